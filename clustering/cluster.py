@@ -1,5 +1,6 @@
 import numpy as np
 import ast
+import json
 import random
 import math
 import sys
@@ -84,19 +85,22 @@ def recomputeCentroid(cluster, docTermMatrix):
 	centroid = np.divide(summation, C)
 	return centroid
 
-def KMeans(K, docs, docTermMatrix):
+def KMeans(K, rows, docTermMatrix):
 	"""Implementation of K-Means clustering algorithm 
 	Args:
 		K: number of clusters
-		doc: (docID, vector index) dictionary
+		rows: number of rows (doc ids) of docTermMatrix to cluster, or a set
+		of row indexes
 		docTermMatrix: document-term matrix
 	Returns:
 		Cluster: object containing final centroids and clusters  
 	"""
 	MAX_ITERATIONS = 20
+	if type(rows) == int:
+		rows = range(rows)
 	centroids = []														# List of centroid vectors 
 	centroidsIdx = []													# List of centroid vector indicies 
-	seeds = selectRandomSeeds(K, len(docs))		# K random indicies 
+	seeds = selectRandomSeeds(K, len(rows))		# K random indicies 
 
 	for s in seeds:
 		centroids.append(docTermMatrix[s])
@@ -114,22 +118,20 @@ def KMeans(K, docs, docTermMatrix):
 	newSSE = finalSSE - 1
 	while i < MAX_ITERATIONS and newSSE < finalSSE:
 		finalSSE = newSSE
-		if type(docs) == set:
-			docs = {a:a for a in docs}
 
 		# Assign documents to a cluster 
-		for j, d in enumerate(docs): 
+		for d in rows: 
 			# Find distance between doc and centroids
 			distances = []
 			for k in centroids:
-				distances.append(getDistance(docTermMatrix[docs[d]], k))
+				distances.append(getDistance(docTermMatrix[d], k))
 			# Reassign vector to closest cluster
-			oldk = getClusterID(docs[d], clusters)
+			oldk = getClusterID(d, clusters)
 			newk = distances.index(max(distances))
 			if oldk != None and oldk != newk:
-				clusters[oldk].remove(docs[d])
+				clusters[oldk].remove(d)
 			if oldk != newk:
-				clusters[newk].add(docs[d])
+				clusters[newk].add(d)
 		SSE = 0
 		# k_SSE = []
 		# Recompute centroid and get SSE
@@ -228,20 +230,21 @@ def main():
 	DOCTERM_MATRIX = inputPath + "docterm-matrix.txt"
 	QUERY_MATRIX = inputPath + "query-matrix.txt"
 	DIMENSIONS = inputPath + "dimensions.txt"
+	DOCS = inputPath + "docs.txt"
 	RESULTS = resultsDir + "results.txt"
 	resultsFile = open(RESULTS, "a+")
 
-	docTermDict = eval(open(DOCTERM_MATRIX, 'r').read())
+	# Rows of the doc-term matrix are doc ids; docnos are only looked up 
+	# to write results
+	docTermMatrix = np.array(json.load(open(DOCTERM_MATRIX, 'r')))
 	queryDict = eval(open(QUERY_MATRIX, 'r').read())
-	docs = sorted(list(docTermDict.keys()))
+	docs = open(DOCS).read().splitlines()	# index: doc id, value: docno
 	queryIDs = sorted(list(queryDict.keys()))
-	docsDict = {k: v for v, k in enumerate(docs)} #k: docID, v: index
 	terms = ast.literal_eval(open(DIMENSIONS).read())
-	docTermMatrix = np.array([docTermDict[i] for i in docs])
 	queryMatrix = np.array([queryDict[i] for i in queryIDs])
 
 	# Cluster document collection
-	clusterComponents = KMeans(K, docsDict, docTermMatrix)
+	clusterComponents = KMeans(K, len(docs), docTermMatrix)
 	centroids = clusterComponents.centroids
 	clusters = clusterComponents.clusters
 
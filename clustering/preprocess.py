@@ -1,43 +1,46 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-import ast
 import json
+import math
 import preprocess_query 
 import sys
 import os
 from time import time
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "preprocessing"))
+import postings
+import segments
+
 def indexToMatrix(inputPath, resultsPath, numDimensions):
 	"""Converts single term inverted index into document-term matrix and query matrix. 
 	Args:
 		inputPath: data input directory path
 		resultsPath: directory where result files will go
 	Returns:
-	  doc-term text file
+	  doc-term text file (row: doc id)
+	  docs text file (line: doc id, docno)
 	  query matrix text file
 	  dimensions text file
 	"""
-	# inverted index format: term df idf cf [posting list])
-	INDEX = inputPath + "single.txt"
-	# document format: docID tf tf_idf
-	DOC = inputPath + "single-docLength.txt"
 	LEXICON = inputPath + "lexicon.txt"
 	QUERY = inputPath + "queries.txt"
 	QUERY_MATRIX = resultsPath + "query-matrix.txt"
 	DOCTERM_MATRIX = resultsPath + "docterm-matrix.txt"
+	DOCS = resultsPath + "docs.txt"
 	DIMENSIONS = resultsPath + "dimensions.txt"
 
-	with open(INDEX) as indexFile, open(DOC) as docFile, open(QUERY) as qFile:
+	# Binary inverted index (see preprocessing/postings.py); posting lists are
+	# decoded only for the terms kept
+	indexFile = postings.LazyIndex(segments.openIndex(inputPath, "single"))
+	with open(QUERY) as qFile:
 		# Convert index to list and filter top n terms with highest idf
 		index = []
 		indexDict = {}
-		for line in indexFile: 
-			term = line.split("\t")[0]
-			idf = float(line.split("\t")[1].split(" ")[1])
-			pList = line.split("\t")[2].replace("\n", "")
-			index.append([term, idf, pList])
-			indexDict[term] = [idf, pList]
+		for term in indexFile: 
+			idf = math.log10(float(indexFile.N) / indexFile[term].df)
+			index.append([term, idf, term])
+			indexDict[term] = [idf, term]
 
 		# Preprocess queries 
 		queryNums = []
@@ -72,8 +75,8 @@ def indexToMatrix(inputPath, resultsPath, numDimensions):
 			if term not in filteredIndexSet and term in indexDict:
 				filteredIndex.append([term, indexDict[term][0], indexDict[term][1]])
 
-		# Create empty doc-term dict to be the doc-term matrix
-		docTermMatrix = {line.split(" ")[0]: [0] * len(filteredIndex) for line in docFile}
+		# Create empty doc-term matrix, one row per doc id
+		docTermMatrix = [[0] * len(filteredIndex) for docno in indexFile.docs]
 		# Create (term: index) dict so weights placed in correct index in matrix
 		termIndex = {k[0]: v for v, k in enumerate(filteredIndex)}
 		indexDict = {}	# (term: idf) dict
@@ -81,14 +84,15 @@ def indexToMatrix(inputPath, resultsPath, numDimensions):
 		for elem in filteredIndex:
 			term = elem[0]
 			idf = elem[1]
-			pList = ast.literal_eval(elem[2])
+			pList = indexFile[elem[2]].pList
 			indexDict[term] = idf
 			for d in pList:
 				docID = d[0]
-				tf = int(d[1])
+				tf = d[1]
 				termIdx = termIndex[term]
 				docTermMatrix[docID][termIdx] = tf * idf
 
+		docnos = indexFile.docs
 		queryMatrix = {num: [0] * len(filteredIndex) for num in queryNums}
 		for qIdx, q in enumerate(queries):
 			query = preprocess_query.parse(q, "single")	# (term: tf) dict 
@@ -99,9 +103,12 @@ def indexToMatrix(inputPath, resultsPath, numDimensions):
 					tf = query[term]
 					idf = indexDict[term]
 					queryMatrix[queryID][termIdx] = tf * idf
+	indexFile.close()
 
-	with open(DOCTERM_MATRIX ,"w+") as f3, open(QUERY_MATRIX, "w+") as f4, open(DIMENSIONS, "w+") as f5:
+	with open(DOCTERM_MATRIX ,"w+") as f3, open(QUERY_MATRIX, "w+") as f4, open(DIMENSIONS, "w+") as f5, \
+		open(DOCS, "w+") as f6:
 		f3.write(json.dumps(docTermMatrix))
+		f6.write("\n".join(docnos) + "\n")
 		f4.write(json.dumps(queryMatrix))
 		f5.write(str(list(termIndex.keys())))
 
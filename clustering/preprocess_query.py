@@ -13,50 +13,8 @@ from bs4 import BeautifulSoup
 from string import punctuation
 from nltk.stem.porter import *
 
-def normalizeDate(match):
-	"""Change date tokens to MM-DD-YYYY format.
-	Args:
-	    match: tokens that match date regex in findSpecialTokens.
-	Returns:
-	    formated date string  
-	"""
-	months = {"Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6, "Jul": 7, 
-	"Aug": 8, "Sep": 9,  "Oct": 10, "Nov": 11, "Dec": 12, "January": 1,  "February": 2, 
-	"March": 3, "April": 4, "May": 5, "June": 6, "July": 7, "August": 8, 
-	"September": 9, "October": 10, "November": 11, "December": 12}
-	month30Day = set([4, 6, 9, 11])
-	month31Day = set([1, 3, 5, 7, 8, 10, 12])
-
-	# Date format: Month Name DD, YYY 
-	if match[0] != '':
-		month = months[match[0].replace(".", "")]
-		day = int(match[1])
-		year = int(match[2])
-
-	# Date format: MM/DD/YYYY || MM-DD-YYYY
-	elif match[3] != '':
-		month = int(match[4])
-		day = int(match[5])
-		year = int(match[6])
-
-	# Rule out invalid dates
-	if (month < 1 or month > 12) or (month == 2 and (day < 1 or day > 29)) or \
-		(month in month30Day and (day < 1 or day > 30)) or \
-		(month in month31Day and (day < 1 or day > 31)):
-			return
-
-	# Change YY to YYYY
-	if len(str(year)) == 2:
-		if year < 19:
-			year = int('20' + str(year))
-		else:
-			year = int('19' + str(year))
-	if year < 1918 or year > 2018:
-		return
-
-	month = str(month) if len(str(month)) == 2 else '0' + str(month)
-	day = str(day) if len(str(day)) == 2 else '0' + str(day)
-	return (month + '-' + day + '-' + str(year))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "preprocessing"))
+import tokenizer
 
 def normalize(token):
 	"""Perform case folding and punctuation stripping.
@@ -85,97 +43,16 @@ def replaceEscSeq(line):
 	return line
 
 def findSpecialTokens(query, stops):
-	"""Identify special tokens using regular expressions. If match, 
-		normalize token, add to parsed query list, and remove from query. 
+	"""Identify special tokens (see tokenizer.scanSpecialTokens). Normalized 
+		tokens are added to the parsed query list and removed from query. 
 	Args:
 	    query: query string
 	    stops: list of stop words 
 	Returns:
 	    query with special token removed
 	"""
-	# Email 
-	email = re.compile(r'([a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+)')
-	if len(email.findall(query)) > 0:
-		for token in email.findall(query):
-			token = normalize(token)
-			parsedQuery.append(token)
-		query = email.sub('', query)
-
-	# IP Address
-	ip = re.compile(r'\b(?:\d{2,3}\.){3}\d{2,3}\b')
-	if len(ip.findall(query)) > 0:
-		for token in ip.findall(query):
-			token = normalize(token)
-			parsedQuery.append(token)
-		query = ip.sub('', query)
-
-	# Abbreviations and Acronyms
-	abbrev = re.compile(r'\b[A-Z][a-zA-Z\.]{,1}[A-Z]\b\.?')
-	if len(abbrev.findall(query)) > 0:
-		for token in abbrev.findall(query):
-			token = normalize(token)
-			token = normalize(token).replace('.', '')
-			parsedQuery.append(token)
-		query = abbrev.sub('', query)
-
-	# Date 
-	date = re.compile(r'(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sept|Oct|Nov|Dec[.]?|January|February|March|April|May|June|July|August|September|October|November|December)\s(\d+),\s(\d+)|((\d+)(?:/|-)(\d+)(?:/|-)(\d+))')
-	if len(date.findall(query)) > 0:
-		for token in date.findall(query):
-			token = normalizeDate(token)
-			if token != None:
-				parsedQuery.append(token)
-		query = date.sub('', query)
-
-	# Decimal and Currency
-	decimal = re.compile(r'(§|\$)*(\d+\.\d+)')
-	if len(decimal.findall(query)) > 0:
-		for token in decimal.findall(query):
-			token = token[0] + str(int(round(float(token[1]))))
-			parsedQuery.append(token)
-		query = decimal.sub('', query)
-
-	#Hyphenated, Alpha-Digit, and Digit-Alpha terms
-	hyphen = re.compile(r'(((\w+)-)+(\w+))')
-	prefixes = set(['a', 'an', 'ante', 'anti', 'auto', 'circum', 'co', 'com',
-	'con', 'contra', 'de', 'dis', 'en', 'ex', 'extra', 'hetero', 'homo', 
-	'inter', 'intra','kilo', 'macro', 'micro', 'milli', 'non', 'pico', 'pseudo',
-	'pre', 'post', 're', 'sub', 'syn', 'trans', 'tri', 'un', 'uni', 'ultra'])
-
-	if len(hyphen.findall(query)) > 0:
-		for token in hyphen.findall(query):
-			token = normalize(token[0])
-			split = token.split("-")
-			if len(split) == 2 and split[0].isalpha() and split[1].isdigit():
-				# Requirement: alphabets stored as a separate term if 3+ letters
-				if len(split[0]) >= 3:
-					parsedQuery.append(normalize(split[0]))
-			elif len(split) == 2 and split[0].isdigit() and split[1].isalpha():
-				if len(split[1]) >= 3:
-					parsedQuery.append(normalize(split[1]))
-			elif split[0] in prefixes:
-				parsedQuery.append(normalize(split[1]))	
-			else: 
-				for s in split:
-						if s not in stops: 
-							parsedQuery.append(s)
-			token = token.replace("-", "")
-			parsedQuery.append(token)
-		query = hyphen.sub('', query)
-
-	# URL
-	url = re.compile(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+')
-	if len(url.findall(query)) > 0: 
-		for token in url.findall(query):
-			parsedQuery.append(token)
-		query = url.sub('', query)
-
-	# File Extension
-	fileext = re.compile(r'(\w*)\.(jpg|JPG|gif|GIF|doc|DOC|pdf|PDF|html|HTML)')
-	if len(fileext.findall(query)) > 0: 
-		for token in fileext.findall(query):
-			parsedQuery.append(token)
-		query = fileext.sub('', query)
+	tokens, query = tokenizer.scanSpecialTokens(query, stops)
+	parsedQuery.extend(tokens)
 	return query
 
 def loadStops():
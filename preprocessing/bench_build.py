@@ -0,0 +1,312 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import re
+import shutil
+import sys
+import tempfile
+import time
+import bounds
+import impacts
+import build
+import postings
+import runs
+import stems
+import trec
+
+PHASES = ["parse", "tokenize", "run write", "sort", "merge", "index write", "other"]
+# The assignment's memory constraints, in triples
+BUDGETS = "1000,10000,100000"
+# Relative slowdown (or growth in RSS and output size) reported as a regression
+TOLERANCE = 0.2
+# Phases shorter than this in the baseline are too noisy to compare
+MIN_PHASE_WALL = 0.05
+DOCNO = re.compile(rb"<DOCNO>\s*(.*?)\s*</DOCNO>", re.DOTALL)
+REPORT = re.compile(r"^(Runs|Merge passes) \(\w*\):\s+(\d+)$", re.MULTILINE)
+
+class PhaseClock:
+	"""Charges wall and CPU time to build phases. Phases nest: time spent in
+	an inner phase (a spill inside addDocument, the merge feeding the index
+	writer) is not charged to the phase it was entered from."""
+
+	def __init__(self):
+		self.wall = dict.fromkeys(PHASES, 0.0)
+		self.cpu = dict.fromkeys(PHASES, 0.0)
+		self.stack = ["other"]
+		self.lastWall = time.perf_counter()
+		self.lastCpu = time.process_time()
+
+	def charge(self):
+		wall = time.perf_counter()
+		cpu = time.process_time()
+		self.wall[self.stack[-1]] += wall - self.lastWall
+		self.cpu[self.stack[-1]] += cpu - self.lastCpu
+		self.lastWall = wall
+		self.lastCpu = cpu
+
+	def enter(self, phase):
+		self.charge()
+		self.stack.append(phase)
+
+	def exit(self):
+		self.charge()
+		self.stack.pop()
+
+	def timed(self, phase, function):
+		"""Wraps function so that its calls are charged to phase."""
+		def wrapper(*args, **kwargs):
+			self.enter(phase)
+			try:
+				return function(*args, **kwargs)
+			finally:
+				self.exit()
+		return wrapper
+
+	def timedIterator(self, phase, iterator):
+		"""Yields the items of iterator, charging the time taken to produce
+		each one to phase."""
+		iterator = iter(iterator)
+		while True:
+			self.enter(phase)
+			try:
+				item = next(iterator)
+			except StopIteration:
+				return
+			finally:
+				self.exit()
+			yield item
+
+def instrument(clock, counts):
+	"""Patches the builder's stages to charge their time to clock. Only
+	called in the throwaway process that runs one benchmark build.
+	Args:
+	    counts: dict that receives the number of documents parsed
+	"""
+	readTrecDocs = trec.readTrecDocs
+	def timedReadTrecDocs(path):
+		for doc in clock.timedIterator("parse", readTrecDocs(path)):
+			counts["docs"] += 1
+			yield doc
+	trec.readTrecDocs = timedReadTrecDocs
+
+	for name in ("replaceEscSeq", "countTokens", "countPhrases"):
+		setattr(build, name, clock.timed("tokenize", getattr(build, name)))
+	for name in ("addDocument", "reserve", "close"):
+		setattr(runs.RunWriter, name, clock.timed("run write", getattr(runs.RunWriter, name)))
+	# A spill sorts the run, then writes it
+	runs.RunWriter.spill = clock.timed("sort", runs.RunWriter.spill)
+	runs.writeArrays = clock.timed("run write", runs.writeArrays)
+
+	sortAndMerge = build.sortAndMerge
+	def timedSortAndMerge(*args, **kwargs):
+		docs, merged = sortAndMerge(*args, **kwargs)
+		return docs, clock.timedIterator("merge", merged)
+	build.sortAndMerge = clock.timed("merge", timedSortAndMerge)
+	build.writeIndex = clock.timed("index write", build.writeIndex)
+	stems.writeTable = clock.timed("index write", stems.writeTable)
+	bounds.writeBounds = clock.timed("index write", bounds.writeBounds)
+	impacts.writeImpacts = clock.timed("index write", impacts.writeImpacts)
+
+def outputBytes(outputDir):
+	"""Bytes of the indexes, their sidecars and the lexicons of a build."""
+	total = 0
+	for root, dirs, files in os.walk(outputDir):
+		if os.path.basename(root) == "temp":
+			continue
+		total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+	return total
+
+def runBuild(corpusDir, stopsPath, indexType, triples, workDir):
+	"""Builds one index with build.main() and measures it. Runs in a fresh
+	process, so that peak RSS is the build's own.
+	Args:
+	    triples: triple budget, or None for unlimited
+	Returns:
+	    result dict (see main)
+	"""
+	shutil.copy(stopsPath, os.path.join(workDir, "stops.txt"))
+	os.chdir(workDir)
+	outputDir = os.path.join(workDir, "output") + "/"
+	sys.argv = ["build.py", corpusDir, indexType, outputDir]
+	if triples != None:
+		sys.argv += ["--triples", str(triples)]
+
+	report = io.StringIO()
+	start = time.perf_counter()
+	startCpu = time.process_time()
+	clock = PhaseClock()
+	counts = {"docs": 0}
+	instrument(clock, counts)
+	with contextlib.redirect_stdout(report):
+		build.main()
+	clock.charge()
+	wall = time.perf_counter() - start
+	cpu = time.process_time() - startCpu
+
+	stats = postings.IndexStats(postings.statsPath(postings.indexPath(outputDir + "indexes",
+		indexType)))
+	reported = dict(REPORT.findall(report.getvalue()))
+	result = {"indexType": indexType, "triples": triples, "docs": counts["docs"],
+		"tokens": stats.totalTf, "runs": int(reported["Runs"]),
+		"mergePasses": int(reported["Merge passes"]), "outputBytes": outputBytes(outputDir),
+		"peakRSS": runs.peakRSS()}
+	result.update(rates(wall, cpu, result))
+	result["phases"] = {phase: rates(clock.wall[phase], clock.cpu[phase], result)
+		for phase in PHASES}
+	return result
+
+def rates(wall, cpu, result):
+	return {"wall": wall, "cpu": cpu,
+		"docsPerSec": result["docs"] / wall if wall > 0 else None,
+		"tokensPerSec": result["tokens"] / wall if wall > 0 else None}
+
+def scaleCorpus(corpusDir, scale, scaledDir):
+	"""Writes a corpus scale times the size of corpusDir, by copying each
+	TREC file scale times with the docnos of every copy but the first
+	suffixed. The vocabulary does not grow with the copies, so this scales
+	the number of postings, not of terms.
+	Returns:
+	    path of the scaled corpus directory
+	"""
+	os.makedirs(scaledDir)
+	for name in sorted(os.listdir(corpusDir)):
+		with open(os.path.join(corpusDir, name), "rb") as f:
+			data = f.read()
+		for copy in range(scale):
+			suffix = "-S%d" % copy
+			text = data if copy == 0 else DOCNO.sub(
+				lambda m: b"<DOCNO> " + m.group(1) + suffix.encode() + b" </DOCNO>", data)
+			with open(os.path.join(scaledDir, name + (suffix if copy else "")), "wb") as f:
+				f.write(text)
+	return scaledDir
+
+def measure(corpusDir, stopsPath, indexType, triples, scale, repeat):
+	"""Runs one configuration repeat times, each in a new process.
+	Returns:
+	    the result of the fastest run
+	"""
+	context = multiprocessing.get_context("spawn")
+	best = None
+	for i in range(repeat):
+		workDir = tempfile.mkdtemp(prefix="bench-build-")
+		try:
+			with context.Pool(1) as pool:
+				result = pool.apply(runBuild, (corpusDir, stopsPath, indexType, triples, workDir))
+		finally:
+			shutil.rmtree(workDir)
+		if best == None or result["wall"] < best["wall"]:
+			best = result
+	best["scale"] = scale
+	return best
+
+def key(result):
+	return (result["indexType"], result["triples"], result["scale"])
+
+def compare(results, baseline, tolerance):
+	"""Compares results with a baseline run of the same configurations.
+	Returns:
+	    list of regressions, one line each
+	"""
+	previous = {key(r): r for r in baseline["results"]}
+	regressions = []
+	for result in results:
+		old = previous.get(key(result))
+		if old == None:
+			continue
+		name = "{} triples={} scale={}".format(*key(result))
+		checks = [("wall", old["wall"], result["wall"]),
+			("peakRSS", old["peakRSS"], result["peakRSS"]),
+			("outputBytes", old["outputBytes"], result["outputBytes"])]
+		for phase in PHASES:
+			if old["phases"][phase]["wall"] >= MIN_PHASE_WALL:
+				checks.append((phase + " wall", old["phases"][phase]["wall"],
+					result["phases"][phase]["wall"]))
+		for metric, before, after in checks:
+			if before > 0 and after > before * (1 + tolerance):
+				regressions.append("{}: {} {:.4g} -> {:.4g} (+{:.0%})".format(name, metric,
+					before, after, after / before - 1))
+	return regressions
+
+def printResult(result):
+	print("{:<12}{:>8}{:>4}x{:>9.3f} s{:>9.0f} docs/s{:>10.0f} tokens/s{:>8.1f} MB{:>6} runs"
+		"{:>3} passes{:>8.1f} MB out".format(result["indexType"],
+		result["triples"] if result["triples"] != None else "-", result["scale"], result["wall"],
+		result["docsPerSec"], result["tokensPerSec"], result["peakRSS"] / build.MB,
+		result["runs"], result["mergePasses"], result["outputBytes"] / build.MB))
+	print("    " + "  ".join("{} {:.3f}/{:.3f}".format(phase, result["phases"][phase]["wall"],
+		result["phases"][phase]["cpu"]) for phase in PHASES))
+
+def main():
+	# python3 bench_build.py [trec-files-directory-path] [stops-file]
+	# python3 bench_build.py ../data/ ../data/stops.txt --baseline bench-build-baseline.json
+	parser = argparse.ArgumentParser(description="Benchmarks index builds per phase")
+	parser.add_argument("trecFileDirPath", help="directory containing the raw documents")
+	parser.add_argument("stops", help="stop word file")
+	parser.add_argument("--types", default=",".join(build.INDEX_TYPES),
+		help="comma-separated index types to build")
+	parser.add_argument("--triples", default=BUDGETS,
+		help="comma-separated triple budgets, 'unlimited' for none (default: %(default)s)")
+	parser.add_argument("--scale", default="1",
+		help="comma-separated corpus scale factors, e.g. 1,4 (default: %(default)s)")
+	parser.add_argument("--repeat", type=int, default=1,
+		help="builds per configuration; the fastest is kept")
+	parser.add_argument("--output", default="bench-build.json", help="JSON results file")
+	parser.add_argument("--baseline",
+		help="JSON results to compare with; written from this run if it does not exist")
+	parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+		help="relative growth reported as a regression (default: %(default)s)")
+	args = parser.parse_args()
+	corpusDir = os.path.abspath(args.trecFileDirPath) + "/"
+	stopsPath = os.path.abspath(args.stops)
+	indexTypes = args.types.split(",")
+	for indexType in indexTypes:
+		if indexType not in build.INDEX_TYPES:
+			parser.error("unknown index type: " + indexType)
+	budgets = [None if t == "unlimited" else int(t) for t in args.triples.split(",")]
+	scales = [int(s) for s in args.scale.split(",")]
+
+	results = []
+	for scale in scales:
+		scaledDir = None
+		scaledCorpus = corpusDir
+		if scale > 1:
+			scaledDir = tempfile.mkdtemp(prefix="bench-corpus-")
+			scaledCorpus = scaleCorpus(corpusDir, scale, scaledDir + "/corpus") + "/"
+		try:
+			for indexType in indexTypes:
+				for triples in budgets:
+					result = measure(scaledCorpus, stopsPath, indexType, triples, scale, args.repeat)
+					printResult(result)
+					results.append(result)
+		finally:
+			if scaledDir != None:
+				shutil.rmtree(scaledDir)
+
+	report = {"corpus": corpusDir, "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+		"python": platform.python_version(), "platform": platform.platform(),
+		"cpus": os.cpu_count(), "results": results}
+	with open(args.output, "w") as f:
+		json.dump(report, f, indent=1)
+
+	if args.baseline != None:
+		if not os.path.exists(args.baseline):
+			shutil.copy(args.output, args.baseline)
+			print("Baseline written:   " + args.baseline)
+			return
+		with open(args.baseline) as f:
+			regressions = compare(results, json.load(f), args.tolerance)
+		for regression in regressions:
+			print("REGRESSION: " + regression)
+		print("Regressions:   {}".format(len(regressions)))
+		if regressions:
+			sys.exit(1)
+
+if __name__== "__main__":
+	main()
@@ -0,0 +1,41 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import sys
+from time import time
+import codec
+import postings
+
+def benchmark(indexFile):
+	"""Re-encodes every posting list of an index with each codec and reports
+	the encoded size and decode throughput.
+	Args:
+	    indexFile: path to a binary index file (<index-type>.idx)
+	"""
+	reader = postings.IndexReader(indexFile)
+	streams = [codec.toGaps(reader.rawPostings(t), reader.positional) for t in reader]
+	numPostings = sum(reader.df(t) for t in reader)
+	numInts = sum(len(s) for s in streams)
+	reader.close()
+
+	print("Index: {} ({} terms, {} postings, {} ints)".format(indexFile,
+		len(streams), numPostings, numInts))
+	print("{:<8}{:>12}{:>16}{:>16}{:>16}".format("codec", "MB", "bytes/posting",
+		"decode (s)", "postings/s"))
+	for name, (codecId, encode, decode) in sorted(codec.CODECS.items(), key=lambda c: c[1][0]):
+		encoded = [encode(s) for s in streams]
+		size = sum(len(e) for e in encoded)
+		start_time = time()
+		for i, e in enumerate(encoded):
+			decode(e, len(streams[i]))
+		elapsed = time() - start_time
+		print("{:<8}{:>12.2f}{:>16.2f}{:>16.3f}{:>16.0f}".format(name, size / 1e6,
+			float(size) / numPostings, elapsed, numPostings / elapsed))
+
+def main():
+	# python3 bench_codecs.py [index-file]
+	# python3 bench_codecs.py output/indexes/positional.idx
+	benchmark(sys.argv[1])
+
+if __name__== "__main__":
+	main()
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+from time import time
+import nltk
+import tokenizer
+import trec
+
+def loadLines(trecFileDirPath):
+	"""Collects every non-empty line of every document, as preProcess sees it."""
+	lines = []
+	for f in sorted(os.listdir(trecFileDirPath)):
+		for docID, text in trec.readTrecDocs(trecFileDirPath + f):
+			for line in filter(None, text.splitlines()):
+				lines.append(tokenizer.replaceEscSeq(line))
+	return lines
+
+def checkGolden(lines, stops):
+	"""Checks that the single-pass scanner emits exactly the tokens (and
+	leaves exactly the text) that the pattern-by-pattern cascade does.
+	Returns:
+	    number of lines that differ
+	"""
+	mismatches = 0
+	for line in lines:
+		expected = tokenizer.scanSpecialTokensCascade(line, stops)
+		actual = tokenizer.scanSpecialTokens(line, stops)
+		if actual != expected:
+			mismatches += 1
+			if mismatches <= 10:
+				print("MISMATCH: " + repr(line))
+				print("  cascade:     " + repr(expected))
+				print("  single-pass: " + repr(actual))
+	return mismatches
+
+def checkWordTokens(lines):
+	"""Checks that tokenizer.wordTokens splits every line exactly as
+	nltk.word_tokenize does.
+	Returns:
+	    number of lines that differ
+	"""
+	mismatches = 0
+	for line in lines:
+		expected = nltk.word_tokenize(line)
+		actual = tokenizer.wordTokens(line)
+		if actual != expected:
+			mismatches += 1
+			if mismatches <= 10:
+				print("MISMATCH: " + repr(line))
+				print("  nltk:       " + repr(expected))
+				print("  wordTokens: " + repr(actual))
+	return mismatches
+
+def timeWordTokenizer(name, tokenize, lines):
+	start_time = time()
+	numTokens = 0
+	for line in lines:
+		numTokens += len(tokenize(line))
+	elapsed = time() - start_time
+	print("{:<12}{:>10.3f} s{:>14.0f} lines/s{:>12.0f} tokens/s".format(name, elapsed,
+		len(lines) / elapsed, numTokens / elapsed))
+
+def timeScanner(name, scan, lines, stops):
+	start_time = time()
+	numTokens = 0
+	for line in lines:
+		numTokens += len(scan(line, stops)[0])
+	elapsed = time() - start_time
+	print("{:<12}{:>10.3f} s{:>14.0f} lines/s{:>12.0f} tokens/s".format(name, elapsed,
+		len(lines) / elapsed, numTokens / elapsed))
+
+def main():
+	# python3 bench_tokenizer.py [trec-files-directory-path] [stops-file]
+	# python3 bench_tokenizer.py ../data/ ../data/stops.txt
+	trecFileDirPath = sys.argv[1]
+	if trecFileDirPath[-1] != "/":
+		trecFileDirPath += "/"
+	with open(sys.argv[2]) as f:
+		stops = set([x.strip() for x in f.readlines()])
+
+	lines = loadLines(trecFileDirPath)
+	mismatches = checkGolden(lines, stops)
+	print("Golden check: {} lines, {} mismatches".format(len(lines), mismatches))
+	timeScanner("cascade", tokenizer.scanSpecialTokensCascade, lines, stops)
+	timeScanner("single-pass", tokenizer.scanSpecialTokens, lines, stops)
+
+	wordMismatches = checkWordTokens(lines)
+	print("Phrase word tokens: {} lines, {} mismatches".format(len(lines), wordMismatches))
+	timeWordTokenizer("nltk", nltk.word_tokenize, lines)
+	timeWordTokenizer("wordTokens", tokenizer.wordTokens, lines)
+	mismatches += wordMismatches
+	if mismatches > 0:
+		sys.exit(1)
+
+if __name__== "__main__":
+	main()
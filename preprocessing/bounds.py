@@ -0,0 +1,125 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import struct
+from array import array
+import numpy as np
+import postings
+
+# Score bounds sidecar (<index-type>.bounds), written next to the index for
+# dynamic pruning (see ranking-and-retrieval/query.py maxScore):
+#   header | magic, version, number of terms, N, total tf, BM25 k1 and b
+#   bounds | per term, in dictionary order, float64 max and min over its
+#          | postings of BM25's document part (k1 + 1) tf / (K + tf), and
+#          | float64 max of tf / sqrt(tf-idf norm), cosine's document part
+# A query multiplies them by the term's idf and query weight, which are
+# the same for every document. The bounds hold for the N and total tf in
+# the header; readers with other collection statistics recompute them.
+BOUNDS_MAGIC = b"SEBD"
+BOUNDS_VERSION = 1
+BOUNDS_HEADER = struct.Struct("<4sHIIQdd")
+BOUNDS_SUFFIX = ".bounds"
+# BM25 parameters, shared with query.BM25
+K1 = 1.2
+K2 = 700
+B = 0.75
+# Index types query.py ranks with BM25 and cosine
+INDEX_TYPES = ["single", "stem"]
+
+def boundsPath(indexFile):
+	"""Path of the score bounds sidecar of an index file."""
+	return os.path.splitext(indexFile)[0] + BOUNDS_SUFFIX
+
+def documentParts(tfs, lengths, norms, avgDocLength):
+	"""BM25's and cosine's document parts of postings.
+	Args:
+	    tfs, lengths, norms: float64 arrays of the postings' tfs and their
+	    documents' total tfs and tf-idf norms
+	Returns:
+	    (BM25 parts, cosine parts) arrays
+	"""
+	K = K1 * ((1 - B) + B * (lengths / avgDocLength))
+	with np.errstate(divide="ignore"):
+		# A document whose terms all have idf 0 bounds nothing
+		return ((K1 + 1) * tfs) / (K + tfs), tfs / np.sqrt(norms)
+
+def termBounds(pList, docLength, avgDocLength):
+	"""Bounds of the document parts of a term's scores.
+	Args:
+	    pList: posting list of (doc id, tf, positions)
+	    docLength: dict from doc id to (total tf, tf-idf norm)
+	    avgDocLength: average total tf of the documents with terms
+	Returns:
+	    (max BM25 part, min BM25 part, max cosine part)
+	"""
+	tfs = np.array([tf for docid, tf, positions in pList], dtype=np.float64)
+	lengths = np.array([docLength[docid][0] for docid, tf, positions in pList], dtype=np.float64)
+	norms = np.array([docLength[docid][1] for docid, tf, positions in pList], dtype=np.float64)
+	bm25, cosine = documentParts(tfs, lengths, norms, avgDocLength)
+	return float(bm25.max()), float(bm25.min()), float(cosine.max())
+
+def writeBounds(indexFile):
+	"""Writes the score bounds sidecar of an index with a statistics
+	sidecar, reading every posting list once, a batch of terms at a time
+	(see postings.postingBatches)."""
+	reader = postings.IndexReader(indexFile)
+	lengths = np.frombuffer(reader.stats.lengths, dtype=np.uint32).astype(np.float64)
+	norms = np.frombuffer(reader.stats.norms, dtype=np.float64)
+	N = reader.stats.N
+	totalTf = reader.stats.totalTf
+	path = boundsPath(indexFile)
+	with open(path + postings.TEMP_SUFFIX, "wb") as f:
+		f.write(BOUNDS_HEADER.pack(BOUNDS_MAGIC, BOUNDS_VERSION, len(reader), N, totalTf, K1, B))
+		for terms, starts, docids, tfs in postings.postingBatches(reader):
+			bm25, cosine = documentParts(tfs.astype(np.float64), lengths[docids], norms[docids],
+				totalTf / N)
+			values = np.zeros((len(terms), 3))
+			values[:, 0] = np.maximum.reduceat(bm25, starts[:-1])
+			values[:, 1] = np.minimum.reduceat(bm25, starts[:-1])
+			values[:, 2] = np.maximum.reduceat(cosine, starts[:-1])
+			f.write(values.tobytes())
+	reader.close()
+	os.replace(path + postings.TEMP_SUFFIX, path)
+
+class Bounds:
+	"""Score bounds of the terms of an open index, from its sidecar when it
+	was written for the same collection statistics, else computed from a
+	term's postings the first time it is asked for."""
+
+	def __init__(self, reader, docLength, indexFile=None):
+		"""
+		Args:
+		    reader: postings.IndexReader, segments.SegmentSet or
+		    shards.ShardSet
+		    docLength: dict from doc id to (total tf, tf-idf norm) that
+		    queries score with
+		    indexFile: path of the index file, if reader is one
+		"""
+		self.reader = reader
+		self.docLength = docLength
+		self.N = len(docLength)
+		self.totalTf = sum(length for length, norm in docLength.values())
+		self.avgDocLength = self.totalTf / self.N
+		self.stored = None
+		self.computed = {}
+		if indexFile != None and os.path.exists(boundsPath(indexFile)):
+			with open(boundsPath(indexFile), "rb") as f:
+				data = f.read()
+			magic, version, numTerms, N, totalTf, k1, b = BOUNDS_HEADER.unpack_from(data, 0)
+			if magic == BOUNDS_MAGIC and version == BOUNDS_VERSION and numTerms == len(reader) and \
+				(N, totalTf, k1, b) == (self.N, self.totalTf, K1, B):
+				self.stored = array("d")
+				self.stored.frombytes(data[BOUNDS_HEADER.size:])
+
+	def __getitem__(self, term):
+		"""Returns:
+		    (max BM25 part, min BM25 part, max cosine part) of a term
+		"""
+		if self.stored != None:
+			i = 3 * self.reader.terms[term]
+			return tuple(self.stored[i:i + 3])
+		if term not in self.computed:
+			self.computed[term] = termBounds(self.reader.rawPostings(term), self.docLength,
+				self.avgDocLength)
+		return self.computed[term]
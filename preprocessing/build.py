@@ -1,88 +1,27 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-import timeit
+from time import time
+import argparse
+import multiprocessing
 import os
 import re
+import resource
+import shutil
+import subprocess
 import sys
-import collections
-import heapq
-import ast
-import nltk
-from bs4 import BeautifulSoup
-from string import punctuation
-from nltk.stem.porter import *
-
-def normalizeDate(match):
-	"""Change date tokens to MM-DD-YYYY format.
-	Args:
-	    match: tokens that match date regex in findSpecialTokens.
-	Returns:
-	    formated date string  
-	"""
-	months = {"Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6, "Jul": 7, 
-	"Aug": 8, "Sep": 9,  "Oct": 10, "Nov": 11, "Dec": 12, "January": 1,  "February": 2, 
-	"March": 3, "April": 4, "May": 5, "June": 6, "July": 7, "August": 8, 
-	"September": 9, "October": 10, "November": 11, "December": 12}
-	month30Day = set([4, 6, 9, 11])
-	month31Day = set([1, 3, 5, 7, 8, 10, 12])
-
-	# Date format: Month Name DD, YYY 
-	if match[0] != '':
-		month = months[match[0].replace(".", "")]
-		day = int(match[1])
-		year = int(match[2])
-
-	# Date format: MM/DD/YYYY || MM-DD-YYYY
-	elif match[3] != '':
-		month = int(match[4])
-		day = int(match[5])
-		year = int(match[6])
-
-	# Rule out invalid dates
-	if (month < 1 or month > 12) or (month == 2 and (day < 1 or day > 29)) or \
-		(month in month30Day and (day < 1 or day > 30)) or \
-		(month in month31Day and (day < 1 or day > 31)):
-			return
-
-	# Change YY to YYYY
-	if len(str(year)) == 2:
-		if year < 19:
-			year = int('20' + str(year))
-		else:
-			year = int('19' + str(year))
-	if year < 1918 or year > 2018:
-		return
-
-	month = str(month) if len(str(month)) == 2 else '0' + str(month)
-	day = str(day) if len(str(day)) == 2 else '0' + str(day)
-	return (month + '-' + day + '-' + str(year))
-
-def normalize(token):
-	"""Perform case folding and punctuation stripping.
-	Args:
-	    token: single token
-	Returns:
-	    normalized token 
-	"""
-	token = token.lower()							# Lowercase words
-	token = token.replace(',', '')		# Remove commas 
-	token = token.strip(punctuation)	# Remove punctuation
-	return token
-
-def replaceEscSeq(line):
-	"""Process escape sequences.
-	Args:
-	    line: line from data file data.
-	Returns:
-	    line with "&<seq>; replaced with symbol it represents 
-	"""
-	match = re.search(r'(&[a-z]+;)', line)
-	if match:
-		line = line.replace('&blank;', '&').replace('blank;', '&') \
-		.replace('&cir;','○').replace('&hyph;', '-').replace('&sect;','§') \
-		.replace('&times;', '×').replace('&racute;', 'r')
-	return line
+import itertools
+import bounds
+import impacts
+import journal
+import postings
+import runs
+import segments
+import shards
+import stems
+import trec
+import tokenizer
+from tokenizer import normalize, replaceEscSeq
 
 def addToDict(token, termfreq, position):
 	"""Add term to a temporary dict. Key: term, Value: frequency (+ positions)
@@ -107,364 +46,318 @@ def addToDict(token, termfreq, position):
 		termfreq[token].append(position)
 
 def findSpecialTokens(line, stops, termfreq):
-	"""Identify special tokens using regular expressions. If match, 
-		normalize token, add to dictionary, and remove from line. 
+	"""Identify special tokens (see tokenizer.scanSpecialTokens). Normalized 
+		tokens are added to the dictionary and removed from line. 
 	Args:
 	    line: line in data file 
 	    termfreq: dict
 	Returns:
 	    line with special token removed
 	"""
-	# Email 
-	email = re.compile(r'([a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+)')
-	if len(email.findall(line)) > 0:
-		for token in email.findall(line):
-			token = normalize(token)
-			addToDict(token, termfreq, None)
-		line = email.sub('', line)
-
-	# IP Address
-	ip = re.compile(r'\b(?:\d{2,3}\.){3}\d{2,3}\b')
-	if len(ip.findall(line)) > 0:
-		for token in ip.findall(line):
-			token = normalize(token)
-			addToDict(token, termfreq, None)
-		line = ip.sub('', line)
-
-	# Abbreviations and Acronyms
-	abbrev = re.compile(r'\b[A-Z][a-zA-Z\.]{,1}[A-Z]\b\.?')
-	if len(abbrev.findall(line)) > 0:
-		for token in abbrev.findall(line):
-			token = normalize(token)
-			token = normalize(token).replace('.', '')
-			addToDict(token, termfreq, None)
-		line = abbrev.sub('', line)
-
-	# Date 
-	date = re.compile(r'(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sept|Oct|Nov|Dec[.]?|January|February|March|April|May|June|July|August|September|October|November|December)\s(\d+),\s(\d+)|((\d+)(?:/|-)(\d+)(?:/|-)(\d+))')
-	if len(date.findall(line)) > 0:
-		for token in date.findall(line):
-			token = normalizeDate(token)
-			if token != None:
-				addToDict(token, termfreq, None)
-		line = date.sub('', line)
-
-	# Decimal and Currency
-	decimal = re.compile(r'(§|\$)*(\d+\.\d+)')
-	if len(decimal.findall(line)) > 0:
-		for token in decimal.findall(line):
-			token = token[0] + str(int(round(float(token[1]))))
-			addToDict(token, termfreq, None)
-		line = decimal.sub('', line)
-
-	#Hyphenated, Alpha-Digit, and Digit-Alpha terms
-	hyphen = re.compile(r'(((\w+)-)+(\w+))')
-	prefixes = set(['a', 'an', 'ante', 'anti', 'auto', 'circum', 'co', 'com',
-	'con', 'contra', 'de', 'dis', 'en', 'ex', 'extra', 'hetero', 'homo', 
-	'inter', 'intra','kilo', 'macro', 'micro', 'milli', 'non', 'pico', 'pseudo',
-	'pre', 'post', 're', 'sub', 'syn', 'trans', 'tri', 'un', 'uni', 'ultra'])
-
-	if len(hyphen.findall(line)) > 0:
-		for token in hyphen.findall(line):
-			token = normalize(token[0])
-			split = token.split("-")
-			if len(split) == 2 and split[0].isalpha() and split[1].isdigit():
-				# Requirement: alphabets stored as a separate term if 3+ letters
-				if len(split[0]) >= 3:
-					addToDict(normalize(split[0]), termfreq, None)
-			elif len(split) == 2 and split[0].isdigit() and split[1].isalpha():
-				if len(split[1]) >= 3:
-					addToDict(split[1], termfreq, None)
-			elif split[0] in prefixes:
-				addToDict(split[1], termfreq, None)		
-			else: 
-				for s in split:
-						if s not in stops: 
-							addToDict(s, termfreq, None)
-			token = token.replace("-", "")
-			addToDict(token, termfreq, None)
-		line = hyphen.sub('', line)
-
-	# URL
-	url = re.compile(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+')
-	if len(url.findall(line)) > 0: 
-		for token in url.findall(line):
-			addToDict(token, termfreq, None)
-		line = url.sub('', line)
-
-	# File Extension
-	fileext = re.compile(r'(\w*)\.(jpg|JPG|gif|GIF|doc|DOC|pdf|PDF|html|HTML)')
-	if len(fileext.findall(line)) > 0: 
-		for token in fileext.findall(line):
-			addToDict(token, termfreq, None)
-		line = fileext.sub('', line)
+	tokens, line = tokenizer.scanSpecialTokens(line, stops)
+	for token in tokens:
+		addToDict(token, termfreq, None)
 	return line
 
-def createTriples(termfreq, docid, triples, memory, outputDir):
-	"""Create (term, document id, term frequency) triples
+# Characters that separate tokens of the single, stem and positional indexes
+SEPARATORS = re.compile(r"\s|\$|\^|\*|@|\(|\)|/|○|•|\,|\?|\!|\;|\:|\`|\]|\[|&")
+
+def preProcess(data, runWriters, stops, stemmer=None, shard=None):
+	"""Parses files to identify tokens and their frequency. Each document is
+	read and tokenized once for all the index types being built.
 	Args:
-	    termfreq: dictionary 
-	    docid: document id
-	    triples: list of triples
-	Returns:
-	    triples
+	    data: path to TREC file
+	    runWriters: dict from index type to the runs.RunWriter that receives
+	    that index's triples
+	    stemmer: stems.Stemmer shared across TREC files, for the stem index
+	    shard: (shard, number of shards) to index only the documents of one
+	    shard (see shards.py), or None
 	"""
-	# Unlimited Memory 
-	if memory == "unlimited":
-		for key,value in termfreq.items():
-			triples.append(str(key)+"\t"+str(docid)+"\t"+str(value))
-		return triples
-
-	# Memory Constraint
-	for key,value in termfreq.items():
-		if len(triples) == memory: 
-			writeToDisk(triples, memory, outputDir)
-			triples = []
-		triples.append(str(key)+"\t"+str(docid)+"\t"+str(value))
-	return triples
-
-
-def writeToDisk(triples, memory, outputDir):
-	"""Writes triples to temporary txt files in output-dir/temp/.
+	if stemmer == None and "stem" in runWriters:
+		stemmer = stems.Stemmer()
+	tokenIndexes = set(runWriters) & set(["single", "positional", "stem"])
+
+	for docID, text in trec.readTrecDocs(data):
+		if shard != None and shards.shardOf(docID, shard[1]) != shard[0]:
+			continue
+		for runWriter in runWriters.values():
+			runWriter.reserve(len(text))
+		termfreqs = {indexType: {} for indexType in runWriters}
+		lines = [replaceEscSeq(line) for line in filter(None, text.splitlines())]
+		if tokenIndexes:
+			countTokens(lines, stops, termfreqs, stemmer)
+		if "phrase" in termfreqs:
+			countPhrases(lines, stops, termfreqs["phrase"])
+		for indexType, runWriter in runWriters.items():
+			runWriter.addDocument(docID, termfreqs[indexType])
+
+def countTokens(lines, stops, termfreqs, stemmer):
+	"""Counts the terms of the single, positional and stem indexes of one
+	document. The line is split once for positional and stem; single first
+	takes out special tokens. Stems are looked up once per distinct token.
 	Args:
-	    triples: list of triples
+	    lines: lines of the document, escape sequences replaced
+	    termfreqs: dict from index type to that index's term dict
+	    stemmer: stems.Stemmer if "stem" is in termfreqs
 	"""
-	i = 0
-	tempFileLineCount = 0
-
-	while os.path.exists(outputDir + "/temp/temp%s" % i):
-		i += 1
-
-	if os.path.exists(outputDir + "/temp/temp%s" % str(i - 1)):
-		with open(outputDir + "/temp/temp%s" % str(i - 1), "r") as f:
-		  for j, l in enumerate(f):
-		      pass
-		  tempFileLineCount = j + 1
-		  if tempFileLineCount < memory:
-		  	tempFile = open(outputDir + "/temp/temp%s" % str(i - 1), "a") 
-		  else:
-		  	tempFile = open(outputDir + "/temp/temp%s" % i, "w")	
-	else:
-		tempFile = open(outputDir + "/temp/temp%s" % i, "w")	
-
-	for t in triples:
-		if tempFileLineCount < memory: 
-			tempFile.write(str(t)+"\n")
-		else:
-			tempFile = open(outputDir + "/temp/temp%s" % i, "w")
-			tempFileLineCount = 0
-			tempFile.write(str(t)+"\n")
-		tempFileLineCount += 1
-	tempFile.close()
-
-def preProcess(data, triples, stops, indexType, memory, outputDir):
-	"""Parses files to identify tokens and their frequency.
-	Args:
-	    data: TREC file
-	"""
-	if memory != "unlimited":
-		triples = [] 
-
-	soup = BeautifulSoup(data, "lxml")
-	doc = soup.find_all('doc')
-
-	if (indexType == "stem"):
-		stemmer = PorterStemmer()
-
-	for d in doc:
-		termfreq = {}
-		position = 0 
-		docID = d.find('docno').text.strip()
-		text = d.find('text').text
-
-		lines = list(filter(None, text.splitlines()))
-		for i, line in enumerate(lines):
-			line = replaceEscSeq(line)
-			if indexType == "single": 
-				line = findSpecialTokens(line, stops, termfreq)  
+	single = termfreqs.get("single")
+	positional = termfreqs.get("positional")
+	stem = termfreqs.get("stem")
+	unstemmed = {}
+	position = 0 
+	for line in lines:
+		if single is not None:
+			rest = findSpecialTokens(line, stops, single)
 			# tokens = nltk.word_tokenize(line)
-			tokens = re.split("\s|\$|\^|\*|@|\(|\)|/|○|•|\,|\?|\!|\;|\:|\`|\]|\[|&", line)
-			tokens = list(filter(None, tokens))
-			for token in tokens:
+			for token in filter(None, SEPARATORS.split(rest)):
 				token = normalize(token)
-				if indexType == "single" and (token not in stops and token != ''):
-					addToDict(token, termfreq, None)
-				elif indexType == "positional" and token != '':
-					position += 1
-					addToDict(token, termfreq, position)	
-				elif indexType == "stem" and (token not in stops and token != ''):
-					token = stemmer.stem(token)
-					addToDict(token, termfreq, None)
-		triples = createTriples(termfreq, docID, triples, memory, outputDir)
-	if memory != "unlimited":
-		writeToDisk(triples, memory, outputDir)
-	return triples
+				if token not in stops and token != '':
+					addToDict(token, single, None)
+		if positional is None and stem is None:
+			continue
+		for token in filter(None, SEPARATORS.split(line)):
+			token = normalize(token)
+			if token == '':
+				continue
+			if positional is not None:
+				position += 1
+				addToDict(token, positional, position)	
+			if stem is not None and token not in stops:
+				addToDict(token, unstemmed, None)
+	for token, tf in unstemmed.items():
+		token = stemmer.stem(token)
+		stem[token] = stem.get(token, 0) + tf
+
+# Tokens that end a phrase, besides stop words
+SYMBOLS = set([",","(", ")", ".", "?", "!", "'", ";", "...", " ", "", ":", "",
+	"-", "@","$","^","*","@","/", "○", "•", "``", "''", "&", "[", "]", "%", "#"])
 
 def isPhrase(stops, token):
 	"""Checks that token is not a symbol or stop word.
 	Args:
 	    data: TREC file
 	"""
-	symbol = set([",","(", ")", ".", "?", "!", "'", ";", "...", " ", "", ":", "",
-		"-", "@","$","^","*","@","/", "○", "•", "``", "''", "&", "[", "]", "%", "#"])
-	if token not in stops and token not in symbol:
-		return True
-	return False
-
-def preProcessPhrase(data, triples, stops, indexType, memory, outputDir):
-	"""Parses files to identify two/three-word phrases.
+	return token not in stops and token not in SYMBOLS
+
+def countPhrases(lines, stops, termfreq):
+	"""Counts the two/three-word phrases of one document: consecutive tokens
+	(see tokenizer.wordTokens) that are neither stop words nor symbols. A
+	line's last two tokens only start phrases that continue on the next line,
+	and lines of fewer than three tokens have no phrases of their own.
 	Args:
-	    data: TREC file
+	    lines: lines of the document, escape sequences replaced
+	    termfreq: dict
 	"""
-	if memory != "unlimited":
-		triples = []
-	soup = BeautifulSoup(data, "lxml")
-	doc = soup.find_all('doc')
-
-	for d in doc:
-		termfreq = {}
-		position = 0 
-		docID = d.find('docno').text.strip()
-		text = d.find('text').text
-
-		lastTwo = []
-		lines = list(filter(None, text.splitlines()))
-		for i, line in enumerate(lines):
-			line = replaceEscSeq(line)
-			tokens = nltk.word_tokenize(line)
-			tokens = list(filter(None, tokens))
-			tokens = [x.lower() for x in tokens]
-
-			# Handle edge case: phrase on two lines
-			if isPhrase(stops, tokens[0]):
-				if len(lastTwo) == 2:
-					phrase = " ".join(lastTwo) + " " + tokens[0]
-					phrase = phrase
-					addToDict(phrase, termfreq, None)
-				if len(lastTwo) == 1:
-					phrase = lastTwo[0] + " " + tokens[0]
-					phrase = phrase
-					addToDict(phrase, termfreq, None)
-			if len(tokens) > 1 and isPhrase(stops, tokens[0]) and isPhrase(stops, tokens[1]):
-				if len(lastTwo) == 2:
-					phrase = lastTwo[1] + " " + tokens[0] + " " + tokens[1]
-					phrase = phrase
-					addToDict(phrase, termfreq, None)
-				if len(lastTwo) == 1:
-					phrase = lastTwo[0] + " " + tokens[0] + " " + tokens[1]
-					phrase = phrase
-					addToDict(phrase, termfreq, None)
+	lastTwo = []
+	for line in lines:
+		tokens = [x.lower() for x in tokenizer.wordTokens(line)]
+		if not tokens:
+			lastTwo = []
+			continue
+		words = [isPhrase(stops, token) for token in tokens]
+
+		# Handle edge case: phrase on two lines
+		if words[0]:
+			if len(lastTwo) == 2:
+				addToDict(" ".join(lastTwo) + " " + tokens[0], termfreq, None)
+			if len(lastTwo) == 1:
+				addToDict(lastTwo[0] + " " + tokens[0], termfreq, None)
+			if lastTwo and len(tokens) > 1 and words[1]:
+				addToDict(lastTwo[-1] + " " + tokens[0] + " " + tokens[1], termfreq, None)
+
+		for i in range(len(tokens) - 2):
+			if words[i] and words[i + 1]:
+				bigram = tokens[i] + " " + tokens[i + 1]
+				addToDict(bigram, termfreq, None)
+				if words[i + 2]:
+					addToDict(bigram + " " + tokens[i + 2], termfreq, None)
+
+		if len(tokens) > 1 and words[-2] and words[-1]:
+			lastTwo = tokens[-2:]
+		elif words[-1]:
+			lastTwo = tokens[-1:]
+		else:
 			lastTwo = []
 
-			i = j = 0
-			phrase = ""
-			while i < len(tokens) - 2:
-				while (j - i) < 3 and isPhrase(stops, tokens[j]):
-					phrase += tokens[j] + " "
-					if j - i >= 1:
-						phrase = phrase
-						addToDict(phrase[:-1], termfreq, None)
-					j += 1
-				if (j - i) < 3:
-					i = j = j + 1
-				else:
-					i = j = i + 1
-				phrase = ""
-			if len(tokens) > 1 and isPhrase(stops, tokens[-2]) and isPhrase(stops, tokens[-1]):
-				lastTwo.append(tokens[-2])
-				lastTwo.append(tokens[-1])
-			elif isPhrase(stops, tokens[-1]):
-				lastTwo.append(tokens[-1])
-		triples = createTriples(termfreq, docID, triples, memory, outputDir)
-	if memory != "unlimited":
-		writeToDisk(triples, memory, outputDir)
-	return triples
-	#364039 # of triples
+INDEX_TYPES = ["single", "stem", "positional", "phrase"]
+# Maximum number of temp files merged at once
+FAN_IN = 64
+UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+MB = float(1 << 20)
 
-def sortAndMerge(outputDir):
-	"""Implements sort/merge-based index construction
+def parseMemory(value):
+	"""Parses a --memory value.
+	Args:
+	    value: "unlimited", or a byte count with an optional unit (256MB, 1.5G)
+	Returns:
+	    "unlimited" or number of bytes
+	"""
+	if value == "unlimited":
+		return value
+	match = re.match(r'^(\d+(?:\.\d+)?)\s*([KMG]?)B?$', value.strip(), re.IGNORECASE)
+	if not match:
+		raise argparse.ArgumentTypeError("invalid memory size: " + value)
+	return int(float(match.group(1)) * UNITS[match.group(2).upper()])
+
+def newRunWriter(indexType, memory, outputDir, runPrefix="", triples=None, capacity=None):
+	"""Creates the run generator for an index build.
+	Args:
+	    memory: bytes this process may use, or "unlimited"
+	    runPrefix: file name prefix, unique per worker process
+	    triples: most triples buffered before a run is spilled, or None
+	    capacity: triples the buffers hold within memory, see
+	    runs.bufferCapacity()
+	"""
+	return runs.RunWriter(outputDir + "temp", runPrefix, positional=(indexType == "positional"),
+		memory=None if memory == "unlimited" else memory, maxTriples=triples, capacity=capacity)
+
+def newRunWriters(indexTypes, memory, outputDir, runPrefix="", triples=None, capacity=None):
+	"""Creates one run generator per index type. Their runs are kept apart
+	by prefixing them with the index type when more than one is built.
+	Args:
+	    memory: bytes this process may use, or "unlimited"
+	    runPrefix: file name prefix, unique per worker process
+	    triples: most triples each run generator buffers, or None
+	    capacity: triples the buffers hold within memory, see
+	    runs.bufferCapacity()
+	Returns:
+	    dict from index type to runs.RunWriter
+	"""
+	if len(indexTypes) == 1:
+		return {indexTypes[0]: newRunWriter(indexTypes[0], memory, outputDir, runPrefix, triples,
+			capacity)}
+	return {indexType: newRunWriter(indexType, memory, outputDir, runPrefix + indexType + "-",
+		triples, capacity) for indexType in indexTypes}
+
+def buildRuns(trecFile, stops, indexTypes, memory, outputDir, triples=None, shard=None,
+	capacity=None):
+	"""Worker for --workers: turns one TREC file into sorted runs.
+	Args:
+	    trecFile: path to TREC file
+	Returns:
+	    (dict from index type to the name of the run manifest written, stem
+	    table of the file or None)
+	"""
+	runWriters = newRunWriters(indexTypes, memory, outputDir, os.path.basename(trecFile) + "-",
+		triples, capacity)
+	stemmer = stems.Stemmer(record=True) if "stem" in indexTypes else None
+	preProcess(trecFile, runWriters, stops, stemmer, shard)
+	return {indexType: runWriter.close() for indexType, runWriter in runWriters.items()}, \
+		stemmer.table if stemmer != None else None
+
+def fileRuns(args):
+	"""buildRuns() for Pool.imap_unordered.
+	Returns:
+	    (TREC file, manifests, stem table)
 	"""
-	if os.path.exists(outputDir + "temp/.DS_Store"):
-		os.remove(outputDir + "temp/.DS_Store")
-
-	# Sort temp files by term and document id 
-	for f in os.listdir(outputDir + "/temp/"):
-		lines = open(outputDir + "/temp/" + f, "r")
-		sorted_file = sorted(lines, key=lambda line: (line.split()[0], line.split()[1]))
-		with open(outputDir + "/temp/" + f, "w") as f:
-			f.writelines(sorted_file)
-	
-	#M-way merge of intermediate files
-	heap = [] 
-	out = open(outputDir + "/merged-triples.txt", "w")
-
-	# Received OSError: [Errno 24] Too many open files because 
-	# my max number of open files limit was too low. To configure, 
-	# run "ulimit -n <limit>"
-	files = [open(outputDir + "/temp/" + f) for f in os.listdir(outputDir + "/temp")]
-
-	# Use priority queue to find min triple among all files 
-	while len(files) > 0:
-		for f in files: 
-			line = f.readline()
-			line = line.replace('\n', '')
-			if line == "":
-				files.remove(f)
-			else:
-				heapq.heappush(heap, line)
-		out.write(heapq.heappop(heap) + "\n")
-	while heap:
-		out.write(heapq.heappop(heap) + "\n")
-
-def buildInvertedIndex(indexType, triples, memory, outputDir):
-	"""Converts list of triples to inverted index
+	return (args[0],) + buildRuns(*args)
+
+def sortAndMerge(outputDir, manifests, fanIn=FAN_IN, memory="unlimited", indexType="",
+	progress=None):
+	"""Implements sort/merge-based index construction. Runs are already
+	sorted by their generator; they are merged at most fanIn at a time, and
+	while more than fanIn remain, groups of them are merged into larger runs.
+	The last pass is not written to disk.
+	Args:
+	    manifests: run manifest names, in the order documents are numbered
+	    fanIn: maximum number of runs open at once
+	    memory: bytes this process may use, or "unlimited"
+	    indexType: names the intermediate runs and the report lines
+	    progress: journal.Journal that records each merged group, and from
+	    whose last pass the merge resumes, or None
+	Returns:
+	    (docnos in doc id order, iterator over (term, doc ids, tfs, positions)
+	    in term order)
 	"""
-	index = {}
-	indexFile = open(outputDir + "/indexes/" + indexType + ".txt", "w")
-	lexiconFile = open(outputDir + "/lexicon.txt", "w")
-
-	if memory == "unlimited":
-		for t in triples:
-			t = t.split("\t")
-			if t[0] not in index:
-				index[t[0]] = []
-			index[t[0]].append([t[1], t[2].replace("\n", "")])
-		for key, value in sorted(index.items()):
-			indexFile.write(str(key) + " -> " + str(value) + "\n")
-			lexiconFile.write(str(key) + "\n")
-		indexFile.close()
-		lexiconFile.close()
-
-	else: 
-		triples = open(outputDir + "/merged-triples.txt", "r")
-		for t in triples.readlines():
-			t = t.split("\t")
-			if t[0] not in index:
-				index[t[0]] = []
-			index[t[0]].append([t[1], t[2].replace("\n", "")])
-
-			if len(index) == memory:
-				# Write all but last term in dictionary to file in case 
-				# additional triples are part of last term's posting list
-				for key, value in sorted(index.items())[:-1]:
-					indexFile.write(str(key) + " -> " + str(value) + "\n")
-					lexiconFile.write(str(key) + "\n")
-					del index[key]
-		for key, value in sorted(index.items()):
-			indexFile.write(str(key) + " -> " + str(value) + "\n")
-			lexiconFile.write(str(key) + "\n")
-		indexFile.close()
-		lexiconFile.close()
-
-	if indexType == "phrase":
-		filteredFile = open(outputDir + "/indexes/" + indexType + "-filtered.txt", "w")
-		unfilteredFile = open(outputDir + "/indexes/" + indexType + ".txt", "r")
-		for line in unfilteredFile.readlines():
-			posting_list = ast.literal_eval(line.split(" -> ")[1])
-			if len(posting_list) > 1:
-				filteredFile.write(line)
-		filteredFile.close()
-		unfilteredFile.close()
+	tempDir = outputDir + "temp/"
+	docs, sortedRuns = runs.loadManifests(tempDir, manifests)
+	chunk = runs.CHUNK
+	if memory != "unlimited":
+		# Split what is left of the budget between the open runs' read
+		# buffers, leaving half for the merged posting lists
+		numOpen = max(min(fanIn, len(sortedRuns)), 1)
+		chunk = max(runs.MIN_CHUNK, (memory - runs.currentRSS()) // (2 * runs.MERGE_BYTES * numOpen))
+		for run in sortedRuns:
+			run.chunk = chunk
+	print('Runs ({}):   {}'.format(indexType, len(sortedRuns)))
+
+	# Multi-pass M-way merge, never more than fanIn runs open
+	mergePass = 0
+	merged = []
+	state = progress.mergeState(indexType) if progress != None else None
+	if state != None:
+		# Pick up the pass the journal was at, skipping its merged groups
+		mergePass, passRuns, mergedNames = state
+		sortedRuns = [runs.Run(tempDir + name, docBase, chunk) for name, docBase in passRuns]
+		merged = [runs.Run(tempDir + name, 0, chunk) for name in mergedNames]
+	while len(sortedRuns) > fanIn:
+		if progress != None and not merged:
+			progress.passStarted(indexType, mergePass,
+				[(os.path.basename(run.path), run.docBase) for run in sortedRuns])
+		for i in range(len(merged) * fanIn, len(sortedRuns), fanIn):
+			group = sortedRuns[i:i + fanIn]
+			path = tempDir + (indexType + "-" if indexType else "") + "merge%s-%s" % (mergePass,
+				len(merged))
+			runs.writeMergedRun(path, runs.mergeRuns(group))
+			merged.append(runs.Run(path, 0, chunk))
+			if progress != None:
+				progress.groupMerged(indexType, os.path.basename(path))
+			for run in group:
+				os.remove(run.path)
+		sortedRuns = merged
+		merged = []
+		mergePass += 1
+	print('Merge passes ({}):   {}'.format(indexType, mergePass + 1))
+	return docs, runs.mergeRuns(sortedRuns)
+
+def writeIndex(indexType, docs, merged, outputDir, lexicon="lexicon.txt", indexFile=None,
+	filtered=True):
+	"""Streams merged posting lists into a binary inverted index (see 
+	postings.py).
+	Args:
+	    docs: docnos in doc id order
+	    merged: iterator over (term, doc ids, tfs, positions) in term order
+	    lexicon: name of the lexicon file written to output-dir
+	    indexFile: path of a segment to write instead of indexes/<type>.idx
+	    filtered: write <type>-filtered too, for the phrase index
+	"""
+	# The phrase index is also written filtered by df as the lists stream
+	# past. Segments and shards are filtered by global df when read (see 
+	# segments.SegmentSet).
+	filteredWriter = None
+	if indexFile == None:
+		indexFile = postings.indexPath(outputDir + "indexes", indexType)
+		if indexType == "phrase" and filtered:
+			filteredWriter = postings.IndexWriter(postings.indexPath(outputDir + "indexes",
+				indexType + segments.FILTERED), indexType + segments.FILTERED)
+	indexWriter = postings.IndexWriter(indexFile, indexType, positional=(indexType == "positional"))
+	lexiconFile = open(outputDir + lexicon, "w")
+	# Every index of the corpus shares its doc ids, and so its doc table
+	for docno in docs:
+		indexWriter.docId(docno)
+		if filteredWriter != None:
+			filteredWriter.docId(docno)
+
+	for term, docIds, tfs, positions in merged:
+		docIds = docIds.tolist()
+		tfs = tfs.tolist()
+		if positions is None:
+			pList = [(d, tf, None) for d, tf in zip(docIds, tfs)]
+		else:
+			positions = positions.tolist()
+			pList = []
+			start = 0
+			for d, tf in zip(docIds, tfs):
+				pList.append((d, tf, positions[start:start + tf]))
+				start += tf
+		indexWriter.addPostings(term, pList)
+		lexiconFile.write(term + "\n")
+		if filteredWriter != None and len(pList) >= segments.FILTERED_MIN_DF:
+			filteredWriter.addPostings(term, pList)
+	indexWriter.close()
+	lexiconFile.close()
+	if filteredWriter != None:
+		filteredWriter.close()
 
 def main():
 	#build [trec-files-directory-path] [index-type] [output-dir]
@@ -474,21 +367,106 @@ def main():
 	global indexType
 
 	# Parse command-line arguments
-	trecFileDirPath = sys.argv[1]  
-	indexType = sys.argv[2] 
-	outputDir = sys.argv[3] 
+	parser = argparse.ArgumentParser(description="Builds an inverted index from TREC files")
+	parser.add_argument("trecFileDirPath", help="directory containing the raw documents")
+	parser.add_argument("indexType", nargs="?", help="single, stem, phrase or positional")
+	parser.add_argument("outputDir", help="directory where index and lexicon files are written")
+	parser.add_argument("--types", help="comma-separated index types built from a single "
+		"parse of the corpus, e.g. single,stem,positional,phrase (instead of index-type)")
+	parser.add_argument("--workers", type=int, default=1,
+		help="number of processes that parse TREC files in parallel")
+	parser.add_argument("--fan-in", type=int, default=FAN_IN,
+		help="maximum number of temp files merged at once")
+	parser.add_argument("--memory", type=parseMemory, default="unlimited",
+		help="memory budget, e.g. 256MB (split evenly between --workers)")
+	parser.add_argument("--triples", type=int,
+		help="memory budget in (term, doc, tf) triples: each run generator spills a run "
+		"when it holds this many, e.g. 1000, 10000 or 100000")
+	parser.add_argument("--append", action="store_true",
+		help="index only TREC files not yet indexed, as a new segment in indexes/<type>/")
+	parser.add_argument("--merge", choices=["background", "wait", "none"], default="background",
+		help="how --append runs the tiered merge of small segments (default: background)")
+	parser.add_argument("--shards", type=int,
+		help="partition the documents by docno hash into this many independently built shards")
+	parser.add_argument("--shard", type=int,
+		help="with --shards, build only this shard (0 to shards - 1); write the manifest "
+		"afterwards with shards.py manifest")
+	parser.add_argument("--restart", action="store_true",
+		help="ignore the progress journal of an interrupted build and start over")
+	parser.add_argument("--impacts",
+		help="comma-separated retrieval models (bm25, cosine) to write impact-ordered copies "
+		"of the single and stem indexes for")
+	parser.add_argument("--impact-bits", type=int, default=impacts.BITS,
+		help="bits per quantized impact (default: %(default)s)")
+	args = parser.parse_args()
+	trecFileDirPath = args.trecFileDirPath
+	outputDir = args.outputDir
+	if (args.indexType == None) == (args.types == None):
+		parser.error("give either an index type or --types")
+	indexTypes = [args.indexType] if args.types == None else args.types.split(",")
+	for indexType in indexTypes:
+		if indexType not in INDEX_TYPES:
+			parser.error("unknown index type: " + indexType)
+	impactModels = args.impacts.split(",") if args.impacts != None else []
+	for model in impactModels:
+		if model not in impacts.MODELS:
+			parser.error("unknown impact model: " + model)
+	if not 1 <= args.impact_bits <= 32:
+		parser.error("--impact-bits must be between 1 and 32")
 	if trecFileDirPath[-1] != "/":
 		trecFileDirPath += "/" 
 	if outputDir[-1] != "/":
 		outputDir += "/"
-
-	memory = "unlimited"
-	triples = []
+	if args.shards != None:
+		if args.shards < 1:
+			parser.error("--shards must be at least 1")
+		if args.append:
+			parser.error("--shards cannot be combined with --append")
+	if args.shard != None and (args.shards == None or not 0 <= args.shard < args.shards):
+		parser.error("--shard needs --shards and must be between 0 and shards - 1")
+
+	start_time = time()
+	if args.shards != None and args.shard == None:
+		# Every shard is an independent build of its documents, so shards may
+		# equally be built by separate processes or machines with --shard
+		for shard in range(args.shards):
+			subprocess.check_call([sys.executable, os.path.abspath(__file__)] + sys.argv[1:] +
+				["--shard", str(shard)])
+		for indexType in indexTypes:
+			manifest = shards.writeManifest(outputDir, indexType, args.shards)
+			print('Shards ({}):   {}, {} docs'.format(indexType, args.shards, manifest["numDocs"]))
+		print('Build Index:   {:.3f} s'.format(time() - start_time))
+		return
+	shard = None
+	if args.shard != None:
+		shard = (args.shard, args.shards)
+		outputDir = shards.shardDir(outputDir, args.shard)
+	memory = args.memory
+	workerMemory = memory
+	capacity = None
+	if args.triples != None and args.triples < 1:
+		parser.error("--triples must be at least 1")
 
 	# Load stop words 
 	with open("stops.txt") as f:
 		stops = f.readlines()
 	stops = set([x.strip() for x in stops])
+	# Stems every surface form once, and keeps them for the stem table
+	stemmer = stems.Stemmer(record=True) if "stem" in indexTypes else None
+	if memory != "unlimited":
+		# The footprint is measured with what parsing imports loaded, and
+		# the budget has to leave room for the merge's read buffers
+		if stemmer != None:
+			stemmer.load()
+		if "phrase" in indexTypes:
+			tokenizer.loadNltk()
+		workerMemory = memory // args.workers
+		footprint = runs.currentRSS() + runs.mergeHeadroom(args.fan_in)
+		if workerMemory <= footprint:
+			parser.error(runs.budgetMessage(workerMemory, footprint))
+		# Sized once, so that the run buffers of later TREC files do not
+		# shrink as the stem table and journal grow
+		capacity = runs.bufferCapacity(workerMemory, footprint)
 
 	# Create output directories
 	if not os.path.exists(outputDir):
@@ -496,89 +474,141 @@ def main():
 		os.makedirs(os.path.join(outputDir, "temp"))
 		os.makedirs(os.path.join(outputDir, "indexes"))
 
-	# Remove old temp files, if any
-	for f in os.listdir(outputDir + "/temp"):
-		os.remove(outputDir + "/temp/" + f)
-
-	for f in os.listdir(trecFileDirPath):
-		data = open(trecFileDirPath + f, "r")
-		if indexType == "phrase":
-			triples = preProcessPhrase(data, triples, stops, indexType, memory, outputDir)
+	trecFiles = [trecFileDirPath + f for f in os.listdir(trecFileDirPath)]
+	if args.append:
+		# One append at a time; queries and background merges go on meanwhile
+		appendLock = segments.acquireLock(outputDir + "indexes/append.lock", blocking=False)
+		if appendLock == None:
+			parser.error("another --append is running on " + outputDir)
+		segmentDirs = {}
+		newFiles = None
+		for indexType in indexTypes:
+			segmentDirs[indexType] = segments.segmentDir(outputDir + "indexes", indexType)
+			if shards.isSharded(outputDir + "indexes", indexType):
+				parser.error("--append cannot add to the sharded {} index".format(indexType))
+			if not segments.isSegmented(outputDir + "indexes", indexType) and \
+				os.path.exists(postings.indexPath(outputDir + "indexes", indexType)):
+				# The first append adds to the index built in one piece
+				try:
+					name = segments.adoptIndex(outputDir + "indexes", indexType)
+				except ValueError as e:
+					parser.error(str(e))
+				print('Segment ({}):   {} (existing index)'.format(indexType, name))
+			if not os.path.exists(segmentDirs[indexType]):
+				os.makedirs(segmentDirs[indexType])
+			indexed = segments.indexedFiles(segmentDirs[indexType])
+			typeFiles = [f for f in trecFiles if os.path.basename(f) not in indexed]
+			if newFiles != None and typeFiles != newFiles:
+				parser.error("--types have indexed different TREC files; append them separately")
+			newFiles = typeFiles
+		trecFiles = newFiles
+		print('New TREC files:   {}'.format(len(trecFiles)))
+
+	# Resume an interrupted build of the same files, or remove its temp
+	# files if it was another build
+	progress = journal.Journal(outputDir + "temp", {"trecFiles": [[os.path.abspath(f),
+		os.path.getsize(f), int(os.path.getmtime(f))] for f in trecFiles], "indexTypes": indexTypes,
+		"fanIn": args.fan_in, "shard": args.shard, "shards": args.shards}, restart=args.restart)
+	if stemmer != None:
+		stemmer.table.update(progress.stemTable())
+	todo = [f for f in trecFiles if not progress.isFileDone(f)]
+	if progress.resumed:
+		print('Resuming:   {} of {} TREC files already in runs'.format(len(trecFiles) - len(todo),
+			len(trecFiles)))
+	# Each TREC file gets its own runs, so that the journal can record it
+	# as done
+	try:
+		if args.workers > 1:
+			# Each worker writes its own sorted runs, largest TREC files first
+			bySize = sorted(todo, key=os.path.getsize, reverse=True)
+			pool = multiprocessing.Pool(args.workers)
+			for trecFile, fileManifests, table in pool.imap_unordered(fileRuns, [(f, stops,
+				indexTypes, workerMemory, outputDir, args.triples, shard, capacity) for f in bySize],
+				chunksize=1):
+				progress.fileDone(trecFile, fileManifests, table)
+				if table != None:
+					stemmer.table.update(table)
+			pool.close()
+			pool.join()
 		else:
-			triples = preProcess(data, triples, stops, indexType, memory, outputDir)
+			for data in todo:
+				runWriters = newRunWriters(indexTypes, memory, outputDir, os.path.basename(data) + "-",
+					args.triples, capacity)
+				known = len(stemmer.table) if stemmer != None else 0
+				preProcess(data, runWriters, stops, stemmer, shard)
+				# The stem table entries this file added
+				table = dict(itertools.islice(stemmer.table.items(), known, None)) \
+					if stemmer != None else None
+				progress.fileDone(data, {indexType: runWriter.close()
+					for indexType, runWriter in runWriters.items()}, table)
+	except MemoryError as e:
+		# The finished TREC files stay in the journal for a rerun with more
+		# memory
+		parser.error(str(e))
+
+	for indexType in indexTypes:
+		if args.append and not trecFiles:
+			break
+		if progress.isIndexDone(indexType):
+			print('Index ({}):   already written'.format(indexType))
+			continue
+		# Number documents in directory order, whichever order the runs were
+		# written in
+		docs, merged = sortAndMerge(outputDir, progress.manifests(trecFiles, indexType),
+			fanIn=args.fan_in, memory=memory, indexType=indexType, progress=progress)
+		if args.append:
+			# Write the segment, then make it live
+			name = segments.newSegment(segmentDirs[indexType])
+			indexFile = segments.segmentPath(segmentDirs[indexType], name)
+			writeIndex(indexType, docs, merged, outputDir,
+				os.path.relpath(segments.lexiconPath(segmentDirs[indexType], name), outputDir), indexFile)
+		else:
+			indexFile = postings.indexPath(outputDir + "indexes", indexType)
+			lexicon = "lexicon.txt" if len(indexTypes) == 1 else indexType + "-lexicon.txt"
+			writeIndex(indexType, docs, merged, outputDir, lexicon, filtered=(shard == None))
+			if shard == None:
+				segments.writeFiles(indexFile, [os.path.basename(f) for f in trecFiles])
+			if shard == None and shards.isSharded(outputDir + "indexes", indexType):
+				# This build replaces an earlier sharded one
+				os.remove(shards.manifestPath(outputDir + "indexes", indexType))
+				segments.removeStats(shards.statsPrefix(outputDir + "indexes", indexType))
+			if shard == None and segments.isSegmented(outputDir + "indexes", indexType):
+				# or an earlier segmented one; open readers keep their files
+				shutil.rmtree(segments.segmentDir(outputDir + "indexes", indexType))
+		if indexType == "stem":
+			stems.writeTable(stems.tablePath(indexFile), stemmer.table)
+		if indexType in bounds.INDEX_TYPES and not args.append and shard == None:
+			# Segments and shards have local statistics, so queries bound
+			# their terms themselves
+			bounds.writeBounds(indexFile)
+			for model in impactModels:
+				impacts.writeImpacts(indexFile, model, args.impact_bits)
+		if args.append:
+			segments.addSegment(segmentDirs[indexType], name, len(docs),
+				[os.path.basename(f) for f in trecFiles])
+			print('Segment ({}):   {}'.format(indexType, name))
+		progress.indexDone(indexType)
+	progress.finish()
+
+	if args.append:
+		for indexType in indexTypes:
+			if args.merge == "background":
+				segments.startMerge(segmentDirs[indexType])
+			elif args.merge == "wait":
+				for names, name in segments.mergeAll(segmentDirs[indexType]):
+					print('Merged ({}):   {} -> {}'.format(indexType, ", ".join(names), name))
+		appendLock.close()
+
+	report = 'Peak RSS:   {:.1f} MB'.format(runs.peakRSS() / MB)
+	if args.workers > 1:
+		report += ' (largest worker {:.1f} MB)'.format(runs.peakRSS(resource.RUSAGE_CHILDREN) / MB)
 	if memory != "unlimited":
-		sortAndMerge(outputDir)
-	buildInvertedIndex(indexType, triples, memory, outputDir)
-
-def timer():
-	SETUP_CODE = '''
-from __main__ import preProcess
-from __main__ import preProcessPhrase
-from __main__ import sortAndMerge
-from __main__ import buildInvertedIndex
-import os
-import re
-import sys
-import collections
-import heapq
-import ast
-import nltk
-from bs4 import BeautifulSoup
-from string import punctuation'''
-	
-	TEST_CODE = '''
-global memory
-global stops
-global outputDir
-global indexType
-# Parse command-line arguments
-trecFileDirPath = sys.argv[1]  
-indexType = sys.argv[2] 
-outputDir = sys.argv[3] 
-memory = 1000
-triples = []
-# Load stop words 
-with open("stops.txt") as f:
-	stops = f.readlines()
-stops = set([x.strip() for x in stops])
-# Create output directories
-if not os.path.exists(outputDir):
-	os.makedirs(outputDir)
-	os.makedirs(os.path.join(outputDir, "temp"))
-	os.makedirs(os.path.join(outputDir, "indexes"))
-# Remove old temp files, if any
-for f in os.listdir(outputDir + "/temp"):
-	os.remove(outputDir + "/temp/" + f)
-for f in os.listdir(trecFileDirPath):
-	data = open(trecFileDirPath + f, "r")
-	if indexType == "phrase":
-		triples = preProcessPhrase(data, triples, stops, indexType, memory, outputDir)
-	else:
-		triples = preProcess(data, triples, stops, indexType, memory, outputDir)
-# if memory != "unlimited":
-# 	sortAndMerge(outputDir)
-# buildInvertedIndex(indexType, triples, memory, outputDir)'''
-
-	TEST_CODE_MERGE = '''
-global memory
-global stops
-global outputDir
-global indexType
-# Parse command-line arguments
-trecFileDirPath = sys.argv[1]  
-indexType = sys.argv[2] 
-outputDir = sys.argv[3]
-sortAndMerge(outputDir)
-	'''
-
-	times = timeit.repeat(setup = SETUP_CODE,
-												stmt = TEST_CODE,
-												repeat = 1,
-												number = 1)
-
-	print('Time: {}'.format(min(times)))  
+		report += ', budget {:.1f} MB'.format(memory / MB)
+	if args.triples != None:
+		report += ', budget {} triples'.format(args.triples)
+	print(report)
+	print('Build Index:   {:.3f} s'.format(time() - start_time))
 
 if __name__== "__main__":
 	main()
-	# timer()
 	
\ No newline at end of file
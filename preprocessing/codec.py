@@ -0,0 +1,243 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from array import array
+import numpy as np
+
+# Every codec takes a list of non-negative ints and returns bytes; decoders
+# take the bytes and the number of ints that were encoded.
+BLOCK = 128
+
+def rawEncode(numbers):
+	"""Fixed-width uint32 encoding (no compression)."""
+	return array("I", numbers).tobytes()
+
+def rawDecode(data, count):
+	numbers = array("I")
+	numbers.frombytes(data)
+	return numbers.tolist()
+
+def vbEncode(numbers):
+	"""Variable-byte encoding: 7 bits per byte, high bit marks the last byte.
+	Args:
+	    numbers: list of non-negative ints
+	Returns:
+	    encoded bytes
+	"""
+	out = bytearray()
+	for n in numbers:
+		if n < 128:
+			out.append(n + 128)
+			continue
+		chunk = []
+		while True:
+			chunk.append(n % 128)
+			if n < 128:
+				break
+			n //= 128
+		chunk.reverse()
+		chunk[-1] += 128
+		out += bytes(chunk)
+	return bytes(out)
+
+def vbDecode(data, count=None):
+	"""Decodes a variable-byte encoded stream.
+	Args:
+	    data: encoded bytes
+	    count: unused, variable-byte streams are self-delimiting
+	Returns:
+	    list of ints
+	"""
+	numbers = []
+	n = 0
+	for b in data:
+		if b < 128:
+			n = 128 * n + b
+		else:
+			numbers.append(128 * n + b - 128)
+			n = 0
+	return numbers
+
+def vbDecodeArray(data):
+	"""Decodes a variable-byte stream with NumPy instead of a loop per byte.
+	Args:
+	    data: encoded bytes
+	Returns:
+	    int64 array of the numbers
+	"""
+	b = np.frombuffer(data, dtype=np.uint8)
+	values = (b & 127).astype(np.int64)
+	ends = np.flatnonzero(b >= 128)
+	if len(ends) == len(b):
+		# Every number fits in one byte
+		return values
+	# Each byte is shifted by 7 bits per byte after it in its number
+	positions = np.arange(len(b))
+	values <<= 7 * (ends[np.searchsorted(ends, positions)] - positions)
+	starts = np.concatenate(([0], ends[:-1] + 1))
+	return np.add.reduceat(values, starts)
+
+def vbDecodeFrom(data, pos, k):
+	"""Decodes k variable-byte numbers starting at pos.
+	Returns:
+	    (list of ints, position after the last byte read)
+	"""
+	numbers = []
+	n = 0
+	while len(numbers) < k:
+		b = data[pos]
+		pos += 1
+		if b < 128:
+			n = 128 * n + b
+		else:
+			numbers.append(128 * n + b - 128)
+			n = 0
+	return numbers, pos
+
+def gammaEncode(numbers):
+	"""Elias-gamma encoding of n + 1 (gamma cannot represent 0).
+	Args:
+	    numbers: list of non-negative ints
+	Returns:
+	    encoded bytes, padded with 1 bits to a byte boundary
+	"""
+	bits = []
+	for n in numbers:
+		offset = bin(n + 1)[3:]
+		bits.append("1" * len(offset) + "0" + offset)
+	bits = "".join(bits)
+	if len(bits) == 0:
+		return b""
+	bits += "1" * (-len(bits) % 8)
+	return int(bits, 2).to_bytes(len(bits) // 8, "big")
+
+def gammaDecode(data, count):
+	"""Decodes count Elias-gamma codes.
+	Args:
+	    data: encoded bytes
+	    count: number of ints encoded
+	Returns:
+	    list of ints
+	"""
+	if count == 0:
+		return []
+	bits = bin(int.from_bytes(data, "big"))[2:].zfill(len(data) * 8)
+	numbers = []
+	i = 0
+	for _ in range(count):
+		zero = bits.index("0", i)
+		length = zero - i
+		end = zero + 1 + length
+		numbers.append(int("1" + bits[zero + 1:end], 2) - 1)
+		i = end
+	return numbers
+
+def blockEncode(numbers):
+	"""PForDelta-style block encoding. Each block of BLOCK ints is bit-packed
+	at the width that fits 90% of its values; larger values are patched in
+	as variable-byte (index, high bits) exceptions.
+	Args:
+	    numbers: list of non-negative ints
+	Returns:
+	    encoded bytes
+	"""
+	out = bytearray()
+	for start in range(0, len(numbers), BLOCK):
+		block = numbers[start:start + BLOCK]
+		ordered = sorted(block)
+		width = ordered[(len(ordered) * 9 + 9) // 10 - 1].bit_length()
+		mask = (1 << width) - 1
+		exceptions = [(i, v >> width) for i, v in enumerate(block) if v > mask]
+		packed = 0
+		for i, v in enumerate(block):
+			packed |= (v & mask) << (i * width)
+		out.append(width)
+		out += vbEncode([len(exceptions)])
+		out += packed.to_bytes((len(block) * width + 7) // 8, "little")
+		for i, high in exceptions:
+			out += vbEncode([i, high])
+	return bytes(out)
+
+def blockDecode(data, count):
+	"""Decodes count ints written by blockEncode.
+	Args:
+	    data: encoded bytes
+	    count: number of ints encoded
+	Returns:
+	    list of ints
+	"""
+	numbers = []
+	pos = 0
+	while len(numbers) < count:
+		n = min(BLOCK, count - len(numbers))
+		width = data[pos]
+		(numExceptions,), pos = vbDecodeFrom(data, pos + 1, 1)
+		size = (n * width + 7) // 8
+		packed = int.from_bytes(data[pos:pos + size], "little")
+		pos += size
+		mask = (1 << width) - 1
+		block = [(packed >> (i * width)) & mask for i in range(n)]
+		if numExceptions:
+			patches, pos = vbDecodeFrom(data, pos, 2 * numExceptions)
+			for j in range(0, len(patches), 2):
+				block[patches[j]] |= patches[j + 1] << width
+		numbers.extend(block)
+	return numbers
+
+# Codec ids are stored in the index header, so never renumber them
+CODECS = {
+	"raw": (0, rawEncode, rawDecode),
+	"vbyte": (1, vbEncode, vbDecode),
+	"gamma": (2, gammaEncode, gammaDecode),
+	"block": (3, blockEncode, blockDecode),
+}
+CODEC_NAMES = {v[0]: k for k, v in CODECS.items()}
+
+def toGaps(postings, positional):
+	"""Flattens postings sorted by doc id into a stream of doc id gaps, tfs
+	and (for positional indexes) position gaps.
+	Args:
+	    postings: list of (docid, tf, positions) with integer doc ids
+	    positional: True if postings carry positions
+	Returns:
+	    list of ints
+	"""
+	numbers = []
+	lastDoc = 0
+	for docid, tf, positions in postings:
+		numbers.append(docid - lastDoc)
+		numbers.append(tf)
+		lastDoc = docid
+		if positional:
+			lastPos = 0
+			for p in positions:
+				numbers.append(p - lastPos)
+				lastPos = p
+	return numbers
+
+def fromGaps(numbers, positional):
+	"""Inverse of toGaps.
+	Args:
+	    numbers: list of ints
+	    positional: True if postings carry positions
+	Returns:
+	    list of (docid, tf, positions), positions is None unless positional
+	"""
+	postings = []
+	docid = 0
+	i = 0
+	while i < len(numbers):
+		docid += numbers[i]
+		tf = numbers[i + 1]
+		i += 2
+		if positional:
+			positions = []
+			p = 0
+			for gap in numbers[i:i + tf]:
+				p += gap
+				positions.append(p)
+			i += tf
+			postings.append((docid, tf, positions))
+		else:
+			postings.append((docid, tf, None))
+	return postings
@@ -0,0 +1,198 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import argparse
+import mmap
+import os
+import struct
+from array import array
+import numpy as np
+import bounds
+import postings
+
+# Impact-ordered index (<index-type>.<model>.impacts), an optional sidecar
+# built from an index and its statistics:
+#   header     | magic, version, model, bits, number of terms and docs,
+#              | total tf, scale, section offsets
+#   segments   | per term, its segments in decreasing impact order: a
+#              | table of (impact, count) uint32 pairs, then the uint32
+#              | doc ids of each segment, sorted
+#   dictionary | terms joined by "\n", then per term (offset, number of
+#              | segments, number of postings)
+# A posting's impact is its document's score for the term, quantized to
+# bits: round(score / scale), with scale the largest score in the index
+# over 2^bits - 1. The scores are bm25, the BM25 weight w * (k1 + 1) tf /
+# (K + tf) without the query tf part, or cosine, tf * idf / sqrt(tf-idf
+# norm). Postings that score 0 or less (BM25 terms in more than half of
+# the documents) are left out. Doc ids are the index's; the numbers of
+# terms and docs and the total tf tell a sidecar left from an earlier
+# build of the index.
+IMPACTS_MAGIC = b"SEIP"
+IMPACTS_VERSION = 1
+IMPACTS_HEADER = struct.Struct("<4sH8sHIIQdQQ")
+IMPACTS_SUFFIX = ".impacts"
+MODELS = ["bm25", "cosine"]
+BITS = 8
+
+def impactsPath(indexFile, model):
+	"""Path of an index file's impact-ordered sidecar for a model."""
+	return os.path.splitext(indexFile)[0] + "." + model + IMPACTS_SUFFIX
+
+def postingScores(reader, model):
+	"""Scores every posting of an index, a batch of terms at a time (see
+	postings.postingBatches). Scores that are not finite are 0.
+	Returns:
+	    iterator, in dictionary order, of (terms, offset of each term's
+	    first posting followed by the batch's length, doc ids, scores)
+	"""
+	lengths = np.frombuffer(reader.stats.lengths, dtype=np.uint32).astype(np.float64)
+	norms = np.frombuffer(reader.stats.norms, dtype=np.float64)
+	N = reader.stats.N
+	for terms, starts, docids, tfs in postings.postingBatches(reader):
+		weights = array("d")
+		for term in terms:
+			df = reader.df(term)
+			if model == "bm25":
+				weights.append(np.log((N - df + 0.5) / (df + 0.5)))
+			else:
+				weights.append(reader.idf(term))
+		# Each posting's term weight
+		weights = np.repeat(np.frombuffer(weights, dtype=np.float64), np.diff(starts))
+		bm25, cosine = bounds.documentParts(tfs.astype(np.float64), lengths[docids], norms[docids],
+			reader.stats.totalTf / N)
+		if model == "bm25":
+			scores = weights * bm25
+		else:
+			scores = weights * cosine
+		scores[~np.isfinite(scores)] = 0
+		yield terms, starts, docids, scores
+
+def writeImpacts(indexFile, model="bm25", bits=BITS):
+	"""Writes the impact-ordered sidecar of an index with a statistics
+	sidecar. The postings are scored twice, a batch of terms at a time: once
+	for the largest score, which sets the scale, and once to write them.
+	Returns:
+	    path of the sidecar
+	"""
+	reader = postings.IndexReader(indexFile)
+	numDocs = len(reader.docs)
+	totalTf = reader.stats.totalTf
+	maxScore = 0.0
+	for terms, starts, docids, scores in postingScores(reader, model):
+		maxScore = max(maxScore, float(scores.max()))
+	scale = maxScore / ((1 << bits) - 1) if maxScore > 0 else 1.0
+
+	path = impactsPath(indexFile, model)
+	entries = array("Q")
+	with open(path + postings.TEMP_SUFFIX, "wb") as f:
+		f.write(b"\0" * IMPACTS_HEADER.size)
+		offset = IMPACTS_HEADER.size
+		for terms, starts, docids, scores in postingScores(reader, model):
+			impacts = np.rint(scores / scale).astype(np.int64)
+			# A positive score is worth at least the smallest impact
+			impacts[(impacts == 0) & (scores > 0)] = 1
+			for i in range(len(terms)):
+				termImpacts = impacts[starts[i]:starts[i + 1]]
+				termDocs = docids[starts[i]:starts[i + 1]]
+				kept = termImpacts > 0
+				termImpacts = termImpacts[kept]
+				termDocs = termDocs[kept]
+				# Highest impact first, doc ids ascending within an impact
+				order = np.lexsort((termDocs, -termImpacts))
+				termImpacts = termImpacts[order]
+				termDocs = termDocs[order]
+				values, first, counts = np.unique(-termImpacts, return_index=True, return_counts=True)
+				table = np.empty(2 * len(values), dtype=np.uint32)
+				table[0::2] = -values
+				table[1::2] = counts
+				f.write(table.tobytes())
+				f.write(termDocs.astype(np.uint32).tobytes())
+				entries.extend((offset, len(values), len(termDocs)))
+				offset += 4 * len(table) + 4 * len(termDocs)
+		dictOffset = offset
+		termBlob = "\n".join(reader).encode("utf-8")
+		f.write(termBlob)
+		f.write(entries.tobytes())
+		f.seek(0)
+		f.write(IMPACTS_HEADER.pack(IMPACTS_MAGIC, IMPACTS_VERSION, model.encode("utf-8"), bits,
+			len(reader), numDocs, totalTf, scale, dictOffset, len(termBlob)))
+	reader.close()
+	os.replace(path + postings.TEMP_SUFFIX, path)
+	return path
+
+class ImpactReader:
+	"""Opens an impact-ordered sidecar via mmap. Only the dictionary is
+	decoded up front."""
+
+	def __init__(self, path):
+		self.f = open(path, "rb")
+		self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+		magic, version, model, bits, numTerms, numDocs, totalTf, scale, dictOffset, \
+			termBlobLen = IMPACTS_HEADER.unpack_from(self.mm, 0)
+		if magic != IMPACTS_MAGIC:
+			raise ValueError(path + " is not an impact-ordered index")
+		if version != IMPACTS_VERSION:
+			raise ValueError("Unsupported impacts version " + str(version))
+		self.model = model.rstrip(b"\0").decode("utf-8")
+		self.bits = bits
+		self.numDocs = numDocs
+		self.totalTf = totalTf
+		self.scale = scale
+		termBlob = self.mm[dictOffset:dictOffset + termBlobLen]
+		terms = termBlob.decode("utf-8").split("\n") if numTerms else []
+		self.terms = {t: i for i, t in enumerate(terms)}
+		self.entries = array("Q")
+		entriesOffset = dictOffset + termBlobLen
+		self.entries.frombytes(self.mm[entriesOffset:entriesOffset + numTerms * 3 * self.entries.itemsize])
+
+	def matches(self, reader):
+		"""Whether the sidecar was written for an open index.
+		Args:
+		    reader: postings.IndexReader of the index
+		"""
+		return (len(self.terms), self.numDocs, self.totalTf) == (len(reader), len(reader.docs),
+			reader.stats.totalTf)
+
+	def __contains__(self, term):
+		return term in self.terms
+
+	def __len__(self):
+		return len(self.terms)
+
+	def __iter__(self):
+		return iter(self.terms)
+
+	def segments(self, term):
+		"""A term's postings grouped by impact.
+		Returns:
+		    list of (impact, uint32 array of doc ids), highest impact first
+		"""
+		i = 3 * self.terms[term]
+		offset, numSegments, numPostings = self.entries[i:i + 3]
+		table = np.frombuffer(self.mm[offset:offset + 8 * numSegments], dtype=np.uint32)
+		offset += 8 * numSegments
+		docids = np.frombuffer(self.mm[offset:offset + 4 * numPostings], dtype=np.uint32)
+		segments = []
+		start = 0
+		for j in range(numSegments):
+			count = int(table[2 * j + 1])
+			segments.append((int(table[2 * j]), docids[start:start + count]))
+			start += count
+		return segments
+
+	def close(self):
+		self.mm.close()
+		self.f.close()
+
+def main():
+	# python3 impacts.py [index-file] --model bm25 --bits 8
+	parser = argparse.ArgumentParser(description="Writes an impact-ordered copy of an index")
+	parser.add_argument("indexFile", help="index file, e.g. output/indexes/single.idx")
+	parser.add_argument("--model", default=MODELS[0], choices=MODELS)
+	parser.add_argument("--bits", type=int, default=BITS,
+		help="bits per quantized impact (default: %(default)s)")
+	args = parser.parse_args()
+	print('Impacts:   ' + writeImpacts(args.indexFile, args.model, args.bits))
+
+if __name__== "__main__":
+	main()
@@ -0,0 +1,121 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import stems
+
+# A build keeps its progress journal in <output-dir>/temp/journal.json:
+#   {"params": {...},
+#    "files": {"fr940104.0": {"manifests": {"single": "fr940104.0-manifest.json"},
+#                             "stems": "fr940104.0-stem.stems"}, ...},
+#    "merges": {"single": {"pass": 1, "runs": [["single-merge0-0", 0], ...],
+#                          "merged": ["single-merge1-0"]}},
+#    "indexes": ["single"]}
+# files lists the TREC files whose runs are complete, merges the runs of
+# each index type's current merge pass (name and doc id base) and the
+# groups of that pass already merged, and indexes the index types already
+# written. The journal is replaced atomically after every step, so a
+# restarted build with the same params skips what it records and, since
+# run boundaries do not change the merged posting lists, writes the same
+# bytes as an uninterrupted build.
+JOURNAL = "journal.json"
+
+class Journal:
+	"""Progress journal of a build. Opening it with other params than the
+	journal on disk (or with no journal) empties the temp directory and
+	starts over."""
+
+	def __init__(self, tempDir, params, restart=False):
+		"""
+		Args:
+		    tempDir: the build's temp directory
+		    params: JSON-able dict of everything that changes the runs,
+		    e.g. TREC files, index types and fan-in
+		    restart: ignore the journal on disk
+		"""
+		self.tempDir = tempDir if tempDir[-1] == "/" else tempDir + "/"
+		self.path = self.tempDir + JOURNAL
+		self.state = None
+		if not restart and os.path.exists(self.path):
+			with open(self.path) as f:
+				self.state = json.load(f)
+			if self.state["params"] != params:
+				self.state = None
+		self.resumed = self.state != None
+		if self.state == None:
+			for f in os.listdir(self.tempDir):
+				os.remove(self.tempDir + f)
+			self.state = {"params": params, "files": {}, "merges": {}, "indexes": []}
+			self.save()
+
+	def save(self):
+		with open(self.path + ".tmp", "w") as f:
+			json.dump(self.state, f)
+		os.replace(self.path + ".tmp", self.path)
+
+	def isFileDone(self, trecFile):
+		return os.path.basename(trecFile) in self.state["files"]
+
+	def fileDone(self, trecFile, manifests, table=None):
+		"""Records that a TREC file's runs are complete.
+		Args:
+		    manifests: dict from index type to the file's run manifest name
+		    table: stem table entries added while parsing the file, or None
+		"""
+		name = os.path.basename(trecFile)
+		entry = {"manifests": manifests, "stems": None}
+		if table != None:
+			entry["stems"] = name + "-stem" + stems.TABLE_SUFFIX
+			stems.writeTable(self.tempDir + entry["stems"], table)
+		self.state["files"][name] = entry
+		self.save()
+
+	def manifests(self, trecFiles, indexType):
+		"""Returns:
+		    run manifest names of an index type, in trecFiles order
+		"""
+		return [self.state["files"][os.path.basename(f)]["manifests"][indexType] for f in trecFiles]
+
+	def stemTable(self):
+		"""Returns:
+		    the stem table entries of the TREC files done
+		"""
+		return stems.readTables(self.tempDir + entry["stems"]
+			for entry in self.state["files"].values() if entry["stems"] != None)
+
+	def mergeState(self, indexType):
+		"""Returns:
+		    (merge pass, [(run name, doc id base)], names of the runs merged
+		    so far in the pass), or None if no pass has started
+		"""
+		state = self.state["merges"].get(indexType)
+		if state == None:
+			return None
+		return state["pass"], [tuple(run) for run in state["runs"]], state["merged"]
+
+	def passStarted(self, indexType, mergePass, passRuns):
+		"""Records the runs a merge pass merges.
+		Args:
+		    passRuns: list of (run name, doc id base)
+		"""
+		self.state["merges"][indexType] = {"pass": mergePass, "runs": [list(run) for run in passRuns],
+			"merged": []}
+		self.save()
+
+	def groupMerged(self, indexType, name):
+		"""Records the next group of the current pass as merged into run name."""
+		self.state["merges"][indexType]["merged"].append(name)
+		self.save()
+
+	def isIndexDone(self, indexType):
+		return indexType in self.state["indexes"]
+
+	def indexDone(self, indexType):
+		self.state["indexes"].append(indexType)
+		self.save()
+
+	def finish(self):
+		"""Removes the journal once the build is complete, so the next build
+		starts afresh."""
+		os.remove(self.path)
@@ -0,0 +1,406 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import collections.abc
+import math
+import mmap
+import os
+import struct
+from array import array
+import numpy as np
+import codec
+
+# File layout (all integers little-endian):
+#   header     | magic, version, flags, codec, index type, counts, section offsets
+#   postings   | per term: doc id gaps, tfs and position gaps, compressed
+#              | with the codec named in the header (see codec.py)
+#   doc table  | docnos joined by "\n", the docno of doc id i on line i. Doc
+#              | ids are dense and in corpus order, and every index built
+#              | from one corpus has the same doc table, including docs
+#              | that have no terms in it
+#   dictionary | terms joined by "\n", then per term (df, cf, offset, length)
+MAGIC = b"SEIX"
+VERSION = 2
+HEADER = struct.Struct("<4sHHH16sIIQQQQ")
+ENTRY = "Q"
+FLAG_POSITIONAL = 1
+
+# Statistics sidecar (<index-type>.stats), written alongside the index:
+#   header  | magic, version, number of docs in the doc table, number of
+#           | terms, total tf
+#   idf     | float64 log10(N / df) per term, in dictionary order
+#   lengths | uint32 total tf per doc, in doc table order
+#   norms   | float64 sum of (tf * idf)^2 per doc
+# N, the number of documents idf counts, is the number with a length above 0.
+STATS_MAGIC = b"SEST"
+STATS_VERSION = 1
+STATS_HEADER = struct.Struct("<4sHIIQ")
+# Both files are written under this suffix and renamed over the old ones
+# when complete, so readers that have the old index mmapped keep reading it
+TEMP_SUFFIX = ".tmp"
+# Postings a batch of postingBatches() decodes, unless one term has more
+BATCH_POSTINGS = 1 << 14
+
+def indexPath(indexDir, indexType):
+	"""Builds the path of a binary index file.
+	Args:
+	    indexDir: directory holding the index files
+	    indexType: type of index (single, stem, positional, phrase, ...)
+	Returns:
+	    path to <indexType>.idx
+	"""
+	if indexDir != "" and indexDir[-1] != "/":
+		indexDir += "/"
+	return indexDir + indexType + ".idx"
+
+def statsPath(path):
+	"""Path of the statistics sidecar of an index file."""
+	return os.path.splitext(path)[0] + ".stats"
+
+class IndexWriter:
+	"""Streams sorted posting lists into a binary index file. Terms must be
+	added in sorted order; doc ids are assigned in first-seen order. Document
+	lengths and tf-idf norms are collected on the way and written to the
+	statistics sidecar."""
+
+	def __init__(self, path, indexType, positional=False, codecName="vbyte"):
+		self.path = path
+		self.indexType = indexType
+		self.positional = positional
+		self.codecId, self.encode, _ = codec.CODECS[codecName]
+		self.terms = []
+		self.entries = array(ENTRY)
+		self.docs = []
+		self.docIds = {}
+		# idf = log10(N / df) needs N, which is only final at close(), so each
+		# doc's sum of (tf * idf)^2 is kept as sums of tf^2, tf^2 * log10(df)
+		# and tf^2 * log10(df)^2
+		self.lengths = array("I")
+		self.sq = array("d")
+		self.sqLog = array("d")
+		self.sqLog2 = array("d")
+		self.f = open(path + TEMP_SUFFIX, "wb")
+		self.f.write(b"\0" * HEADER.size)
+		self.offset = HEADER.size
+
+	def docId(self, docno):
+		"""Maps a docno to its integer id in the doc table."""
+		if docno not in self.docIds:
+			self.docIds[docno] = len(self.docs)
+			self.docs.append(docno)
+			self.lengths.append(0)
+			self.sq.append(0.0)
+			self.sqLog.append(0.0)
+			self.sqLog2.append(0.0)
+		return self.docIds[docno]
+
+	def addTerm(self, term, postings):
+		"""Appends a term's posting list.
+		Args:
+		    term: term string
+		    postings: list of (docno, tf, positions) with positions None for
+		    non-positional indexes
+		"""
+		self.addPostings(term, sorted((self.docId(docno), tf, positions)
+			for docno, tf, positions in postings))
+
+	def addPostings(self, term, postings):
+		"""Appends a posting list whose docnos are already mapped by docId().
+		Args:
+		    term: term string
+		    postings: list of (docid, tf, positions) sorted by docid
+		"""
+		cf = sum(p[1] for p in postings)
+		logDf = math.log10(len(postings))
+		logDf2 = logDf * logDf
+		lengths, sq, sqLog, sqLog2 = self.lengths, self.sq, self.sqLog, self.sqLog2
+		for docid, tf, positions in postings:
+			lengths[docid] += tf
+			w = tf * tf
+			sq[docid] += w
+			sqLog[docid] += w * logDf
+			sqLog2[docid] += w * logDf2
+		data = self.encode(codec.toGaps(postings, self.positional))
+		self.f.write(data)
+		self.terms.append(term)
+		self.entries.extend((len(postings), cf, self.offset, len(data)))
+		self.offset += len(data)
+
+	def close(self):
+		"""Writes the doc table, dictionary and header, and publishes the
+		index with its statistics."""
+		docTableOffset = self.offset
+		docTable = "\n".join(self.docs).encode("utf-8")
+		self.f.write(docTable)
+		dictOffset = docTableOffset + len(docTable)
+		termBlob = "\n".join(self.terms).encode("utf-8")
+		self.f.write(termBlob)
+		self.f.write(self.entries.tobytes())
+
+		flags = FLAG_POSITIONAL if self.positional else 0
+		self.f.seek(0)
+		self.f.write(HEADER.pack(MAGIC, VERSION, flags, self.codecId, self.indexType.encode("utf-8"),
+			len(self.terms), len(self.docs), docTableOffset, len(docTable),
+			dictOffset, len(termBlob)))
+		self.f.close()
+		self.writeStats()
+		# The index last: a reader that sees the new index sees its statistics
+		os.replace(statsPath(self.path) + TEMP_SUFFIX, statsPath(self.path))
+		os.replace(self.path + TEMP_SUFFIX, self.path)
+
+	def writeStats(self):
+		"""Writes idf per term and length and tf-idf norm per document."""
+		N = len(self.docs) - self.lengths.count(0)
+		logN = math.log10(N) if N else 0.0
+		idf = array("d", (logN - math.log10(self.entries[i]) for i in range(0, len(self.entries), 4)))
+		norms = array("d", (self.sq[d] * logN * logN - 2 * logN * self.sqLog[d] + self.sqLog2[d]
+			for d in range(len(self.docs))))
+		writeStats(statsPath(self.path), idf, self.lengths, norms)
+
+def writeStats(path, idf, lengths, norms):
+	"""Writes a statistics sidecar under path + TEMP_SUFFIX, for the caller
+	to rename into place.
+	Args:
+	    idf: float64 array of idf per term, in dictionary order
+	    lengths: uint32 array of total tf per doc, in doc table order
+	    norms: float64 array of sum of (tf * idf)^2 per doc
+	"""
+	with open(path + TEMP_SUFFIX, "wb") as f:
+		f.write(STATS_HEADER.pack(STATS_MAGIC, STATS_VERSION, len(lengths), len(idf), int(sum(lengths))))
+		f.write(idf.tobytes())
+		f.write(lengths.tobytes())
+		f.write(norms.tobytes())
+
+class IndexStats:
+	"""Reads the statistics sidecar of an index."""
+
+	def __init__(self, path):
+		with open(path, "rb") as f:
+			data = f.read()
+		magic, version, numDocs, numTerms, totalTf = STATS_HEADER.unpack_from(data, 0)
+		if magic != STATS_MAGIC:
+			raise ValueError(path + " is not an index statistics file")
+		if version != STATS_VERSION:
+			raise ValueError("Unsupported statistics version " + str(version))
+		self.numDocs = numDocs
+		self.totalTf = totalTf
+		offset = STATS_HEADER.size
+		self.idf = array("d")
+		self.idf.frombytes(data[offset:offset + 8 * numTerms])
+		offset += 8 * numTerms
+		self.lengths = array("I")
+		self.lengths.frombytes(data[offset:offset + 4 * numDocs])
+		offset += 4 * numDocs
+		self.norms = array("d")
+		self.norms.frombytes(data[offset:offset + 8 * numDocs])
+		# Documents that have terms in the index
+		self.N = numDocs - self.lengths.count(0)
+
+class IndexReader:
+	"""Opens a binary index via mmap. Only the dictionary and doc table are
+	decoded up front; posting lists are unpacked on request."""
+
+	def __init__(self, path):
+		self.f = open(path, "rb")
+		self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+		magic, version, flags, codecId, indexType, numTerms, numDocs, docTableOffset, \
+			docTableLen, dictOffset, termBlobLen = HEADER.unpack_from(self.mm, 0)
+		if magic != MAGIC:
+			raise ValueError(path + " is not a binary index file")
+		if version != VERSION:
+			raise ValueError("Unsupported index version " + str(version))
+		self.indexType = indexType.rstrip(b"\0").decode("utf-8")
+		self.positional = bool(flags & FLAG_POSITIONAL)
+		self.codecName = codec.CODEC_NAMES[codecId]
+		self.decode = codec.CODECS[self.codecName][2]
+
+		docTable = self.mm[docTableOffset:docTableOffset + docTableLen]
+		self.docs = docTable.decode("utf-8").split("\n") if numDocs else []
+		termBlob = self.mm[dictOffset:dictOffset + termBlobLen]
+		terms = termBlob.decode("utf-8").split("\n") if numTerms else []
+		self.entries = array(ENTRY)
+		entriesOffset = dictOffset + termBlobLen
+		self.entries.frombytes(self.mm[entriesOffset:entriesOffset + numTerms * 4 * self.entries.itemsize])
+		self.terms = {t: i for i, t in enumerate(terms)}
+		self.N = numDocs
+		self.stats = None
+		if os.path.exists(statsPath(path)):
+			self.stats = IndexStats(statsPath(path))
+			self.N = self.stats.N
+
+	def __contains__(self, term):
+		return term in self.terms
+
+	def __len__(self):
+		return len(self.terms)
+
+	def __iter__(self):
+		return iter(self.terms)
+
+	def df(self, term):
+		return self.entries[4 * self.terms[term]]
+
+	def cf(self, term):
+		return self.entries[4 * self.terms[term] + 1]
+
+	def idf(self, term):
+		"""log10(N / df), read from the statistics sidecar if there is one."""
+		if self.stats != None:
+			return self.stats.idf[self.terms[term]]
+		return math.log10(float(self.N) / self.df(term))
+
+	def docLengths(self, norms=True):
+		"""Args:
+		    norms: unused; the sidecar holds the norms either way (see
+		    segments.SegmentSet.docLengths)
+		Returns:
+		    dict from doc id to (total tf, sum of (tf * idf)^2) of the docs
+		    with terms, or None if the index has no statistics sidecar
+		"""
+		if self.stats == None:
+			return None
+		lengths, norms = self.stats.lengths, self.stats.norms
+		return {d: (lengths[d], norms[d]) for d in range(len(lengths)) if lengths[d]}
+
+	def postings(self, term):
+		"""Unpacks a term's posting list.
+		Args:
+		    term: term string
+		Returns:
+		    list of (docno, tf, positions), positions is None unless positional
+		"""
+		docs = self.docs
+		return [(docs[docid], tf, positions) for docid, tf, positions in self.rawPostings(term)]
+
+	def rawPostings(self, term):
+		"""Decodes a term's posting list without resolving doc ids.
+		Args:
+		    term: term string
+		Returns:
+		    list of (docid, tf, positions) with integer doc ids
+		"""
+		i = 4 * self.terms[term]
+		df, cf, offset, length = self.entries[i:i + 4]
+		count = 2 * df + (cf if self.positional else 0)
+		numbers = self.decode(self.mm[offset:offset + length], count)
+		return codec.fromGaps(numbers, self.positional)
+
+	def postingArrays(self, term):
+		"""Decodes a term's doc ids and tfs, without positions, into arrays.
+		Variable-byte lists without positions are decoded with NumPy.
+		Returns:
+		    (int64 array of doc ids, int64 array of tfs)
+		"""
+		if self.codecName == "vbyte" and not self.positional:
+			i = 4 * self.terms[term]
+			df, cf, offset, length = self.entries[i:i + 4]
+			numbers = codec.vbDecodeArray(self.mm[offset:offset + length])
+			return np.cumsum(numbers[0::2]), numbers[1::2]
+		return toArrays(self.rawPostings(term))
+
+	def close(self):
+		self.mm.close()
+		self.f.close()
+
+def toArrays(pList):
+	"""Returns:
+	    (int64 array of doc ids, int64 array of tfs) of a posting list
+	"""
+	return (np.array([docid for docid, tf, positions in pList], dtype=np.int64),
+		np.array([tf for docid, tf, positions in pList], dtype=np.int64))
+
+def postingBatches(reader, maxPostings=BATCH_POSTINGS):
+	"""Decodes every posting list of an index, without positions, a few
+	terms at a time, so that about maxPostings postings are in memory at
+	once.
+	Args:
+	    reader: IndexReader
+	Returns:
+	    iterator, in dictionary order, of (terms, offset of each term's
+	    first posting followed by the batch's length, int64 array of doc ids,
+	    int64 array of tfs)
+	"""
+	terms = []
+	docids = []
+	tfs = []
+	count = 0
+	for term in reader:
+		termDocids, termTfs = reader.postingArrays(term)
+		if terms and count + len(termDocids) > maxPostings:
+			yield batch(terms, docids, tfs)
+			terms = []
+			docids = []
+			tfs = []
+			count = 0
+		terms.append(term)
+		docids.append(termDocids)
+		tfs.append(termTfs)
+		count += len(termDocids)
+	if terms:
+		yield batch(terms, docids, tfs)
+
+def batch(terms, docids, tfs):
+	"""A batch of postingBatches() from the terms' posting arrays."""
+	starts = np.zeros(len(terms) + 1, dtype=np.int64)
+	np.cumsum([len(d) for d in docids], out=starts[1:])
+	return terms, starts, np.concatenate(docids), np.concatenate(tfs)
+
+class Term:
+	"""Entry of a LazyIndex. df, idf and cf come from the dictionary; the
+	posting list is decoded the first time pList (or arrays) is read."""
+
+	def __init__(self, reader, term):
+		self.reader = reader
+		self.term = term
+		self.df = reader.df(term) # Document freq
+		self.idf = reader.idf(term) # Inverse document freq
+		self.cf = reader.cf(term) # Collection freq
+		self.postings = None
+		self.postingArrays = None
+
+	@property
+	def pList(self):
+		"""Posting list of (doc id, tf, positions)."""
+		if self.postings == None:
+			self.postings = self.reader.rawPostings(self.term)
+		return self.postings
+
+	@property
+	def arrays(self):
+		"""Posting list as (int64 array of doc ids, int64 array of tfs)."""
+		if self.postingArrays == None:
+			self.postingArrays = self.reader.postingArrays(self.term)
+		return self.postingArrays
+
+class LazyIndex(collections.abc.Mapping):
+	"""Read-only dict from term to Term over an open index (IndexReader,
+	segments.SegmentSet or shards.ShardSet), which it keeps open. Opening
+	reads only the dictionary, so the cost of a query grows with the terms
+	it looks up, not with the lexicon."""
+
+	def __init__(self, reader):
+		self.reader = reader
+		self.docs = reader.docs
+		self.N = reader.N
+		self.loaded = {}
+
+	def __getitem__(self, term):
+		entry = self.loaded.get(term)
+		if entry == None:
+			if term not in self.reader:
+				raise KeyError(term)
+			entry = Term(self.reader, term)
+			self.loaded[term] = entry
+		return entry
+
+	def __contains__(self, term):
+		return term in self.reader
+
+	def __len__(self):
+		return len(self.reader)
+
+	def __iter__(self):
+		return iter(self.reader)
+
+	def close(self):
+		self.reader.close()
@@ -0,0 +1,457 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import heapq
+import json
+import os
+import resource
+import shutil
+import sys
+from array import array
+import numpy as np
+
+# A run file is a sequence of .npy arrays (see numpy.lib.format):
+#   terms     | uint8, the run's distinct terms in sorted order joined by "\n"
+#   counts    | int64, number of postings of each term
+#   docs      | int32, doc ids, sorted within each term
+#   tfs       | int32, term frequencies
+#   positions | int32, positions of each posting (tf of them), positional only
+# Each run generator also writes <prefix>docs.txt, its docnos one per line
+# (doc ids in its runs index that list), and <prefix>manifest.json listing
+# its runs.
+TERM_ID = np.int32
+DOC_ID = np.int32
+TF = np.int32
+POSITION = np.int32
+ARRAYS = ("terms", "counts", "docs", "tfs", "positions")
+GROWTH = 1 << 16
+BUFFER_SIZE = 1 << 20
+CHUNK = 1 << 16
+
+# Bytes of scratch a spill allocates per buffered triple and position to
+# sort them, bytes of buffer per triple, and the parser's peak working set
+# per byte of document text
+SPILL_TRIPLE_BYTES = 32
+SPILL_POSITION_BYTES = 16
+TRIPLE_BYTES = 12
+PARSE_BYTES = 16
+# Bytes a run reader buffers per element of its chunk, across its arrays,
+# and the fewest elements it buffers however small the budget
+MERGE_BYTES = 24
+MIN_CHUNK = 1024
+# Fewest triples a run is spilled with to stay within the memory budget
+MIN_RUN = 1 << 14
+MB = 1 << 20
+
+def currentRSS():
+	"""Resident set size of this process in bytes."""
+	try:
+		with open("/proc/self/statm") as f:
+			return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+	except (IOError, OSError):
+		return peakRSS()
+
+def mergeHeadroom(fanIn):
+	"""Bytes a merge of fanIn runs needs at least, for the smallest read
+	buffers of the open runs."""
+	return MERGE_BYTES * MIN_CHUNK * fanIn
+
+def bufferCapacity(memory, footprint):
+	"""Triples a run generator's buffers can hold within a memory budget.
+	Args:
+	    memory: bytes the whole process may use
+	    footprint: bytes the process needs besides the buffers
+	"""
+	return max(MIN_RUN, (memory - footprint) // TRIPLE_BYTES)
+
+def budgetMessage(memory, footprint):
+	"""Error message of a memory budget the process cannot keep to."""
+	return "--memory of {:.1f} MB per process is less than the builder's own footprint of " \
+		"{:.1f} MB".format(memory / MB, footprint / MB)
+
+def peakRSS(who=resource.RUSAGE_SELF):
+	"""Peak resident set size in bytes (of the largest child for
+	RUSAGE_CHILDREN)."""
+	peak = resource.getrusage(who).ru_maxrss
+	return peak if sys.platform == "darwin" else peak * 1024
+
+def writeArrays(path, arrays):
+	"""Writes a run file, arrays in ARRAYS order."""
+	with open(path, "wb") as f:
+		for a in arrays:
+			np.lib.format.write_array(f, np.ascontiguousarray(a), allow_pickle=False)
+
+def arrayHeaders(path):
+	"""Reads the array headers of a run file.
+	Returns:
+	    dict from array name to (offset, dtype, length)
+	"""
+	headers = {}
+	with open(path, "rb") as f:
+		for name in ARRAYS:
+			if np.lib.format.read_magic(f) == (1, 0):
+				shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+			else:
+				shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+			offset = f.tell()
+			headers[name] = (offset, dtype, shape[0])
+			f.seek(offset + shape[0] * dtype.itemsize)
+	return headers
+
+class Section:
+	"""Sequential reader of one array of a run file that keeps at most about
+	chunk elements in memory."""
+
+	def __init__(self, f, header, chunk):
+		self.f = f
+		self.pos, self.dtype, self.left = header
+		self.chunk = chunk
+		self.buf = np.zeros(0, self.dtype)
+		self.i = 0
+
+	def take(self, k):
+		"""Returns the next k elements."""
+		if self.i + k > len(self.buf):
+			rest = self.buf[self.i:]
+			count = min(self.left, max(self.chunk, k - len(rest)))
+			self.f.seek(self.pos)
+			more = np.fromfile(self.f, self.dtype, count)
+			self.pos += count * self.dtype.itemsize
+			self.left -= count
+			self.buf = np.concatenate((rest, more))
+			self.i = 0
+		out = self.buf[self.i:self.i + k]
+		self.i += k
+		return out
+
+	def takeTerm(self):
+		"""Returns the next "\n"-terminated term of the terms section."""
+		if not isinstance(self.buf, bytes):
+			self.buf = b""
+		end = self.buf.find(b"\n", self.i)
+		while end == -1 and self.left > 0:
+			rest = self.buf[self.i:]
+			count = min(self.left, self.chunk)
+			self.f.seek(self.pos)
+			self.buf = rest + self.f.read(count)
+			self.pos += count
+			self.left -= count
+			self.i = 0
+			end = self.buf.find(b"\n")
+		if end == -1:
+			end = len(self.buf)
+		term = self.buf[self.i:end].decode("utf-8")
+		self.i = end + 1
+		return term
+
+class RunWriter:
+	"""Run generator: maps terms and docnos to integer ids, accumulates
+	(term id, doc id, tf) triples in preallocated arrays and spills them,
+	sorted by term and doc id, as binary runs. With a memory budget it
+	measures the process's resident size and spills before parsing the next
+	document or sorting the run could take it over budget, but not runs of
+	fewer than MIN_RUN triples: it raises MemoryError if the process is over
+	budget with no more buffered than that. With a triple budget it spills
+	whenever that many triples are buffered."""
+
+	def __init__(self, runDir, runPrefix, positional=False, memory=None, maxTriples=None,
+		capacity=None):
+		"""
+		Args:
+		    runDir: directory the runs and manifest are written to
+		    runPrefix: file name prefix, unique per run generator
+		    positional: True if termfreq values are [tf, pos1, pos2, ...]
+		    memory: bytes the whole process may use, None for unlimited
+		    maxTriples: most triples held in memory, None for unlimited
+		    capacity: triples the buffers hold within the memory budget, see
+		    bufferCapacity(); measured now if None
+		"""
+		self.runDir = runDir if runDir[-1] == "/" else runDir + "/"
+		self.runPrefix = runPrefix
+		self.positional = positional
+		self.memory = memory
+		self.terms = {}
+		self.termList = []
+		self.numDocs = 0
+		self.docFile = open(self.runDir + runPrefix + "docs.txt", "w")
+		self.runs = []
+		# Untouched pages of np.empty are not resident, so the buffers can be
+		# sized for the whole budget up front
+		self.capacity = capacity
+		if memory != None and capacity == None:
+			self.capacity = bufferCapacity(memory, currentRSS())
+		if maxTriples != None:
+			self.capacity = maxTriples if self.capacity == None else min(self.capacity, maxTriples)
+		size = self.capacity if self.capacity != None else GROWTH
+		self.termIds = np.empty(size, TERM_ID)
+		self.docIds = np.empty(size, DOC_ID)
+		self.tfs = np.empty(size, TF)
+		self.positions = array("i")
+		self.n = 0
+
+	def addDocument(self, docno, termfreq):
+		"""Adds the triples of one document.
+		Args:
+		    docno: document id
+		    termfreq: dict from term to tf, or to [tf, pos1, ...] if positional
+		"""
+		docId = self.numDocs
+		self.numDocs += 1
+		self.docFile.write(docno + "\n")
+		# Documents without terms still take an id, so that every index type
+		# built from the corpus numbers documents alike
+		if len(termfreq) == 0:
+			return
+		keys = [str(key) for key in termfreq]
+		ids = self.termIdsOf(keys)
+		values = list(termfreq.values())
+		if self.positional:
+			tfs = [v[0] for v in values]
+		else:
+			tfs = values
+
+		start = 0
+		while start < len(ids):
+			if self.n == len(self.termIds):
+				if self.capacity != None:
+					self.spill()
+					# The document goes on in the next run, whose term ids
+					# start over
+					ids[start:] = self.termIdsOf(keys[start:])
+				else:
+					self.grow()
+			k = min(len(ids) - start, len(self.termIds) - self.n)
+			self.termIds[self.n:self.n + k] = ids[start:start + k]
+			self.docIds[self.n:self.n + k] = docId
+			self.tfs[self.n:self.n + k] = tfs[start:start + k]
+			if self.positional:
+				for v in values[start:start + k]:
+					self.positions.extend(v[1:])
+			self.n += k
+			start += k
+		self.makeRoom(0)
+
+	def termIdsOf(self, keys):
+		"""Returns:
+		    the current run's term ids of keys, numbering new terms
+		"""
+		terms = self.terms
+		termList = self.termList
+		ids = []
+		for key in keys:
+			if key not in terms:
+				terms[key] = len(termList)
+				termList.append(key)
+			ids.append(terms[key])
+		return ids
+
+	def reserve(self, textBytes):
+		"""Spills first if parsing a document of textBytes could go over
+		budget. Called before each document is parsed."""
+		self.makeRoom(PARSE_BYTES * textBytes)
+
+	def makeRoom(self, extra):
+		"""Spills if the process could not take extra bytes within its memory
+		budget, once at least MIN_RUN triples are buffered. Smaller runs
+		would only multiply the runs and merge passes.
+		Raises:
+		    MemoryError: the process is over budget with at most MIN_RUN
+		    triples buffered
+		"""
+		if self.fits(extra):
+			return
+		if self.n >= MIN_RUN:
+			self.spill()
+		rss = currentRSS()
+		if rss >= self.memory:
+			raise MemoryError(budgetMessage(self.memory, rss))
+
+	def fits(self, extra):
+		"""True if the process can take extra bytes and still sort the
+		buffered run within its memory budget."""
+		if self.memory == None:
+			return True
+		spillBytes = self.n * SPILL_TRIPLE_BYTES + len(self.positions) * SPILL_POSITION_BYTES
+		return currentRSS() + spillBytes + extra < self.memory
+
+	def grow(self):
+		size = 2 * len(self.termIds)
+		for name in ("termIds", "docIds", "tfs"):
+			old = getattr(self, name)
+			new = np.empty(size, old.dtype)
+			new[:self.n] = old[:self.n]
+			setattr(self, name, new)
+
+	def spill(self):
+		"""Sorts the buffered triples by term and doc id and writes them as
+		the next run."""
+		if self.n == 0:
+			return
+		n = self.n
+		termIds = self.termIds[:n]
+		docIds = self.docIds[:n]
+		tfs = self.tfs[:n]
+
+		# Rank the run's distinct terms in string order
+		present = np.unique(termIds)
+		termList = self.termList
+		sortedTerms = sorted(present.tolist(), key=termList.__getitem__)
+		rank = np.empty(len(termList), TERM_ID)
+		rank[sortedTerms] = np.arange(len(sortedTerms), dtype=TERM_ID)
+		ranks = rank[termIds]
+		order = np.lexsort((docIds, ranks))
+
+		counts = np.bincount(ranks, minlength=len(sortedTerms)).astype(np.int64)
+		termBlob = "\n".join(termList[t] for t in sortedTerms).encode("utf-8")
+		if self.positional:
+			# Move each posting's positions along with it: the i-th sorted
+			# position comes from its posting's old start plus i minus its
+			# new start
+			positions = np.frombuffer(self.positions, dtype=POSITION)
+			index = np.int32 if len(positions) < 2 ** 31 else np.int64
+			sortedTfs = tfs[order]
+			oldStarts = np.cumsum(tfs, dtype=index)
+			oldStarts -= tfs
+			newStarts = np.cumsum(sortedTfs, dtype=index)
+			newStarts -= sortedTfs
+			shift = oldStarts[order]
+			shift -= newStarts
+			del oldStarts, newStarts
+			source = np.repeat(shift, sortedTfs)
+			del shift
+			source += np.arange(len(positions), dtype=index)
+			positions = positions[source]
+			del source
+		else:
+			positions = np.zeros(0, POSITION)
+
+		name = self.runPrefix + "run%s" % len(self.runs)
+		writeArrays(self.runDir + name, (np.frombuffer(termBlob, dtype=np.uint8), counts,
+			docIds[order], tfs[order], positions))
+		self.runs.append({"file": name, "triples": n, "terms": len(sortedTerms)})
+		self.n = 0
+		self.positions = array("i")
+		# Term ids only need to be stable within a run
+		self.terms = {}
+		self.termList = []
+
+	def close(self):
+		"""Spills what is left and writes the manifest.
+		Returns:
+		    manifest file name
+		"""
+		self.spill()
+		self.docFile.close()
+		name = self.runPrefix + "manifest.json"
+		with open(self.runDir + name, "w") as f:
+			json.dump({"positional": self.positional, "runs": self.runs,
+				"docs": self.runPrefix + "docs.txt", "numDocs": self.numDocs}, f)
+		return name
+
+class Run:
+	"""Reader of one run file whose doc ids are shifted by docBase."""
+
+	def __init__(self, path, docBase, chunk=CHUNK):
+		self.path = path
+		self.docBase = docBase
+		self.chunk = chunk
+
+	def __iter__(self):
+		"""Yields (term, doc ids, tfs, positions) per term, in term order."""
+		headers = arrayHeaders(self.path)
+		with open(self.path, "rb") as f:
+			terms, counts, docs, tfs, positions = [Section(f, headers[name], self.chunk)
+				for name in ARRAYS]
+			positional = headers["positions"][2] > 0
+			for i in range(headers["counts"][2]):
+				term = terms.takeTerm()
+				count = int(counts.take(1)[0])
+				termDocs = docs.take(count) + self.docBase
+				termTfs = tfs.take(count)
+				termPositions = positions.take(int(termTfs.sum())) if positional else None
+				yield term, termDocs, termTfs, termPositions
+
+def loadManifests(runDir, manifests, chunk=CHUNK):
+	"""Lays the run generators' doc id ranges end to end.
+	Args:
+	    runDir: directory holding the runs
+	    manifests: manifest file names, in the order documents are numbered
+	    chunk: elements each run reader buffers per array
+	Returns:
+	    (docnos in global doc id order, Run readers in doc id order)
+	"""
+	docs = []
+	runs = []
+	for name in manifests:
+		with open(runDir + name) as f:
+			manifest = json.load(f)
+		for run in manifest["runs"]:
+			runs.append(Run(runDir + run["file"], len(docs), chunk))
+		with open(runDir + manifest["docs"]) as f:
+			docs.extend(line[:-1] for line in f)
+	return docs, runs
+
+def mergeRuns(runs):
+	"""Merges runs into one posting list per term. Runs must be in doc id
+	order so that concatenating a term's lists keeps them sorted.
+	Args:
+	    runs: Run readers
+	Yields:
+	    (term, doc ids, tfs, positions) in term order
+	"""
+	streams = [((term, i, docs, tfs, positions) for term, docs, tfs, positions in run)
+		for i, run in enumerate(runs)]
+	term = None
+	parts = []
+	for part in heapq.merge(*streams, key=lambda p: (p[0], p[1])):
+		if part[0] != term:
+			if term is not None:
+				yield concat(term, parts)
+			term = part[0]
+			parts = []
+		parts.append(part)
+	if term is not None:
+		yield concat(term, parts)
+
+def concat(term, parts):
+	if len(parts) == 1:
+		return term, parts[0][2], parts[0][3], parts[0][4]
+	positions = None
+	if parts[0][4] is not None:
+		positions = np.concatenate([p[4] for p in parts])
+	return term, np.concatenate([p[2] for p in parts]), np.concatenate([p[3] for p in parts]), \
+		positions
+
+def writeMergedRun(path, merged):
+	"""Writes a merge pass's output as a single run with global doc ids. The
+	arrays are streamed to side files first, so only one posting list is
+	held in memory at a time.
+	Args:
+	    path: run file to write
+	    merged: iterator of (term, doc ids, tfs, positions) in term order
+	"""
+	dtypes = (np.uint8, np.int64, DOC_ID, TF, POSITION)
+	parts = [open(path + "." + name, "wb") for name in ARRAYS]
+	lengths = [0] * len(ARRAYS)
+	for term, docs, tfs, positions in merged:
+		if lengths[1] > 0:
+			parts[0].write(b"\n")
+			lengths[0] += 1
+		term = term.encode("utf-8")
+		arrays = (np.frombuffer(term, dtype=np.uint8), np.array([len(docs)], np.int64),
+			docs, tfs, positions)
+		for k in range(len(ARRAYS)):
+			if arrays[k] is not None:
+				parts[k].write(np.ascontiguousarray(arrays[k], dtypes[k]).tobytes())
+				lengths[k] += len(arrays[k])
+	for f in parts:
+		f.close()
+
+	with open(path, "wb") as f:
+		for k, name in enumerate(ARRAYS):
+			header = {"descr": np.lib.format.dtype_to_descr(np.dtype(dtypes[k])),
+				"fortran_order": False, "shape": (lengths[k],)}
+			np.lib.format.write_array_header_1_0(f, header)
+			with open(path + "." + name, "rb") as part:
+				shutil.copyfileobj(part, f, BUFFER_SIZE)
+			os.remove(path + "." + name)
@@ -0,0 +1,570 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import argparse
+import fcntl
+import itertools
+import heapq
+import json
+import math
+import os
+import re
+import shutil
+import subprocess
+import sys
+from array import array
+import numpy as np
+import postings
+import stems
+
+# A segmented index keeps each index type in its own directory,
+# <index-dir>/<index-type>/, holding immutable segments (seg-NNNNNN.idx with
+# its .stats sidecar, seg-NNNNNN-lexicon.txt and, for stem, its .stems table) and segments.json, which
+# lists the live segments in ingest order:
+#   {"generation": 3, "nextSegment": 5,
+#    "segments": [{"name": "seg-000004", "docs": 1523, "files": [...]}, ...]}
+# generation changes whenever the live segments do. The manifest is
+# replaced atomically, so readers never see it half written; writers update
+# it under segments.lock. A document's length is in its segment's .stats
+# sidecar, but its tf-idf norm depends on the global idf, which every
+# append changes. The first reader of a generation that needs the norms
+# sums them over the posting lists and saves them, with the lengths, in
+# segments-<generation>.stats, and those of <type>-filtered, whose lengths
+# and N only count its terms, in segments-<generation>-filtered.stats; the
+# format is postings' statistics sidecar without idf (see writeStats).
+# These files depend only on the generation's segments, so they are never
+# out of date, and later readers of the generation read no posting list.
+# An index built in one piece (<index-dir>/<type>.idx) has a <type>.files
+# sidecar listing its TREC files, one per line, so the first --append can
+# take it over as the first segment (see adoptIndex).
+MANIFEST = "segments.json"
+FILES_SUFFIX = ".files"
+LOCK = "segments.lock"
+MERGE_LOCK = "merge.lock"
+STATS_PREFIX = "segments"
+# Tiered merge policy: a segment's tier is floor(log(docs) / log(MERGE_FACTOR))
+# and MERGE_FACTOR consecutive segments of one tier are merged into one
+MERGE_FACTOR = 4
+# <type>-filtered keeps the terms with at least FILTERED_MIN_DF documents
+FILTERED = "-filtered"
+FILTERED_MIN_DF = 2
+# Times a reader re-reads the manifest when a merge removes a segment
+# between reading the manifest and opening the segment
+OPEN_ATTEMPTS = 5
+
+def segmentDir(indexDir, indexType):
+	"""Directory of an index type's segments."""
+	return os.path.join(indexDir, indexType)
+
+def segmentPath(directory, name):
+	"""Path of a segment's index file."""
+	return os.path.join(directory, name + ".idx")
+
+def lexiconPath(directory, name):
+	"""Path of a segment's lexicon file."""
+	return os.path.join(directory, name + "-lexicon.txt")
+
+def isSegmented(indexDir, indexType):
+	"""Checks whether indexType (or, for <type>-filtered, its base type) was
+	built with build.py --append."""
+	if indexType.endswith(FILTERED):
+		indexType = indexType[:-len(FILTERED)]
+	return os.path.exists(os.path.join(segmentDir(indexDir, indexType), MANIFEST))
+
+def liveSegments(indexDir, indexType):
+	"""Returns:
+	    paths of the index files of an index type's live segments
+	"""
+	directory = segmentDir(indexDir, indexType)
+	return [segmentPath(directory, segment["name"]) for segment in readManifest(directory)["segments"]]
+
+def acquireLock(path, blocking=True):
+	"""Takes an exclusive lock on path, creating it if needed.
+	Returns:
+	    the open lock file (the lock is held until it is closed), or None if
+	    blocking is False and another process holds the lock
+	"""
+	f = open(path, "a")
+	try:
+		fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+	except BlockingIOError:
+		f.close()
+		return None
+	return f
+
+def readManifest(directory):
+	"""Reads segments.json, or an empty manifest if there is none yet."""
+	path = os.path.join(directory, MANIFEST)
+	if not os.path.exists(path):
+		return {"generation": 0, "nextSegment": 0, "segments": []}
+	with open(path) as f:
+		return json.load(f)
+
+def writeManifest(directory, manifest):
+	"""Atomically replaces segments.json. Callers hold segments.lock."""
+	path = os.path.join(directory, MANIFEST)
+	with open(path + ".tmp", "w") as f:
+		json.dump(manifest, f)
+	os.replace(path + ".tmp", path)
+
+def indexedFiles(directory):
+	"""Returns:
+	    set of the TREC file names held by the live segments
+	"""
+	return set(f for segment in readManifest(directory)["segments"] for f in segment["files"])
+
+def filesPath(indexFile):
+	"""Path of the TREC file list of an index built in one piece."""
+	return os.path.splitext(indexFile)[0] + FILES_SUFFIX
+
+def writeFiles(indexFile, files):
+	"""Records the TREC file names an index was built from."""
+	with open(filesPath(indexFile) + ".tmp", "w") as f:
+		for name in files:
+			f.write(name + "\n")
+	os.replace(filesPath(indexFile) + ".tmp", filesPath(indexFile))
+
+def adoptIndex(indexDir, indexType):
+	"""Makes an index built in one piece the first segment of its type, so
+	that appends add to its documents. Its files are hard-linked (copied
+	across filesystems) into the segment directory and left in place.
+	Returns:
+	    name of the segment
+	Raises:
+	    ValueError if the index has no record of its TREC files
+	"""
+	indexFile = postings.indexPath(indexDir, indexType)
+	if not os.path.exists(filesPath(indexFile)):
+		raise ValueError("{} was built without a record of its TREC files; rebuild it, or append "
+			"to an empty output directory".format(indexFile))
+	with open(filesPath(indexFile)) as f:
+		files = [line[:-1] for line in f]
+	directory = segmentDir(indexDir, indexType)
+	if not os.path.exists(directory):
+		os.makedirs(directory)
+	name = newSegment(directory)
+	reader = postings.IndexReader(indexFile)
+	numDocs = len(reader.docs)
+	with open(lexiconPath(directory, name), "w") as lexicon:
+		for term in reader:
+			lexicon.write(term + "\n")
+	reader.close()
+	segmentFile = segmentPath(directory, name)
+	for source, target in [(indexFile, segmentFile),
+		(postings.statsPath(indexFile), postings.statsPath(segmentFile)),
+		(stems.tablePath(indexFile), stems.tablePath(segmentFile))]:
+		if not os.path.exists(source):
+			continue
+		try:
+			os.link(source, target)
+		except OSError:
+			shutil.copyfile(source, target)
+	addSegment(directory, name, numDocs, files)
+	return name
+
+def newSegment(directory):
+	"""Reserves the name of a new segment."""
+	lock = acquireLock(os.path.join(directory, LOCK))
+	try:
+		manifest = readManifest(directory)
+		name = "seg-%06d" % manifest["nextSegment"]
+		manifest["nextSegment"] += 1
+		writeManifest(directory, manifest)
+	finally:
+		lock.close()
+	return name
+
+def addSegment(directory, name, numDocs, files):
+	"""Makes a written segment live.
+	Args:
+	    name: name reserved by newSegment()
+	    numDocs: number of documents in the segment
+	    files: TREC file names the segment was built from
+	"""
+	lock = acquireLock(os.path.join(directory, LOCK))
+	try:
+		manifest = readManifest(directory)
+		manifest["segments"].append({"name": name, "docs": numDocs, "files": files})
+		manifest["generation"] += 1
+		writeManifest(directory, manifest)
+	finally:
+		lock.close()
+
+def statsPath(prefix, generation, minDf=1):
+	"""Path of the statistics of one generation of a segmented or sharded
+	index, read whole or, with minDf > 1, as <type>-filtered."""
+	return "%s-%d%s.stats" % (prefix, generation, FILTERED if minDf > 1 else "")
+
+def readStats(path):
+	"""Returns:
+	    postings.IndexStats, or None if the statistics were not written
+	"""
+	try:
+		return postings.IndexStats(path)
+	except FileNotFoundError:
+		return None
+
+def writeStats(prefix, generation, minDf, lengths, norms):
+	"""Writes the document lengths and tf-idf norms of a generation of a
+	segmented or sharded index, and removes those of older ones.
+	Args:
+	    lengths: array of total tf per doc
+	    norms: float64 array of sum of (tf * idf)^2 per doc
+	"""
+	path = statsPath(prefix, generation, minDf)
+	postings.writeStats(path, array("d"), np.asarray(lengths, dtype=np.uint32), norms)
+	os.replace(path + postings.TEMP_SUFFIX, path)
+	removeStats(prefix, generation)
+
+def removeStats(prefix, generation=None):
+	"""Deletes the statistics of the generations before generation, or of
+	all of them."""
+	directory, name = os.path.split(prefix)
+	pattern = re.compile(re.escape(name) + r"-(\d+)(?:" + FILTERED + r")?\.stats$")
+	for f in os.listdir(directory or "."):
+		match = pattern.match(f)
+		if match != None and (generation == None or int(match.group(1)) < generation):
+			os.remove(os.path.join(directory, f))
+
+def tier(numDocs, factor):
+	return int(math.log(max(numDocs, 1)) / math.log(factor))
+
+def findMerge(segments, factor=MERGE_FACTOR):
+	"""Applies the tiered merge policy.
+	Args:
+	    segments: live segments, in manifest order
+	Returns:
+	    (start, end) of the first factor consecutive segments of one tier, or
+	    None if there is nothing to merge
+	"""
+	start = 0
+	for i in range(1, len(segments) + 1):
+		if i == len(segments) or tier(segments[i]["docs"], factor) != tier(segments[start]["docs"], factor):
+			if i - start >= factor:
+				return start, start + factor
+			start = i
+	return None
+
+def mergeSegments(directory, names, name):
+	"""Writes the union of segments as a new segment. Documents keep their
+	order, so each segment's doc ids are shifted by the documents before it.
+	Args:
+	    names: segments to merge, in manifest order
+	    name: name reserved by newSegment() for the merged segment
+	"""
+	readers = [postings.IndexReader(segmentPath(directory, n)) for n in names]
+	writer = postings.IndexWriter(segmentPath(directory, name), readers[0].indexType,
+		positional=readers[0].positional, codecName=readers[0].codecName)
+	bases = []
+	for reader in readers:
+		bases.append(len(writer.docs))
+		for docno in reader.docs:
+			writer.docId(docno)
+
+	lexicon = open(lexiconPath(directory, name), "w")
+	terms = heapq.merge(*[zip(reader, itertools.repeat(i)) for i, reader in enumerate(readers)])
+	for term, holders in itertools.groupby(terms, key=lambda entry: entry[0]):
+		pList = []
+		for _, i in holders:
+			base = bases[i]
+			pList.extend((base + docid, tf, positions)
+				for docid, tf, positions in readers[i].rawPostings(term))
+		writer.addPostings(term, pList)
+		lexicon.write(term + "\n")
+	writer.close()
+	lexicon.close()
+	for reader in readers:
+		reader.close()
+	tables = [stems.tablePath(segmentPath(directory, n)) for n in names]
+	if any(os.path.exists(path) for path in tables):
+		stems.writeTable(stems.tablePath(segmentPath(directory, name)), stems.readTables(tables))
+
+def removeSegment(directory, name):
+	"""Deletes a segment's files. Readers that have it open keep reading it."""
+	indexFile = segmentPath(directory, name)
+	for path in (indexFile, postings.statsPath(indexFile), stems.tablePath(indexFile),
+		lexiconPath(directory, name)):
+		if os.path.exists(path):
+			os.remove(path)
+
+def mergeAll(directory, factor=MERGE_FACTOR):
+	"""Merges segments until the merge policy finds nothing to merge. Only
+	one process merges a directory at a time; appends may run meanwhile.
+	Returns:
+	    list of (merged segment names, new segment name)
+	"""
+	mergeLock = acquireLock(os.path.join(directory, MERGE_LOCK), blocking=False)
+	if mergeLock == None:
+		return []
+	merges = []
+	try:
+		while True:
+			segments = readManifest(directory)["segments"]
+			window = findMerge(segments, factor)
+			if window == None:
+				break
+			group = segments[window[0]:window[1]]
+			names = [segment["name"] for segment in group]
+			name = newSegment(directory)
+			mergeSegments(directory, names, name)
+
+			# Appends only add segments at the end, so the group is still
+			# there, in one piece
+			lock = acquireLock(os.path.join(directory, LOCK))
+			try:
+				manifest = readManifest(directory)
+				live = manifest["segments"]
+				start = [segment["name"] for segment in live].index(names[0])
+				live[start:start + len(names)] = [{"name": name,
+					"docs": sum(segment["docs"] for segment in group),
+					"files": [f for segment in group for f in segment["files"]]}]
+				# Merging keeps the documents, their order and the counts, so
+				# the statistics carry over to the new generation
+				prefix = os.path.join(directory, STATS_PREFIX)
+				for minDf in (1, FILTERED_MIN_DF):
+					old = statsPath(prefix, manifest["generation"], minDf)
+					if os.path.exists(old):
+						os.link(old, statsPath(prefix, manifest["generation"] + 1, minDf))
+				manifest["generation"] += 1
+				writeManifest(directory, manifest)
+			finally:
+				lock.close()
+			removeStats(prefix, manifest["generation"])
+			for n in names:
+				removeSegment(directory, n)
+			merges.append((names, name))
+	finally:
+		mergeLock.close()
+	return merges
+
+def startMerge(directory, factor=MERGE_FACTOR):
+	"""Runs mergeAll() in a detached background process."""
+	subprocess.Popen([sys.executable, os.path.abspath(__file__), "merge", directory,
+		"--factor", str(factor)], stdout=subprocess.DEVNULL, start_new_session=True)
+
+class SegmentSet:
+	"""Reads the live segments of a segmented index as one index. df and cf
+	are summed over the segments and idf and tf-idf norms use those global
+	counts, so scores match a single index over the same documents.
+	minDf > 1 keeps only terms with at least that global df, which is how
+	<type>-filtered is read. Document lengths, norms and the N of 
+	<type>-filtered come from the generation's statistics (see writeStats)
+	when they were saved. Otherwise the lengths are the segments' own, and
+	the norms, or the lengths and N of <type>-filtered, are summed from the
+	posting lists when first needed and saved for later readers."""
+
+	def __init__(self, directory, minDf=1):
+		for attempt in range(OPEN_ATTEMPTS):
+			manifest = readManifest(directory)
+			readers = []
+			try:
+				for segment in manifest["segments"]:
+					readers.append(postings.IndexReader(segmentPath(directory, segment["name"])))
+				break
+			except FileNotFoundError:
+				for reader in readers:
+					reader.close()
+				if attempt == OPEN_ATTEMPTS - 1:
+					raise
+		self.generation = manifest["generation"]
+		self.statsPrefix = os.path.join(directory, STATS_PREFIX)
+		self.load(readers, minDf, stats=readStats(statsPath(self.statsPrefix, self.generation, minDf)))
+
+	def load(self, readers, minDf, counts=None, N=None, stats=None):
+		"""Reads a list of indexes as one.
+		Args:
+		    readers: postings.IndexReader per part, in doc id order
+		    counts: dict from term to (df, cf) over all parts, or None to sum
+		    them from the parts' dictionaries
+		    N: number of documents with terms over all parts, or None to sum it
+		    stats: postings.IndexStats of the parts' documents (see 
+		    writeStats), or None to take the lengths from the parts' own
+		    statistics and sum the rest from the posting lists when needed
+		"""
+		self.readers = readers
+		self.positional = bool(readers) and readers[0].positional
+		self.minDf = minDf
+		# Parts hold consecutive documents, so a part's doc ids are shifted
+		# by the documents of the parts before it
+		self.bases = []
+		self.docs = []
+		for reader in readers:
+			self.bases.append(len(self.docs))
+			self.docs.extend(reader.docs)
+
+		terms = {}
+		for i, reader in enumerate(readers):
+			for term in reader:
+				if term not in terms:
+					terms[term] = [0, 0, []]
+				entry = terms[term]
+				if counts == None:
+					entry[0] += reader.df(term)
+					entry[1] += reader.cf(term)
+				entry[2].append(i)
+		if counts != None:
+			for term, entry in terms.items():
+				entry[0], entry[1] = counts[term]
+		self.terms = {term: terms[term] for term in sorted(terms) if terms[term][0] >= minDf}
+		self.N = sum(reader.N for reader in readers) if N == None else N
+		# uint32 lengths and float64 norms indexed by doc id, None until known
+		self.lengths = None
+		self.norms = None
+		if stats != None and stats.numDocs == len(self.docs):
+			self.lengths = np.frombuffer(stats.lengths, dtype=np.uint32)
+			self.norms = np.frombuffer(stats.norms, dtype=np.float64)
+		elif minDf <= 1 and all(reader.stats != None for reader in readers):
+			# A document's length does not depend on the other parts
+			self.lengths = np.concatenate([np.frombuffer(reader.stats.lengths, dtype=np.uint32)
+				for reader in readers] + [np.zeros(0, dtype=np.uint32)])
+		elif minDf > 1:
+			self.saveStats()
+		if minDf > 1:
+			# Only documents with a remaining term count
+			self.N = int(np.count_nonzero(self.lengths))
+
+	def __contains__(self, term):
+		return term in self.terms
+
+	def __len__(self):
+		return len(self.terms)
+
+	def __iter__(self):
+		return iter(self.terms)
+
+	def df(self, term):
+		return self.terms[term][0]
+
+	def cf(self, term):
+		return self.terms[term][1]
+
+	def idf(self, term):
+		"""log10(N / df) over all live segments."""
+		return math.log10(float(self.N) / self.terms[term][0])
+
+	def docLengths(self, norms=True):
+		"""Args:
+		    norms: False if only the lengths are needed; the norms are then
+		    None rather than summed from the posting lists
+		Returns:
+		    dict from doc id to (total tf, sum of (tf * idf)^2) of the docs
+		    with terms, with global idf
+		"""
+		if len(self.readers) == 1 and self.minDf <= 1 and self.readers[0].stats != None:
+			return self.readers[0].docLengths()
+		if self.lengths is None or (norms and self.norms is None):
+			self.saveStats()
+		lengths = self.lengths.tolist()
+		normList = self.norms.tolist() if norms else itertools.repeat(None, len(lengths))
+		return {d: (length, norm) for d, (length, norm) in enumerate(zip(lengths, normList)) if length}
+
+	def saveStats(self):
+		"""Sums the lengths and norms from the posting lists and saves them
+		as the generation's statistics. An index the process cannot write
+		to only keeps them in memory."""
+		self.lengths, self.norms = self.computeLengths()
+		try:
+			writeStats(self.statsPrefix, self.generation, self.minDf, self.lengths, self.norms)
+		except OSError:
+			pass
+
+	def computeLengths(self):
+		"""Sums document lengths and tf-idf norms, with global idf, over the
+		posting lists of the set's terms. As in postings.IndexWriter, each
+		doc's norm is kept as sums of tf^2, tf^2 * log10(df) and 
+		tf^2 * log10(df)^2, since the N of <type>-filtered is only known 
+		once every list is read.
+		Returns:
+		    (uint32 array of total tf, float64 array of sum of (tf * idf)^2),
+		    indexed by doc id
+		"""
+		lengths = np.zeros(len(self.docs), dtype=np.int64)
+		sq = np.zeros(len(self.docs))
+		sqLog = np.zeros(len(self.docs))
+		sqLog2 = np.zeros(len(self.docs))
+		for term in self.terms:
+			docids, tfs = self.postingArrays(term)
+			logDf = math.log10(self.terms[term][0])
+			# A term's doc ids are distinct, so fancy indexing adds once each
+			lengths[docids] += tfs
+			w = (tfs * tfs).astype(np.float64)
+			sq[docids] += w
+			sqLog[docids] += w * logDf
+			sqLog2[docids] += w * (logDf * logDf)
+		N = self.N if self.minDf <= 1 else np.count_nonzero(lengths)
+		logN = math.log10(N) if N else 0.0
+		return lengths.astype(np.uint32), sq * logN * logN - 2 * logN * sqLog + sqLog2
+
+	def postings(self, term):
+		"""Concatenates a term's posting lists from the segments holding it.
+		Returns:
+		    list of (docno, tf, positions), positions is None unless positional
+		"""
+		docs = self.docs
+		return [(docs[docid], tf, positions) for docid, tf, positions in self.rawPostings(term)]
+
+	def rawPostings(self, term):
+		"""Concatenates a term's posting lists without resolving doc ids.
+		Returns:
+		    list of (docid, tf, positions) with doc ids global to the set
+		"""
+		pList = []
+		for i in self.terms[term][2]:
+			base = self.bases[i]
+			if base == 0:
+				pList.extend(self.readers[i].rawPostings(term))
+			else:
+				pList.extend((base + docid, tf, positions)
+					for docid, tf, positions in self.readers[i].rawPostings(term))
+		return pList
+
+	def postingArrays(self, term):
+		"""Concatenates a term's doc ids and tfs (see
+		postings.IndexReader.postingArrays).
+		Returns:
+		    (int64 array of doc ids global to the set, int64 array of tfs)
+		"""
+		segments = self.terms[term][2]
+		parts = [self.readers[i].postingArrays(term) for i in segments]
+		return (np.concatenate([self.bases[i] + docids for i, (docids, tfs) in zip(segments, parts)]),
+			np.concatenate([tfs for docids, tfs in parts]))
+
+	def close(self):
+		for reader in self.readers:
+			reader.close()
+
+def openIndex(indexDir, indexType):
+	"""Opens an index for reading, whether it was built in one piece, in
+	segments or in shards.
+	Args:
+	    indexDir: directory holding the index files
+	    indexType: type of index (single, stem, positional, phrase,
+	    phrase-filtered, ...)
+	Returns:
+	    SegmentSet if indexType was built with build.py --append,
+	    shards.ShardSet if it was built with --shards, else
+	    postings.IndexReader
+	"""
+	# shards.py builds on this module
+	import shards
+	if shards.isSharded(indexDir, indexType):
+		return shards.openShards(indexDir, indexType)
+	if isSegmented(indexDir, indexType):
+		if indexType.endswith(FILTERED):
+			return SegmentSet(segmentDir(indexDir, indexType[:-len(FILTERED)]), minDf=FILTERED_MIN_DF)
+		return SegmentSet(segmentDir(indexDir, indexType))
+	return postings.IndexReader(postings.indexPath(indexDir, indexType))
+
+def main():
+	# segments.py merge [segment-dir]
+	parser = argparse.ArgumentParser(description="Maintains a segmented index")
+	parser.add_argument("command", choices=["merge"], help="merge: apply the tiered merge policy")
+	parser.add_argument("directory", help="segment directory, e.g. output/indexes/single")
+	parser.add_argument("--factor", type=int, default=MERGE_FACTOR,
+		help="number of segments of one tier merged at once")
+	args = parser.parse_args()
+	for names, name in mergeAll(args.directory, args.factor):
+		print('Merged {} -> {}'.format(", ".join(names), name))
+
+if __name__== "__main__":
+	main()
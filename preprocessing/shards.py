@@ -0,0 +1,241 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import zlib
+import postings
+import segments
+import stems
+
+# A sharded index (build.py --shards N) partitions the documents by a hash
+# of their docno into N shards. Each shard is an ordinary build of its own
+# documents in <output-dir>/shards/shard-NN/ (indexes/<type>.idx with its
+# .stats sidecar, a lexicon and, for stem, its .stems table), so its
+# statistics are local. <output-dir>/indexes/<type>.shards.json is the
+# top-level manifest:
+#   {"indexType": "single", "shards": 4, "generation": 1, "N": 1765,
+#    "numDocs": 1768,
+#    "parts": [{"dir": "../shards/shard-00", "numDocs": 440, "N": 440,
+#               "files": {"indexes/single.idx": {"bytes": 1234, "sha256": "..."}, ...}},
+#              ...],
+#    "terms": {"term": [df, cf], ...}}
+# N, df and cf are summed over the shards, so readers score exactly as with
+# an unsharded build. Paths are relative to the manifest's directory. Next to
+# it, <type>.shards-<generation>.stats and <type>.shards-<generation>-filtered.stats
+# hold the document lengths and tf-idf norms with global idf (see
+# segments.writeStats), written with the manifest, so opening the shards
+# reads no posting list.
+MANIFEST_SUFFIX = ".shards.json"
+SHARDS_DIR = "shards"
+READ_SIZE = 1 << 20
+
+def shardOf(docno, numShards):
+	"""Shard a document belongs to; stable across processes and machines."""
+	return zlib.crc32(docno.encode("utf-8")) % numShards
+
+def shardDir(outputDir, shard):
+	"""Output directory of one shard's build."""
+	return os.path.join(outputDir, SHARDS_DIR, "shard-%02d" % shard) + "/"
+
+def manifestPath(indexDir, indexType):
+	"""Path of an index type's shard manifest."""
+	return os.path.join(indexDir, indexType + MANIFEST_SUFFIX)
+
+def statsPrefix(indexDir, indexType):
+	"""Prefix of the statistics of an index type's shards (see
+	segments.statsPath)."""
+	return os.path.splitext(manifestPath(indexDir, indexType))[0]
+
+def isSharded(indexDir, indexType):
+	"""Checks whether indexType (or, for <type>-filtered, its base type) was
+	built with build.py --shards."""
+	if indexType.endswith(segments.FILTERED):
+		indexType = indexType[:-len(segments.FILTERED)]
+	return os.path.exists(manifestPath(indexDir, indexType))
+
+def readManifest(indexDir, indexType):
+	with open(manifestPath(indexDir, indexType)) as f:
+		return json.load(f)
+
+def indexFiles(indexDir, indexType):
+	"""Returns:
+	    paths of the index files of an index type's shards
+	"""
+	manifest = readManifest(indexDir, indexType)
+	return [postings.indexPath(os.path.join(indexDir, part["dir"], "indexes"), indexType)
+		for part in manifest["parts"]]
+
+def shardFiles(directory, indexType):
+	"""Returns:
+	    paths, relative to a shard's directory, of the files its build wrote
+	    for indexType
+	"""
+	indexFile = postings.indexPath("indexes", indexType)
+	files = [indexFile, postings.statsPath(indexFile)]
+	for lexicon in (indexType + "-lexicon.txt", "lexicon.txt"):
+		if os.path.exists(os.path.join(directory, lexicon)):
+			files.append(lexicon)
+			break
+	if os.path.exists(os.path.join(directory, stems.tablePath(indexFile))):
+		files.append(stems.tablePath(indexFile))
+	return files
+
+def checksum(path):
+	"""SHA-256 of a file, as a hex string."""
+	digest = hashlib.sha256()
+	with open(path, "rb") as f:
+		for block in iter(lambda: f.read(READ_SIZE), b""):
+			digest.update(block)
+	return digest.hexdigest()
+
+def writeManifest(outputDir, indexType, numShards):
+	"""Sums the shards' counts into the top-level manifest of an index type.
+	Called once every shard has been built.
+	Returns:
+	    the manifest
+	"""
+	indexDir = os.path.join(outputDir, "indexes")
+	if not os.path.exists(indexDir):
+		os.makedirs(indexDir)
+	path = manifestPath(indexDir, indexType)
+	generation = 0
+	if os.path.exists(path):
+		generation = readManifest(indexDir, indexType)["generation"]
+	parts = []
+	counts = {}
+	for shard in range(numShards):
+		directory = shardDir(outputDir, shard)
+		reader = postings.IndexReader(postings.indexPath(directory + "indexes", indexType))
+		for term in reader:
+			if term not in counts:
+				counts[term] = [0, 0]
+			entry = counts[term]
+			entry[0] += reader.df(term)
+			entry[1] += reader.cf(term)
+		parts.append({"dir": os.path.relpath(directory, indexDir), "numDocs": len(reader.docs),
+			"N": reader.N, "files": {f: {"bytes": os.path.getsize(os.path.join(directory, f)),
+				"sha256": checksum(os.path.join(directory, f))} for f in shardFiles(directory, indexType)}})
+		reader.close()
+	manifest = {"indexType": indexType, "shards": numShards, "generation": generation + 1,
+		"N": sum(part["N"] for part in parts), "numDocs": sum(part["numDocs"] for part in parts),
+		"parts": parts, "terms": {term: counts[term] for term in sorted(counts)}}
+	with open(path + ".tmp", "w") as f:
+		json.dump(manifest, f)
+	os.replace(path + ".tmp", path)
+	# Norms need the global idf, so one pass over the shards' posting lists
+	# here saves every reader that pass (opening <type>-filtered without
+	# its statistics already saves them)
+	for minDf in (1, segments.FILTERED_MIN_DF):
+		shardSet = ShardSet(indexDir, indexType, minDf)
+		if shardSet.norms is None:
+			shardSet.saveStats()
+		shardSet.close()
+	return manifest
+
+def verify(outputDir, indexType):
+	"""Checks the shards of an index type against its manifest: file sizes
+	and checksums, that every document is in the shard its docno hashes to
+	and in no other, and that the shards' counts add up to the manifest's.
+	Returns:
+	    list of problems found, one line each
+	"""
+	indexDir = os.path.join(outputDir, "indexes")
+	manifest = readManifest(indexDir, indexType)
+	numShards = manifest["shards"]
+	problems = []
+	if len(manifest["parts"]) != numShards:
+		problems.append("manifest lists {} shards, not {}".format(len(manifest["parts"]), numShards))
+	counts = {}
+	seen = set()
+	N = 0
+	for shard, part in enumerate(manifest["parts"]):
+		directory = os.path.join(indexDir, part["dir"])
+		missing = False
+		for f, expected in sorted(part["files"].items()):
+			path = os.path.join(directory, f)
+			if not os.path.exists(path):
+				problems.append("shard {}: {} is missing".format(shard, f))
+				missing = True
+			elif os.path.getsize(path) != expected["bytes"] or checksum(path) != expected["sha256"]:
+				problems.append("shard {}: {} does not match the manifest".format(shard, f))
+		if missing:
+			continue
+		reader = postings.IndexReader(postings.indexPath(directory + "/indexes", indexType))
+		if len(reader.docs) != part["numDocs"] or reader.N != part["N"]:
+			problems.append("shard {}: {} docs ({} with terms), manifest says {} ({})".format(shard,
+				len(reader.docs), reader.N, part["numDocs"], part["N"]))
+		for docno in reader.docs:
+			if shardOf(docno, numShards) != shard:
+				problems.append("shard {}: {} belongs to shard {}".format(shard, docno,
+					shardOf(docno, numShards)))
+			if docno in seen:
+				problems.append("shard {}: {} is in more than one shard".format(shard, docno))
+			seen.add(docno)
+		for term in reader:
+			if term not in counts:
+				counts[term] = [0, 0]
+			counts[term][0] += reader.df(term)
+			counts[term][1] += reader.cf(term)
+		N += reader.N
+		reader.close()
+	if N != manifest["N"]:
+		problems.append("shards hold {} docs with terms, manifest says {}".format(N, manifest["N"]))
+	if counts != manifest["terms"]:
+		wrong = sum(1 for term in set(counts) | set(manifest["terms"])
+			if counts.get(term) != manifest["terms"].get(term))
+		problems.append("{} terms have other df or cf in the shards than in the manifest".format(wrong))
+	for minDf in (1, segments.FILTERED_MIN_DF):
+		path = segments.statsPath(statsPrefix(indexDir, indexType), manifest["generation"], minDf)
+		if not os.path.exists(path):
+			problems.append("{} is missing".format(os.path.basename(path)))
+	return problems
+
+class ShardSet(segments.SegmentSet):
+	"""Reads the shards of a sharded index as one index, with df, cf and N
+	from the manifest and document lengths and norms from its statistics.
+	Doc ids run through shard 0's documents, then shard 1's, and so on."""
+
+	def __init__(self, indexDir, indexType, minDf=1):
+		manifest = readManifest(indexDir, indexType)
+		self.generation = manifest["generation"]
+		self.statsPrefix = statsPrefix(indexDir, indexType)
+		readers = [postings.IndexReader(path) for path in indexFiles(indexDir, indexType)]
+		self.load(readers, minDf, manifest["terms"], manifest["N"], segments.readStats(
+			segments.statsPath(self.statsPrefix, self.generation, minDf)))
+
+def openShards(indexDir, indexType):
+	"""Opens a sharded index type, or <type>-filtered of one."""
+	if indexType.endswith(segments.FILTERED):
+		return ShardSet(indexDir, indexType[:-len(segments.FILTERED)], minDf=segments.FILTERED_MIN_DF)
+	return ShardSet(indexDir, indexType)
+
+def main():
+	# shards.py manifest [output-dir] [index-type] --shards N
+	# shards.py verify [output-dir] [index-type]
+	parser = argparse.ArgumentParser(description="Maintains a sharded index")
+	parser.add_argument("command", choices=["manifest", "verify"],
+		help="manifest: write the top-level manifest once all shards are built; "
+		"verify: check the shards against it")
+	parser.add_argument("outputDir", help="output directory of the sharded build")
+	parser.add_argument("indexType", help="single, stem, phrase or positional")
+	parser.add_argument("--shards", type=int, help="number of shards (manifest only)")
+	args = parser.parse_args()
+	if args.command == "manifest":
+		if args.shards == None:
+			parser.error("manifest needs --shards")
+		manifest = writeManifest(args.outputDir, args.indexType, args.shards)
+		print('Shards ({}):   {}, {} docs'.format(args.indexType, manifest["shards"], manifest["numDocs"]))
+	else:
+		problems = verify(args.outputDir, args.indexType)
+		for problem in problems:
+			print(problem)
+		print('Problems ({}):   {}'.format(args.indexType, len(problems)))
+		if problems:
+			sys.exit(1)
+
+if __name__== "__main__":
+	main()
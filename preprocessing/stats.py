@@ -6,10 +6,10 @@ import re
 import sys
 import collections
 import heapq
-import ast
 from bs4 import BeautifulSoup
 from string import punctuation
 import nltk
+import postings
 
 def computeStats():
 	indexType = "phrase"
@@ -25,17 +25,16 @@ def computeStats():
 	sumDF = 0
 	dfCount = {}
 
-	indexFile = open(outputDir + "/indexes/" + indexType + ".txt", "r")
-	for line in indexFile.readlines():
+	index = postings.IndexReader(postings.indexPath(outputDir + "/indexes", indexType))
+	for term in index:
 		numTerms += 1
-		posting_list = ast.literal_eval(line.split(" -> ")[1])
-		df = len(posting_list)
+		df = index.df(term)
 		if df > maxDF:
 			maxDF = df
-			maxDFterm = line.split(" -> ")[0]
+			maxDFterm = term
 		if df <= minDF:
 			minDF = df
-			minDFterm = line.split(": ")[0]
+			minDFterm = term
 		if df not in dfCount:
 			dfCount[df] = 0
 		dfCount[df] += 1
@@ -44,6 +43,7 @@ def computeStats():
 			medianDFCount = dfCount[df]
 		sumDF += df
 	meanDF = sumDF/numTerms
+	index.close()
 
 	print("Lexicon size: " + str(numTerms))
 	print("Max DF: " + str(maxDF))
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import functools
+import os
+
+# The stem index is written with a stem table sidecar (<index>.stems): every
+# surface form the build stemmed and its Porter stem, one "surface\tstem"
+# per line in sorted order. Queries stem by looking terms up in it.
+TABLE_SUFFIX = ".stems"
+# Most stems a Stemmer memoizes beyond its table
+CACHE_SIZE = 1 << 16
+
+def tablePath(indexFile):
+	"""Path of the stem table sidecar of an index file."""
+	return os.path.splitext(indexFile)[0] + TABLE_SUFFIX
+
+class Stemmer:
+	"""Porter stemmer that looks surface forms up in a stem table first and
+	memoizes the rest in a bounded LRU cache. nltk is only imported on the
+	first lookup the table cannot answer.
+	Args:
+	    table: dict from surface form to stem, e.g. from readTables()
+	    record: add every stem computed to the table, so that it can be
+	    written out with writeTable(); the table then memoizes every stem and
+	    the cache is not used
+	"""
+
+	def __init__(self, table=None, record=False, cacheSize=CACHE_SIZE):
+		self.table = {} if table == None else table
+		self.record = record
+		self.porter = None
+		self.cached = functools.lru_cache(maxsize=cacheSize)(self.porterStem)
+
+	def load(self):
+		"""Imports nltk now rather than on the first lookup, e.g. before the
+		process measures its footprint."""
+		if self.porter == None:
+			from nltk.stem.porter import PorterStemmer
+			self.porter = PorterStemmer()
+
+	def porterStem(self, token):
+		self.load()
+		return self.porter.stem(token)
+
+	def stem(self, token):
+		"""Returns:
+		    Porter stem of a normalized token
+		"""
+		stem = self.table.get(token)
+		if stem == None:
+			if self.record:
+				stem = self.porterStem(token)
+				self.table[token] = stem
+			else:
+				stem = self.cached(token)
+		return stem
+
+def writeTable(path, table):
+	"""Writes a stem table, sorted by surface form.
+	Args:
+	    table: dict from surface form to stem
+	"""
+	with open(path, "w") as f:
+		for token in sorted(table):
+			f.write(token + "\t" + table[token] + "\n")
+
+def readTables(paths):
+	"""Reads stem tables into one dict. Missing files are skipped.
+	Args:
+	    paths: stem table paths
+	Returns:
+	    dict from surface form to stem
+	"""
+	table = {}
+	for path in paths:
+		if not os.path.exists(path):
+			continue
+		with open(path) as f:
+			for line in f:
+				token, stem = line[:-1].split("\t")
+				table[token] = stem
+	return table
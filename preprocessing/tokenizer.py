@@ -0,0 +1,318 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import re
+from string import punctuation
+
+def normalizeDate(match):
+	"""Change date tokens to MM-DD-YYYY format.
+	Args:
+	    match: tokens that match date regex in findSpecialTokens.
+	Returns:
+	    formated date string
+	"""
+	months = {"Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6, "Jul": 7,
+	"Aug": 8, "Sep": 9,  "Oct": 10, "Nov": 11, "Dec": 12, "January": 1,  "February": 2,
+	"March": 3, "April": 4, "May": 5, "June": 6, "July": 7, "August": 8,
+	"September": 9, "October": 10, "November": 11, "December": 12}
+	month30Day = set([4, 6, 9, 11])
+	month31Day = set([1, 3, 5, 7, 8, 10, 12])
+
+	# Date format: Month Name DD, YYY
+	if match[0] != '':
+		month = months[match[0].replace(".", "")]
+		day = int(match[1])
+		year = int(match[2])
+
+	# Date format: MM/DD/YYYY || MM-DD-YYYY
+	elif match[3] != '':
+		month = int(match[4])
+		day = int(match[5])
+		year = int(match[6])
+
+	# Rule out invalid dates
+	if (month < 1 or month > 12) or (month == 2 and (day < 1 or day > 29)) or \
+		(month in month30Day and (day < 1 or day > 30)) or \
+		(month in month31Day and (day < 1 or day > 31)):
+			return
+
+	# Change YY to YYYY
+	if len(str(year)) == 2:
+		if year < 19:
+			year = int('20' + str(year))
+		else:
+			year = int('19' + str(year))
+	if year < 1918 or year > 2018:
+		return
+
+	month = str(month) if len(str(month)) == 2 else '0' + str(month)
+	day = str(day) if len(str(day)) == 2 else '0' + str(day)
+	return (month + '-' + day + '-' + str(year))
+
+def normalize(token):
+	"""Perform case folding and punctuation stripping.
+	Args:
+	    token: single token
+	Returns:
+	    normalized token
+	"""
+	token = token.lower()							# Lowercase words
+	token = token.replace(',', '')		# Remove commas
+	token = token.strip(punctuation)	# Remove punctuation
+	return token
+
+def replaceEscSeq(line):
+	"""Process escape sequences.
+	Args:
+	    line: line from data file data.
+	Returns:
+	    line with "&<seq>; replaced with symbol it represents 
+	"""
+	match = re.search(r'(&[a-z]+;)', line)
+	if match:
+		line = line.replace('&blank;', '&').replace('blank;', '&') \
+		.replace('&cir;','○').replace('&hyph;', '-').replace('&sect;','§') \
+		.replace('&times;', '×').replace('&racute;', 'r')
+	return line
+
+PREFIXES = set(['a', 'an', 'ante', 'anti', 'auto', 'circum', 'co', 'com',
+	'con', 'contra', 'de', 'dis', 'en', 'ex', 'extra', 'hetero', 'homo',
+	'inter', 'intra','kilo', 'macro', 'micro', 'milli', 'non', 'pico', 'pseudo',
+	'pre', 'post', 're', 'sub', 'syn', 'trans', 'tri', 'un', 'uni', 'ultra'])
+
+def hyphenTokens(text, groups, stops):
+	"""Hyphenated, Alpha-Digit, and Digit-Alpha terms"""
+	token = normalize(groups[0])
+	split = token.split("-")
+	tokens = []
+	if len(split) == 2 and split[0].isalpha() and split[1].isdigit():
+		# Requirement: alphabets stored as a separate term if 3+ letters
+		if len(split[0]) >= 3:
+			tokens.append(normalize(split[0]))
+	elif len(split) == 2 and split[0].isdigit() and split[1].isalpha():
+		if len(split[1]) >= 3:
+			tokens.append(split[1])
+	elif split[0] in PREFIXES:
+		tokens.append(split[1])
+	else:
+		for s in split:
+			if s not in stops:
+				tokens.append(s)
+	tokens.append(token.replace("-", ""))
+	return tokens
+
+def dateTokens(text, groups, stops):
+	token = normalizeDate(groups)
+	return [token] if token != None else []
+
+# Special token patterns in the order findSpecialTokens has always applied
+# them, with the function that turns a match into index terms.
+SPECIAL_TOKENS = [
+	("email", r'([a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+)',
+		lambda text, groups, stops: [normalize(text)]),
+	("ip", r'\b(?:\d{2,3}\.){3}\d{2,3}\b',
+		lambda text, groups, stops: [normalize(text)]),
+	("abbrev", r'\b[A-Z][a-zA-Z\.]{,1}[A-Z]\b\.?',
+		lambda text, groups, stops: [normalize(text).replace('.', '')]),
+	("date", r'(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sept|Oct|Nov|Dec[.]?|January|February|March|April|May|June|July|August|September|October|November|December)\s(\d+),\s(\d+)|((\d+)(?:/|-)(\d+)(?:/|-)(\d+))',
+		dateTokens),
+	("decimal", r'(§|\$)*(\d+\.\d+)',
+		lambda text, groups, stops: [groups[0] + str(int(round(float(groups[1]))))]),
+	("hyphen", r'(((\w+)-)+(\w+))', hyphenTokens),
+	("url", r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+',
+		lambda text, groups, stops: [text]),
+	("fileext", r'(\w*)\.(jpg|JPG|gif|GIF|doc|DOC|pdf|PDF|html|HTML)',
+		lambda text, groups, stops: [(groups[0], groups[1])]),
+]
+PATTERNS = [re.compile(p) for name, p, convert in SPECIAL_TOKENS]
+CONVERTERS = [convert for name, p, convert in SPECIAL_TOKENS]
+
+MONTH = re.compile(r'Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec')
+UPPER = re.compile(r'[A-Z]')
+DIGIT_DOT_DIGIT = re.compile(r'\d\.\d')
+DIGIT_SEP_DIGIT = re.compile(r'\d[/-]\d')
+WORD_HYPHEN_WORD = re.compile(r'\w-\w')
+FILE_EXTENSIONS = (".jpg", ".JPG", ".gif", ".GIF", ".doc", ".DOC", ".pdf", ".PDF",
+	".html", ".HTML")
+
+def candidates(line):
+	"""Cheap necessary conditions for each special token pattern.
+	Args:
+	    line: line in data file
+	Returns:
+	    bitmask with bit k set if pattern k could match somewhere in line
+	"""
+	mask = 0
+	dot = "." in line
+	hyphen = "-" in line and WORD_HYPHEN_WORD.search(line) != None
+	if "@" in line:
+		mask |= 1
+	if dot and DIGIT_DOT_DIGIT.search(line) != None:
+		mask |= 2 | 16
+	if UPPER.search(line) != None:
+		mask |= 4
+	if (("-" in line or "/" in line) and DIGIT_SEP_DIGIT.search(line) != None) or \
+		("," in line and MONTH.search(line) != None):
+		mask |= 8
+	if hyphen:
+		mask |= 32
+	if "http" in line:
+		mask |= 64
+	if dot and any(e in line for e in FILE_EXTENSIONS):
+		mask |= 128
+	return mask
+
+class Scanner:
+	"""One alternation of the patterns selected by a candidate mask, tried in
+	priority order at each position. groups[k] is the range of match groups
+	that belongs to pattern k and higher[k] matches any selected pattern that
+	the cascade applies before k."""
+
+	def __init__(self, mask):
+		kinds = [k for k in range(len(SPECIAL_TOKENS)) if mask & (1 << k)]
+		self.regex = re.compile("|".join("(?P<k%d>%s)" % (k, SPECIAL_TOKENS[k][1]) for k in kinds))
+		self.kind = {}
+		self.groups = {}
+		self.higher = {}
+		group = 1
+		for i, k in enumerate(kinds):
+			self.kind["k%d" % k] = k
+			self.groups[k] = (group + 1, group + 1 + PATTERNS[k].groups)
+			group += PATTERNS[k].groups + 1
+			if i > 0:
+				self.higher[k] = re.compile("|".join("(?:%s)" % SPECIAL_TOKENS[h][1] for h in kinds[:i]))
+
+SCANNERS = {}
+
+def getScanner(mask):
+	"""Compiles (once) the scanner for a candidate mask."""
+	if mask not in SCANNERS:
+		SCANNERS[mask] = Scanner(mask)
+	return SCANNERS[mask]
+
+def scanSpecialTokensCascade(line, stops):
+	"""Applies the special token patterns one after another, removing each
+	pattern's matches before the next one runs.
+	Args:
+	    line: line in data file
+	    stops: set of stop words
+	Returns:
+	    (list of special tokens, line with special tokens removed)
+	"""
+	tokens = []
+	for k, pattern in enumerate(PATTERNS):
+		convert = CONVERTERS[k]
+		def collect(m):
+			groups = tuple(g if g != None else '' for g in m.groups())
+			tokens.extend(convert(m.group(0), groups, stops))
+			return ''
+		line = pattern.sub(collect, line)
+	return tokens, line
+
+def scanSpecialTokens(line, stops):
+	"""Identify special tokens (emails, IPs, acronyms, dates, decimals and
+		currency, hyphenated terms, URLs and file names) in a single
+		left-to-right pass. Produces the same tokens, in the same order, as
+		scanSpecialTokensCascade; lines where the two could disagree (a
+		pattern matching inside another's match, or matches that only appear
+		once another is removed) are handed to the cascade.
+	Args:
+	    line: line in data file
+	    stops: set of stop words
+	Returns:
+	    (list of special tokens, line with special tokens removed)
+	"""
+	mask = candidates(line)
+	if mask == 0:
+		return [], line
+	scanner = getScanner(mask)
+	found = None
+	pieces = []
+	last = 0
+	for m in scanner.regex.finditer(line):
+		k = scanner.kind[m.lastgroup]
+		start, end = m.span()
+		if found == None:
+			found = {}
+		elif start == last:
+			return scanSpecialTokensCascade(line, stops)
+		if k in scanner.higher:
+			higher = scanner.higher[k].search(line, start + 1)
+			if higher != None and higher.start() < end:
+				return scanSpecialTokensCascade(line, stops)
+		found.setdefault(k, []).append(m)
+		pieces.append(line[last:start])
+		last = end
+	if found == None:
+		return [], line
+	pieces.append(line[last:])
+	rest = "".join(pieces)
+	restMask = candidates(rest)
+	if restMask != 0 and getScanner(restMask).regex.search(rest) != None:
+		return scanSpecialTokensCascade(line, stops)
+
+	tokens = []
+	for k in sorted(found):
+		first, stop = scanner.groups[k]
+		convert = CONVERTERS[k]
+		for m in found[k]:
+			groups = tuple(m.group(g) or '' for g in range(first, stop))
+			tokens.extend(convert(m.group(first - 1), groups, stops))
+	return tokens, rest
+
+# Word tokens for phrases: nltk.word_tokenize splits a line into sentences
+# (Punkt) and each sentence with NLTKWordTokenizer, a cascade of about 30
+# regex substitutions. Sentences that have no quotes, contractions, unicode
+# dashes or back-to-back ":"/"," (whose substitutions interact) come out of
+# that cascade exactly as from the two substitutions below.
+SENTENCE_END = re.compile(r'[.?!]')
+TREEBANK_FALLBACK = re.compile("['\"`«»“”‘’„‒-―]|[:,][:,]")
+CONTRACTIONS = re.compile(r'cannot|gimme|gonna|gotta|lemme|wanna')
+FINAL_PERIOD = re.compile(r'([^\.])(\.)([\]\)}>"\'' "»”’ " r"]*)\s*$")
+CLOSERS = ']})>"\'»”’ '
+# Splits off "..", "--", ":" or "," not before a digit, and ;@#$%&?!*()[]{}<>.
+# The pattern starts with a character class so that re skips ahead quickly.
+PADDED = re.compile(r'([-.:,;@#$%&?!*\[\](){}<>]'
+	r'(?:(?<=\.)\.+|(?<=-)-|(?<=[:,])(?!\d)|(?<=[^-.:,])))')
+TREEBANK = None
+
+def treebankTokens(sentence):
+	"""Tokenizes one sentence as nltk's NLTKWordTokenizer does."""
+	global TREEBANK
+	if TREEBANK_FALLBACK.search(sentence) != None or CONTRACTIONS.search(sentence.lower()) != None:
+		if TREEBANK == None:
+			from nltk.tokenize import NLTKWordTokenizer
+			TREEBANK = NLTKWordTokenizer()
+		return TREEBANK.tokenize(sentence)
+	if sentence.rstrip().rstrip(CLOSERS).endswith("."):
+		match = FINAL_PERIOD.search(sentence)
+		if match != None:
+			sentence = sentence[:match.start(2)] + " . " + sentence[match.end(2):]
+	return " ".join(PADDED.split(sentence)).split()
+
+def loadNltk():
+	"""Imports the nltk tokenizers wordTokens falls back on now rather than
+	on the first line that needs them, e.g. before the process measures its
+	footprint."""
+	global TREEBANK
+	import nltk.tokenize
+	if TREEBANK == None:
+		TREEBANK = nltk.tokenize.NLTKWordTokenizer()
+	nltk.tokenize.sent_tokenize("Punkt.")
+
+def wordTokens(text):
+	"""Tokenizes text as nltk.word_tokenize does. Punkt only splits sentences
+	at '.', '?' and '!', so text without them is one sentence and nltk is not
+	needed.
+	Args:
+	    text: line of a document, or a query
+	Returns:
+	    list of tokens
+	"""
+	if SENTENCE_END.search(text) == None:
+		return treebankTokens(text)
+	import nltk.tokenize
+	tokens = []
+	for sentence in nltk.tokenize.sent_tokenize(text):
+		tokens.extend(treebankTokens(sentence))
+	return tokens
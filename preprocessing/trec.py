@@ -0,0 +1,80 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import mmap
+import os
+import re
+from html.entities import name2codepoint
+
+COMMENT = re.compile(r'<!--.*?-->', re.DOTALL)
+TAG = re.compile(r'<[^>]*>')
+BLANK_LINE = re.compile(r'^[ \t]+$', re.MULTILINE)
+# Bytes scanned between releases of the mmapped pages behind the cursor
+RELEASE = 16 << 20
+# Only HTML 4 entities are decoded; TREC-specific ones such as &hyph; and
+# &blank; are left in place for replaceEscSeq.
+ENTITY = re.compile(r'&(' + '|'.join(sorted(name2codepoint, key=len, reverse=True)) + r');')
+
+def decodeEntity(match):
+	return chr(name2codepoint[match.group(1)])
+
+def tagText(doc, tag):
+	"""Returns the raw bytes between <tag> and </tag>, or None.
+	Args:
+	    doc: bytes of a single document
+	    tag: upper-case tag name
+	"""
+	start = doc.find(b"<" + tag + b">")
+	if start == -1:
+		return None
+	start += len(tag) + 2
+	end = doc.find(b"</" + tag + b">", start)
+	return doc[start:end if end != -1 else len(doc)]
+
+def toText(raw):
+	"""Strips comments and tags and decodes entities, like an HTML parser's
+	get_text().
+	Args:
+	    raw: bytes of an element's content
+	Returns:
+	    text string
+	"""
+	text = raw.decode("utf-8").replace("\r\n", "\n")
+	text = COMMENT.sub('', text)
+	text = TAG.sub('', text)
+	text = BLANK_LINE.sub('', text)
+	return ENTITY.sub(decodeEntity, text)
+
+def readTrecDocs(path):
+	"""Streams the documents of a TREC file without parsing it as a whole.
+	The file is mmapped and scanned for <DOC> blocks, so only one document
+	is held in memory at a time.
+	Args:
+	    path: path to TREC file
+	Yields:
+	    (docno, text) for every <DOC> in the file
+	"""
+	if os.path.getsize(path) == 0:
+		return
+	with open(path, "rb") as f:
+		mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			pos = mm.find(b"<DOC>")
+			released = 0
+			while pos != -1:
+				end = mm.find(b"</DOC>", pos)
+				if end == -1:
+					end = len(mm)
+				doc = mm[pos + 5:end]
+				docno = tagText(doc, b"DOCNO")
+				text = tagText(doc, b"TEXT")
+				if docno is not None and text is not None:
+					yield toText(docno).strip(), toText(text)
+				pos = mm.find(b"<DOC>", end)
+				# Drop the pages already scanned so they do not count against
+				# the builder's resident memory
+				if pos - released >= RELEASE and hasattr(mm, "madvise"):
+					released = (pos // mmap.PAGESIZE) * mmap.PAGESIZE
+					mm.madvise(mmap.MADV_DONTNEED, 0, released)
+		finally:
+			mm.close()
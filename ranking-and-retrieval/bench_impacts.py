@@ -0,0 +1,171 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import argparse
+import collections
+import os
+import re
+import subprocess
+from time import perf_counter
+import preprocess_query as preprocess
+import query as query_static
+
+def readQrels(path):
+	"""Reads a TREC qrels file
+	Returns:
+		dictionary (key: topic number, value: set of relevant docnos)
+	"""
+	qrels = collections.defaultdict(set)
+	with open(path) as f:
+		for line in f:
+			fields = line.split()
+			if len(fields) == 4 and int(fields[3]) > 0:
+				qrels[fields[0]].add(fields[2])
+	return qrels
+
+def evaluate(qrels, ranked):
+	"""MAP and P@10 of ranked lists, as trec_eval computes them: averaged
+	over the topics ranked that have relevance judgements
+	Args:
+		ranked: list of (topic number, list of docnos, best first)
+	Returns:
+		(MAP, P@10)
+	"""
+	precisions = []
+	p10s = []
+	for num, docnos in ranked:
+		if not qrels.get(num):
+			continue
+		relevant = qrels[num]
+		found = 0
+		total = 0.0
+		for rank, docno in enumerate(docnos):
+			if docno in relevant:
+				found += 1
+				total += found / (rank + 1)
+		precisions.append(total / len(relevant))
+		p10s.append(len([docno for docno in docnos[:10] if docno in relevant]) / 10)
+	if not precisions:
+		return 0.0, 0.0
+	return sum(precisions) / len(precisions), sum(p10s) / len(p10s)
+
+def trecEval(trecEvalPath, qrelsPath, resultsPath):
+	"""Runs trec_eval on a results file
+	Returns:
+		(MAP, P@10)
+	"""
+	output = subprocess.run([trecEvalPath, qrelsPath, resultsPath], stdout=subprocess.PIPE,
+		check=True, universal_newlines=True).stdout
+	measures = dict(re.findall(r"^(\S+)\s+all\s+(\S+)$", output, re.M))
+	return float(measures["map"]), float(measures["P_10"])
+
+def percentile(values, p):
+	values = sorted(values)
+	return values[min(len(values) - 1, int(p * len(values)))]
+
+def main():
+	# python3 bench_impacts.py [index-dir-path] [query-file-path]
+	# python3 bench_impacts.py indexes/ data/queryfile.txt --budgets 100,500,none --trec-eval ./trec_eval
+	parser = argparse.ArgumentParser(description="Measures latency and effectiveness of "
+		"score-at-a-time evaluation against exhaustive evaluation, per postings budget")
+	parser.add_argument("indexPath", help="directory holding the index files and their impact-ordered "
+		"sidecars (build.py --impacts)")
+	parser.add_argument("queryPath", help="TREC topic file")
+	parser.add_argument("--qrels", default="data/qrels.txt", help="TREC relevance judgements")
+	parser.add_argument("--types", default="single,stem", help="comma-separated index types")
+	parser.add_argument("--models", default="bm25,cosine", help="comma-separated retrieval models")
+	parser.add_argument("--k", type=int, default=100, help="result list size (default: %(default)s)")
+	parser.add_argument("--budgets", default="50,100,200,500,none",
+		help="comma-separated postings budgets per query, none for no budget")
+	parser.add_argument("--repeat", type=int, default=5,
+		help="runs per query; the fastest is kept (default: %(default)s)")
+	parser.add_argument("--results", default="results/impacts",
+		help="directory the results files are written to")
+	parser.add_argument("--trec-eval",
+		help="trec_eval binary that scores the results files; without it, or if it cannot run "
+		"here, MAP and P@10 are computed the same way in Python")
+	args = parser.parse_args()
+	indexPath = args.indexPath if args.indexPath[-1] == "/" else args.indexPath + "/"
+	with open(args.queryPath) as f:
+		topics = query_static.readTopics(f.readlines())
+	stops = preprocess.loadStops()
+	qrels = readQrels(args.qrels)
+	budgets = [None if budget == "none" else int(budget) for budget in args.budgets.split(",")]
+	if not os.path.exists(args.results):
+		os.makedirs(args.results)
+	trecEvalPath = args.trec_eval
+
+	print("{:<8}{:<8}{:<12}{:>8}{:>10}{:>10}{:>12}{:>10}{:>8}{:>8}".format("index", "model",
+		"mode", "budget", "mean ms", "p95 ms", "postings", "overlap", "MAP", "P@10"))
+	for indexType in args.types.split(","):
+		index = query_static.getIndex(indexPath, indexType)
+		docLength = query_static.getDocLength(indexPath, indexType)
+		docnos = query_static.getDocnos(indexPath, indexType)
+		N = len(docLength)
+		C = query_static.getC(docLength)
+		avgDocLength = C / N
+		stemmer = query_static.getStemmer(indexPath) if indexType == "stem" else None
+		queries = [preprocess.parse(title, indexType, stemmer, stops) for num, title in topics]
+		# Decode the posting lists up front, so both evaluations time scoring
+		# only
+		for query in queries:
+			for term in query:
+				if term in index:
+					index[term].pList
+		for retrievalModel in args.models.split(","):
+			termImpacts = query_static.getImpacts(indexPath, indexType, retrievalModel, index)
+			def exhaustive(query, budget):
+				scored = sum(len(index[term].pList) for term in query if term in index)
+				return query_static.search(query, index, docLength, retrievalModel, N, C,
+					avgDocLength, args.k), scored
+			def impact(query, budget):
+				return query_static.impactSearch(query, index, termImpacts, args.k, budget)
+			exact = None
+			for name, evaluation, runBudgets in [("exhaustive", exhaustive, [None]),
+				("impact", impact, budgets)]:
+				for budget in runBudgets:
+					times = []
+					read = 0
+					ranked = []
+					for (num, title), query in zip(topics, queries):
+						best = None
+						for i in range(args.repeat):
+							start = perf_counter()
+							topScores, n = evaluation(query, budget)
+							elapsed = perf_counter() - start
+							best = elapsed if best == None else min(best, elapsed)
+						times.append(best * 1000)
+						read += n
+						ranked.append((num, topScores))
+					if exact == None:
+						exact = ranked
+					# Share of the exhaustive top k found, 1 for topics with no results
+					overlap = sum(len(set(docid for docid, s in a) & set(docid for docid, s in b)) /
+						len(a) if a else 1 for (num, a), (num, b) in zip(exact, ranked)) / len(ranked)
+
+					resultsPath = os.path.join(args.results, "{}-{}-{}-{}.txt".format(indexType,
+						retrievalModel, name, "all" if budget == None else budget))
+					with open(resultsPath, "w") as f:
+						for num, topScores in ranked:
+							for rank, (docid, score) in enumerate(topScores):
+								f.write(num + " 0 " + docnos[docid] + " " + str(rank) + " " +
+									str(score) + " " + retrievalModel.upper() + "\n")
+					effectiveness = None
+					if trecEvalPath != None:
+						try:
+							effectiveness = trecEval(trecEvalPath, args.qrels, resultsPath)
+						except (OSError, subprocess.CalledProcessError) as e:
+							print('trec_eval failed, evaluating in Python:   {}'.format(e))
+							trecEvalPath = None
+					if effectiveness == None:
+						effectiveness = evaluate(qrels, [(num, [docnos[docid] for docid, s in topScores])
+							for num, topScores in ranked])
+					print("{:<8}{:<8}{:<12}{:>8}{:>10.3f}{:>10.3f}{:>12}{:>10.3f}{:>8.4f}{:>8.4f}".format(
+						indexType, retrievalModel, name, "-" if budget == None else budget,
+						sum(times) / len(times), percentile(times, 0.95), read, overlap,
+						*effectiveness))
+			termImpacts.close()
+		index.close()
+
+if __name__== "__main__":
+	main()
@@ -0,0 +1,124 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import argparse
+import collections
+import sys
+from time import perf_counter
+import preprocess_query as preprocess
+import query as query_static
+
+def postingsScored(query, index):
+	return sum(index[term].df for term in query if term in index)
+
+def exhaustive(query, index, docLength, retrievalModel, N, C, avgDocLength, k, prepared):
+	"""Term-at-a-time evaluation, one posting at a time (see query.score and
+	query.queryLikelihood).
+	Returns:
+		(list of the k best (doc id, score), postings scored)
+	"""
+	return query_static.search(query, index, docLength, retrievalModel, N, C, avgDocLength, k,
+		docsByLength=prepared.docsByLength), postingsScored(query, index)
+
+def maxScore(query, index, docLength, retrievalModel, N, C, avgDocLength, k, prepared):
+	return query_static.maxScore(query, index, docLength, retrievalModel, N, C, avgDocLength,
+		prepared.termBounds, k)
+
+def vector(query, index, docLength, retrievalModel, N, C, avgDocLength, k, prepared):
+	return query_static.vectorScore(query, index, prepared.docArrays, retrievalModel, N, C,
+		avgDocLength, k), postingsScored(query, index)
+
+# Evaluations and the retrieval models they rank; each is checked against
+# the first
+MODES = [("exhaustive", exhaustive, ["bm25", "cosine", "lm"]), ("maxscore", maxScore, ["bm25", "cosine"]),
+	("vector", vector, ["bm25", "cosine", "lm"])]
+# What the evaluations precompute per index
+Prepared = collections.namedtuple("Prepared", ["termBounds", "docsByLength", "docArrays"])
+
+def percentile(values, p):
+	values = sorted(values)
+	return values[min(len(values) - 1, int(p * len(values)))]
+
+def main():
+	# python3 bench_query.py [index-dir-path] [query-file-path]
+	# python3 bench_query.py indexes/ data/queryfile.txt --types single,stem --k 10,100
+	# python3 bench_query.py indexes/ data/queryfile.txt --types single --query 1 --modes exhaustive,vector
+	parser = argparse.ArgumentParser(description="Compares exhaustive, MaxScore and vectorized top-k "
+		"evaluation")
+	parser.add_argument("indexPath", help="directory holding the index files")
+	parser.add_argument("queryPath", help="TREC topic file")
+	parser.add_argument("--types", default="single,stem", help="comma-separated index types")
+	parser.add_argument("--models", default="bm25,cosine,lm", help="comma-separated retrieval models")
+	parser.add_argument("--modes", default=",".join(name for name, evaluate, models in MODES),
+		help="comma-separated evaluations (default: %(default)s)")
+	parser.add_argument("--query", action="append",
+		help="run this query string instead of the topics; may be repeated")
+	parser.add_argument("--k", default="100", help="comma-separated result list sizes")
+	parser.add_argument("--repeat", type=int, default=5,
+		help="runs per query; the fastest is kept (default: %(default)s)")
+	args = parser.parse_args()
+	indexPath = args.indexPath if args.indexPath[-1] == "/" else args.indexPath + "/"
+	with open(args.queryPath) as f:
+		topics = query_static.readTopics(f.readlines())
+	if args.query != None:
+		topics = [(str(i), text) for i, text in enumerate(args.query)]
+	modes = [mode for mode in MODES if mode[0] in args.modes.split(",")]
+	stops = preprocess.loadStops()
+
+	mismatches = 0
+	print("{:<8}{:<8}{:>5}  {:<12}{:>10}{:>10}{:>10}{:>10}{:>12}".format("index", "model", "k",
+		"mode", "total ms", "mean ms", "p50 ms", "p95 ms", "postings"))
+	for indexType in args.types.split(","):
+		index = query_static.getIndex(indexPath, indexType)
+		docLength = query_static.getDocLength(indexPath, indexType)
+		N = len(docLength)
+		C = query_static.getC(docLength)
+		avgDocLength = C / N
+		stemmer = query_static.getStemmer(indexPath) if indexType == "stem" else None
+		prepared = Prepared(query_static.getBounds(indexPath, indexType, index, docLength),
+			query_static.getDocsByLength(docLength), query_static.getDocArrays(docLength))
+		queries = [preprocess.parse(title, indexType, stemmer, stops) for num, title in topics]
+		# Decode the posting lists and bounds up front, so the modes time
+		# scoring only
+		for query in queries:
+			for term in query:
+				if term in index:
+					index[term].pList
+					index[term].arrays
+					prepared.termBounds[term]
+		for retrievalModel in args.models.split(","):
+			for k in [int(k) for k in args.k.split(",")]:
+				results = {}
+				for name, evaluate, models in modes:
+					if retrievalModel not in models:
+						continue
+					times = []
+					scored = 0
+					results[name] = []
+					for query in queries:
+						best = None
+						for i in range(args.repeat):
+							start = perf_counter()
+							topScores, n = evaluate(query, index, docLength, retrievalModel, N, C,
+								avgDocLength, k, prepared)
+							elapsed = perf_counter() - start
+							best = elapsed if best == None else min(best, elapsed)
+						times.append(best * 1000)
+						scored += n
+						results[name].append(topScores)
+					print("{:<8}{:<8}{:>5}  {:<12}{:>10.2f}{:>10.3f}{:>10.3f}{:>10.3f}{:>12}".format(
+						indexType, retrievalModel, k, name, sum(times), sum(times) / len(times),
+						percentile(times, 0.5), percentile(times, 0.95), scored))
+				reference = next(iter(results.values()))
+				for name, ranked in results.items():
+					differ = sum(1 for a, b in zip(reference, ranked) if a != b)
+					if differ:
+						print("MISMATCH ({}): {} of {} queries differ".format(name, differ, len(queries)))
+					mismatches += differ
+		index.close()
+	print("Mismatches:   {}".format(mismatches))
+	if mismatches:
+		sys.exit(1)
+
+if __name__== "__main__":
+	main()
@@ -2,63 +2,175 @@
 # -*- coding: utf-8 -*-
 
 import preprocess_query as preprocess 
+import result_cache
 import os
 import sys
 import collections
-import ast
+import bisect
+import heapq
 import math
+import multiprocessing
 from time import time
+import numpy as np
 
-class Term:
-	def __init__(self, df, idf, cf, pList):
-		self.df = df # Document freq
-		self.idf = idf # Inverse document freq
-		self.cf = cf # Collection freq
-		self.pList = pList #Posting list
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "preprocessing"))
+import bounds
+import impacts
+import postings
+import segments
+import shards
+import stems
 
-class DocLength: 
-	def __init__(self, tf, tf_idf):
-		self.tf = tf # Sum of all tf 
-		self.tf_idf = tf_idf # Sum of all (tf*idf)^2
+# tf: sum of all tf, tf_idf: sum of all (tf*idf)^2
+DocLength = collections.namedtuple("DocLength", ["tf", "tf_idf"])
+# The same as arrays indexed by doc id (see getDocArrays), indexed: doc 
+# ids in docLength
+DocArrays = collections.namedtuple("DocArrays", ["tf", "tf_idf", "indexed"])
+
+# Slack added to score bounds, for the rounding of sums taken in another
+# order and of cosine scores to 8 decimals
+BOUND_SLACK = 1e-9
+BOUND_ROUNDING = 1e-8
+# Topic batches per --jobs worker
+TOPIC_CHUNKS = 4
 
 def getIndex(indexPath, indexType):
-	"""Reads txt file containing relevant index and coverts it to a dictionary
+	"""Opens the binary index file (see preprocessing/postings.py), the live
+	segments of an index built with build.py --append or the shards of one 
+	built with --shards. Only the dictionary is read; a term's posting list 
+	is decoded when it is first used
 	Args: 
 		indexType: Type of index (single, phrase, stem, positional)
 	Returns:
-		index dictionary (key: term, value: Term object)
+		postings.LazyIndex (key: term, value: postings.Term object), postings 
+		hold integer doc ids (see getDocnos)
 	"""
-	index = {}
-	with open(indexPath + indexType + ".txt") as f: 
-		for line in f:
-			name = line.split("\t")[0]
-			df = int(line.split("\t")[1].split(" ")[0])
-			idf = float(line.split("\t")[1].split(" ")[1])
-			cf = int(line.split("\t")[1].split(" ")[2])
-			pList = ast.literal_eval(line.split("\t")[2].replace("\n", ""))
-			index[name] = Term(df, idf, cf, pList)
-	return index
-
-def getDocLength(indexType):
-	"""Reads txt file containing document lengths and coverts it to a dictionary
+	return postings.LazyIndex(segments.openIndex(indexPath, indexType))
+
+def getDocnos(indexPath, indexType):
+	"""Reads the index's doc table. Indexes built together share it, so the
+	doc ids of all of them resolve here
+	Returns:
+		list of docnos (index: doc id)
+	"""
+	reader = segments.openIndex(indexPath, indexType)
+	docnos = reader.docs
+	reader.close()
+	return docnos
+
+def getDocLength(indexPath, indexType, norms=True):
+	"""Reads document lengths from the index's statistics sidecar (see 
+	preprocessing/postings.py) or segments, or from data/<type>-docLength.txt for indexes
+	built without one, and converts them to a dictionary
 	Args: 
 		indexType: Type of index (single, phrase, stem, positional)
+		norms: whether tf_idf is needed (cosine); without it a segmented
+		index leaves tf_idf None rather than sum it from the posting lists
 	Returns:
-		docLength dictionary (key: docID, value: DocLength object)
+		docLength dictionary (key: doc id of the indexType index, value: 
+		DocLength object)
 	"""
 	docLength = {} 
 	if indexType == "phrase": 
 		filtered = "filtered"
 	else:
 		filtered = ""
+	indexName = indexType + ("-" if filtered else "") + filtered
+	if segments.isSegmented(indexPath, indexName) or shards.isSharded(indexPath, indexName) or \
+		os.path.exists(postings.statsPath(postings.indexPath(indexPath, indexName))):
+		reader = segments.openIndex(indexPath, indexName)
+		docIDs = None
+		if indexName != indexType:
+			docnos = getDocnos(indexPath, indexType)
+			if reader.docs != docnos:
+				# Indexes built before they shared one doc table
+				docIDs = {docno: d for d, docno in enumerate(docnos)}
+		for docID, (tf, tf_idf) in reader.docLengths(norms).items():
+			if docIDs != None:
+				docID = docIDs[reader.docs[docID]]
+			docLength[docID] = DocLength(tf, tf_idf)
+		reader.close()
+		return docLength
+	docIDs = {docno: d for d, docno in enumerate(getDocnos(indexPath, indexType))}
 	with open("data/" + indexType + filtered + "-docLength.txt") as f:
 		for line in f:
-			docID = line.split(" ")[0]
+			docID = docIDs[line.split(" ")[0]]
 			tf = line.split(" ")[1]
 			tf_idf = line.split(" ")[2]
 			docLength[docID] = DocLength(int(tf), float(tf_idf))
 		return docLength
 
+def getStemmer(indexPath):
+	"""Loads the stem table written next to the stem index (see 
+	preprocessing/stems.py), so queries are stemmed by lookup
+	Returns:
+		stems.Stemmer
+	"""
+	if shards.isSharded(indexPath, "stem"):
+		indexFiles = shards.indexFiles(indexPath, "stem")
+	elif segments.isSegmented(indexPath, "stem"):
+		indexFiles = segments.liveSegments(indexPath, "stem")
+	else:
+		indexFiles = [postings.indexPath(indexPath, "stem")]
+	return stems.Stemmer(stems.readTables(stems.tablePath(f) for f in indexFiles))
+
+def getBounds(indexPath, indexType, index, docLength):
+	"""Loads the score bounds of an index (see preprocessing/bounds.py) for
+	maxScore. Segmented and sharded indexes, and indexes built without the 
+	sidecar, get their bounds computed per query term
+	Args: 
+		index: postings.LazyIndex (see getIndex)
+		docLength: dictionary (key: doc id, value: DocLength object)
+	Returns:
+		bounds.Bounds
+	"""
+	indexFile = None
+	if not segments.isSegmented(indexPath, indexType) and not shards.isSharded(indexPath, indexType):
+		indexFile = postings.indexPath(indexPath, indexType)
+	return bounds.Bounds(index.reader, docLength, indexFile)
+
+def getImpacts(indexPath, indexType, retrievalModel, index):
+	"""Opens the impact-ordered index of an index type for a retrieval model
+	(see preprocessing/impacts.py) for impactSearch
+	Args: 
+		index: postings.LazyIndex (see getIndex) it was written for
+	Returns:
+		impacts.ImpactReader
+	"""
+	path = impacts.impactsPath(postings.indexPath(indexPath, indexType), retrievalModel)
+	if segments.isSegmented(indexPath, indexType) or shards.isSharded(indexPath, indexType) or \
+		not os.path.exists(path):
+		raise ValueError("no {} impact index for {}, build it with --impacts".format(
+			retrievalModel, indexType))
+	termImpacts = impacts.ImpactReader(path)
+	if not termImpacts.matches(index.reader):
+		termImpacts.close()
+		raise ValueError("the {} impact index for {} is out of date, rebuild it with --impacts".format(
+			retrievalModel, indexType))
+	return termImpacts
+
+def getGeneration(indexPath, indexType):
+	"""Identifies the published version of an index type: the manifest
+	generation of a segmented or sharded index, else the inode, size and
+	mtime of the index file, which a rebuild replaces, and of its impact-
+	ordered sidecars, written after it.
+	Returns:
+		generation string
+	"""
+	if shards.isSharded(indexPath, indexType):
+		return "shards-%d" % shards.readManifest(indexPath, indexType)["generation"]
+	if segments.isSegmented(indexPath, indexType):
+		return "segments-%d" % segments.readManifest(segments.segmentDir(indexPath,
+			indexType))["generation"]
+	indexFile = postings.indexPath(indexPath, indexType)
+	stat = os.stat(indexFile)
+	version = "file-%d-%d-%d" % (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+	for model in impacts.MODELS:
+		if os.path.exists(impacts.impactsPath(indexFile, model)):
+			stat = os.stat(impacts.impactsPath(indexFile, model))
+			version += "-%s-%d-%d" % (model, stat.st_ino, stat.st_mtime_ns)
+	return version
+
 def getC(docLength):
 	"""Gets total number of terms in collection
 	Args: 
@@ -85,44 +197,594 @@ def BM25(n, doc_tf, q_tf, N, doclen, avgdoclen):
 		similarity score between query and document i SC(Q, Di). 
 	"""
 	# k1, k2, and b are parameters to be empirically determined
-	k1 = 1.2
-	k2 = 700
-	b = 0.75
+	k1 = bounds.K1
+	k2 = bounds.K2
+	b = bounds.B
 	K = k1 * ((1 - b) + b * (float(doclen)/float(avgdoclen))) 
 	w = math.log((N - n + 0.5) / (n + 0.5)) #idf 
 	normalizedD = (((k1 + 1) * doc_tf) / (K + doc_tf))
 	normalizedQ= (((k2 + 1) * q_tf) / (k2 + q_tf))
 	return w * normalizedD * normalizedQ
 
-def LM(doc_tf, u, cf, C, D):
-	"""Implementation of Query Likelihood with Dirichlet Smoothing. 
-	Computes similarity scores between query and a document. 
+def readTopics(lines):
+	"""Reads the numbers and titles of the topics in a TREC query file
 	Args: 
-		doc_tf: document term frequency
-		u: smoothing factor 
-		cf: collection frequency of term 
-		C: total number of terms in colelction
-		D: total number of documents in collection
+		lines: lines of the query file
 	Returns:
-		similarity score between query and document i SC(Q, Di). 
+		list of (topic number, title)
+	"""
+	queryNums = []
+	queries = []
+	for line in lines:
+		if line.startswith("<num>"):
+			num = line.replace("<num> Number: ", "").replace("\n", "").rstrip()
+			queryNums.append(num)
+		elif line.startswith("<title>"):
+			num = line.replace("<title> Topic: ", "").replace("\n", "").rstrip()
+			queries.append(num)
+	return list(zip(queryNums, queries))
+
+def score(query, index, docLength, retrievalModel, N, C, avgDocLength):
+	"""Scores the documents of a parsed query with a retrieval model
+	Args: 
+		query: dictionary (key: term, value: query tf), see preprocess_query.parse
+		index: postings.LazyIndex (see getIndex)
+		docLength: dictionary (key: doc id, value: DocLength object)
+		retrievalModel: "cosine" or "bm25" (LM ranks with queryLikelihood)
+		N: number of documents
+		C: total number of terms in collection
+		avgDocLength: average document length
+	Returns:
+		scores dictionary (key: doc id, value: score)
+	"""
+	scores = {}
+	queryLen = 0
+	for term in query:
+		q_tf = query[term]
+		if term in index:
+			pList = index[term].pList 
+			t_idf = float(index[term].idf)
+			for doc in pList: 
+				docid = doc[0]
+				doc_tf = doc[1]
+
+				if retrievalModel == "cosine":
+					score = (doc_tf * t_idf) * (q_tf * t_idf)
+
+				elif retrievalModel == "bm25":
+					score = BM25(n=index[term].df, doc_tf=doc_tf, q_tf=q_tf, 
+						N=N, doclen=docLength[docid].tf, avgdoclen=avgDocLength)
+				
+				# Cosine and BM25 use summation
+				if docid in scores:
+					scores[docid] += score
+				else:
+					scores[docid] = score
+
+			# Cosine: calculate query length over the terms in the index
+			queryLen += pow(q_tf * t_idf,2)
+
+	# Cosine: normalize for document length 
+	if retrievalModel == "cosine":
+		for doc in scores: 
+			scores[doc] = round(scores[doc] / math.sqrt(docLength[doc].tf_idf * queryLen), 8)
+	return scores
+
+def getDocsByLength(docLength):
+	"""Orders the documents for queryLikelihood, which ranks documents 
+	without any query term shortest first
+	Args: 
+		docLength: dictionary (key: doc id, value: DocLength object)
+	Returns:
+		list of doc ids by increasing length (total tf), then doc id
+	"""
+	return sorted(docLength, key=lambda docid: (docLength[docid].tf, docid))
+
+def queryLikelihood(query, index, docLength, C, avgDocLength, k=100, docsByLength=None):
+	"""Query likelihood with Dirichlet smoothing (u = avgDocLength) in log 
+	space. A document's score is the log of the product over the query 
+	terms in the index of (tf + u * cf / C) / (D + u), D being that 
+	document's own length:
+		sum over terms of log(u * cf / C)
+		+ sum over the terms it contains of log(1 + tf / (u * cf / C))
+		- number of terms * log(D + u)
+	The first part is the same for every document and the last depends only
+	on its length, so only the postings of the query terms are read. A 
+	document with none of the terms scores the first and last parts alone,
+	and the shortest ones fill the top k when fewer than k documents match.
+	Same ranking as the product, which underflows for long queries; ties go
+	to the lower doc id
+	Args: 
+		query: dictionary (key: term, value: query tf), see preprocess_query.parse
+		docLength: dictionary (key: doc id, value: DocLength object)
+		docsByLength: getDocsByLength(docLength), computed if not given
+	Returns:
+		list of the k best (doc id, log likelihood), best first
+	"""
+	u = avgDocLength
+	background = 0.0
+	numTerms = 0
+	matched = {}
+	for term in query:
+		if term not in index:
+			continue
+		numTerms += 1
+		smoothing = u * (float(index[term].cf) / float(C))
+		background += math.log(smoothing)
+		for docid, doc_tf, positions in index[term].pList:
+			matched[docid] = matched.get(docid, 0.0) + math.log1p(doc_tf / smoothing)
+	if numTerms == 0:
+		return []
+	scores = {docid: background + matched[docid] - numTerms * math.log(docLength[docid].tf + u)
+		for docid in matched}
+	# The best documents without a query term are the shortest
+	if docsByLength == None:
+		docsByLength = getDocsByLength(docLength)
+	unmatched = 0
+	for docid in docsByLength:
+		if unmatched == k:
+			break
+		if docid not in matched:
+			scores[docid] = background - numTerms * math.log(docLength[docid].tf + u)
+			unmatched += 1
+	return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+def getDocArrays(docLength):
+	"""Lays the document lengths out as arrays indexed by doc id, for
+	vectorScore
+	Args:
+		docLength: dictionary (key: doc id, value: DocLength object)
+	Returns:
+		DocArrays of float64 tf and tf_idf arrays and a boolean array
+		marking the doc ids in docLength
+	"""
+	size = max(docLength) + 1 if docLength else 0
+	docids = np.fromiter(docLength.keys(), dtype=np.int64, count=len(docLength))
+	docArrays = DocArrays(np.zeros(size), np.zeros(size), np.zeros(size, dtype=bool))
+	docArrays.tf[docids] = [length.tf for length in docLength.values()]
+	docArrays.tf_idf[docids] = [length.tf_idf for length in docLength.values()]
+	docArrays.indexed[docids] = True
+	return docArrays
+
+def vectorScore(query, index, docArrays, retrievalModel, N, C, avgDocLength, k=100):
+	"""Scores a parsed query with array arithmetic: each term's postings
+	(see postings.Term.arrays) are scored at once and added into an
+	accumulator over all doc ids, and the top k is picked with argpartition.
+	The per-posting arithmetic is that of score() and queryLikelihood, in
+	the same order, so the documents, scores and order are the same too
+	Args:
+		docArrays: getDocArrays(docLength)
+		(others as for score)
+	Returns:
+		list of the k best (doc id, score), best first
+	"""
+	numDocs = len(docArrays.tf)
+	scores = np.zeros(numDocs)
+	# Ties go to the document scored first, as in score(): the one in the
+	# earlier query term, then the lower doc id
+	firstTerm = np.full(numDocs, len(query))
+	k1, b = bounds.K1, bounds.B
+	u = avgDocLength
+	numTerms = 0
+	queryLen = 0
+	background = 0.0
+	for t, term in enumerate(query):
+		if term not in index:
+			continue
+		numTerms += 1
+		docids, tfs = index[term].arrays
+		q_tf = query[term]
+		if retrievalModel == "cosine":
+			t_idf = float(index[term].idf)
+			scores[docids] += (tfs * t_idf) * (q_tf * t_idf)
+			queryLen += pow(q_tf * t_idf,2)
+		elif retrievalModel == "bm25":
+			n = index[term].df
+			K = k1 * ((1 - b) + b * (docArrays.tf[docids] / avgDocLength))
+			w = math.log((N - n + 0.5) / (n + 0.5))
+			normalizedQ = (((bounds.K2 + 1) * q_tf) / (bounds.K2 + q_tf))
+			scores[docids] += w * (((k1 + 1) * tfs) / (K + tfs)) * normalizedQ
+		elif retrievalModel == "lm":
+			smoothing = u * (float(index[term].cf) / float(C))
+			background += math.log(smoothing)
+			# math.log1p once per distinct tf; NumPy's can differ in the
+			# last bit
+			distinct, inverse = np.unique(tfs, return_inverse=True)
+			scores[docids] += np.array([math.log1p(tf / smoothing) for tf in distinct.tolist()])[inverse]
+		firstTerm[docids] = np.minimum(firstTerm[docids], t)
+	if numTerms == 0:
+		return []
+
+	if retrievalModel == "lm":
+		# Every document has a likelihood
+		candidates = np.flatnonzero(docArrays.indexed)
+		values = background + scores[candidates] - numTerms * np.log(docArrays.tf[candidates] + u)
+		firstTerm[:] = 0
+	else:
+		candidates = np.flatnonzero(firstTerm < len(query))
+		values = scores[candidates]
+		if retrievalModel == "cosine":
+			values = values / np.sqrt(docArrays.tf_idf[candidates] * queryLen)
+	if len(candidates) > k:
+		# Keep the top k and what could tie with the k-th once rounded to 8
+		# decimals (cosine) or scored with math.log (LM)
+		kth = -np.partition(-values, k - 1)[k - 1]
+		kept = values >= kth - (BOUND_ROUNDING + abs(kth) * BOUND_SLACK)
+		candidates = candidates[kept]
+		values = values[kept]
+	values = values.tolist()
+	if retrievalModel == "cosine":
+		values = [round(value, 8) for value in values]
+	elif retrievalModel == "lm":
+		values = [background + matched - numTerms * math.log(length + u) for matched, length
+			in zip(scores[candidates].tolist(), docArrays.tf[candidates].tolist())]
+	ranked = sorted(zip(values, (-firstTerm[candidates]).tolist(), (-candidates).tolist()),
+		reverse=True)[:k]
+	return [(-docid, value) for value, first, docid in ranked]
+
+def maxScore(query, index, docLength, retrievalModel, N, C, avgDocLength, termBounds, k=100):
+	"""Document-at-a-time MaxScore evaluation of a parsed query for BM25 or
+	cosine. The query terms are kept in order of their score bound; the 
+	lowest ones whose bounds add up to less than the k-th best score so far
+	are non-essential. Only documents in an essential term's postings are 
+	candidates, and the non-essential postings are searched for a candidate 
+	only while its score can still reach the top k. Returns the same 
+	documents, scores and order as score() and Counter.most_common, whose 
+	ties go to the document scored first: the one in the earlier query term,
+	then the lower doc id
+	Args: 
+		termBounds: bounds.Bounds of the index (see getBounds)
+		(others as for score)
+	Returns:
+		(list of the k best (doc id, score), best first, postings scored)
+	"""
+	terms = []
+	queryLen = 0
+	for term in query:
+		if term in index:
+			t_idf = float(index[term].idf)
+			queryLen += pow(query[term] * t_idf,2)
+			terms.append(term)
+	if not terms:
+		return [], 0
+	numTerms = len(terms)
+	bm25 = retrievalModel == "bm25"
+	k1, b = bounds.K1, bounds.B
+	pLists = []
+	# Per term factors of its score, as BM25() and score() compute them
+	weights = []
+	queryWeights = []
+	ub = []	# bound of each term's share of a document's final score
+	for term in terms:
+		pLists.append(index[term].pList)
+		t_idf = float(index[term].idf)
+		q_tf = query[term]
+		bm25Max, bm25Min, cosineMax = termBounds[term]
+		if bm25:
+			n = index[term].df
+			w = math.log((N - n + 0.5) / (n + 0.5))
+			normalizedQ = (((bounds.K2 + 1) * q_tf) / (bounds.K2 + q_tf))
+			weights.append(w)
+			queryWeights.append(normalizedQ)
+			bound = w * (bm25Max if w >= 0 else bm25Min) * normalizedQ
+		else:
+			weights.append(t_idf)
+			queryWeights.append(q_tf * t_idf)
+			bound = t_idf * t_idf * q_tf * cosineMax / math.sqrt(queryLen)
+		ub.append(max(bound, 0.0) * (1 + BOUND_SLACK))
+	order = sorted(range(numTerms), key=lambda i: ub[i])
+	# Sum of the bounds of order[:j + 1]
+	prefix = []
+	for i in order:
+		prefix.append((prefix[-1] if prefix else 0.0) + ub[i])
+
+	END = math.inf
+	positions = [0] * numTerms
+	current = [pList[0][0] if pList else END for pList in pLists]
+	heap = []	# worst of the top k first: (score, -first term, -doc id)
+	threshold = -math.inf
+	essential = 0	# order[essential:] are essential
+	essentials = order
+	nonEssentials = []
+	scored = 0
+	while True:
+		# Next candidate: the lowest doc id in an essential posting list
+		docid = min([current[i] for i in essentials])
+		if docid == END:
+			break
+		doclen = docLength[docid]
+		if bm25:
+			K = k1 * ((1 - b) + b * (float(doclen.tf)/float(avgDocLength)))
+			scale = 1.0
+		else:
+			scale = 1.0 / math.sqrt(doclen.tf_idf * queryLen)
+		hits = [None] * numTerms	# score of each term in docid
+		bound = prefix[essential - 1] if essential > 0 else 0.0
+		for i in essentials:
+			if current[i] == docid:
+				p = positions[i]
+				doc_tf = pLists[i][p][1]
+				if bm25:
+					hits[i] = weights[i] * (((k1 + 1) * doc_tf) / (K + doc_tf)) * queryWeights[i]
+				else:
+					hits[i] = (doc_tf * weights[i]) * queryWeights[i]
+				bound += hits[i] * scale
+				scored += 1
+				p += 1
+				positions[i] = p
+				current[i] = pLists[i][p][0] if p < len(pLists[i]) else END
+		# Non-essential terms, highest bound first, while docid can still
+		# make the top k
+		for i in nonEssentials:
+			if bound * (1 + BOUND_SLACK) + BOUND_ROUNDING < threshold:
+				break
+			bound -= ub[i]
+			if current[i] < docid:
+				p = bisect.bisect_left(pLists[i], (docid,), positions[i])
+				positions[i] = p
+				current[i] = pLists[i][p][0] if p < len(pLists[i]) else END
+			if current[i] == docid:
+				doc_tf = pLists[i][positions[i]][1]
+				if bm25:
+					hits[i] = weights[i] * (((k1 + 1) * doc_tf) / (K + doc_tf)) * queryWeights[i]
+				else:
+					hits[i] = (doc_tf * weights[i]) * queryWeights[i]
+				bound += hits[i] * scale
+				scored += 1
+		if bound * (1 + BOUND_SLACK) + BOUND_ROUNDING < threshold:
+			continue
+
+		# Sum in query order, as score() does
+		total = 0
+		first = None
+		for i in range(numTerms):
+			if hits[i] != None:
+				total += hits[i]
+				if first == None:
+					first = i
+		if not bm25:
+			total = round(total / math.sqrt(doclen.tf_idf * queryLen), 8)
+		entry = (total, -first, -docid)
+		if len(heap) < k:
+			heapq.heappush(heap, entry)
+		elif entry > heap[0]:
+			heapq.heapreplace(heap, entry)
+		if len(heap) == k and heap[0][0] > threshold:
+			threshold = heap[0][0]
+			while essential < numTerms and \
+				prefix[essential] * (1 + BOUND_SLACK) + BOUND_ROUNDING < threshold:
+				essential += 1
+			if essential == numTerms:
+				break
+			essentials = order[essential:]
+			nonEssentials = order[essential - 1::-1] if essential > 0 else []
+	return [(-docid, total) for total, first, docid in sorted(heap, reverse=True)], scored
+
+def impactSearch(query, index, termImpacts, k=100, budget=None):
+	"""Score-at-a-time evaluation of a parsed query over an impact-ordered
+	index. The segments of postings with the same impact are added to the
+	document accumulators highest contribution first, across all query
+	terms. Once the k-th best score is above the k+1-th plus the most the
+	unread segments could still add to a document, the top k documents are
+	settled: the rest of the postings are read only for them, to give their
+	exact order. Scores are of the quantized impacts, so they (and the order
+	of close documents) differ a little from score(); BM25 terms in more
+	than half of the documents, which would lower a score, add nothing
+	Args:
+		index: postings.LazyIndex (see getIndex), for idf and the query
+		length of cosine
+		termImpacts: impacts.ImpactReader of the index for the retrieval
+		model (see getImpacts)
+		budget: if given, stop after this many postings and rank the
+		documents by their partial scores; an anytime approximation
+	Returns:
+		(list of the k best (doc id, score), best first, postings read)
 	"""
-	numerator = float(doc_tf) + float(u) * (float(cf) / float(C))
-	denominator = float(D) + float(u)
-	return numerator/denominator
+	# Each segment's contribution to a document's score is its impact
+	# times the query term's weight
+	segmentList = []
+	queryLen = 0
+	for term in query:
+		if term not in index:
+			continue
+		q_tf = query[term]
+		t_idf = float(index[term].idf)
+		queryLen += pow(q_tf * t_idf,2)
+		if term not in termImpacts:
+			continue
+		if termImpacts.model == "bm25":
+			weight = (((bounds.K2 + 1) * q_tf) / (bounds.K2 + q_tf))
+		else:
+			weight = q_tf * t_idf
+		if weight <= 0:
+			continue
+		termSegments = termImpacts.segments(term)
+		for i, (impact, docids) in enumerate(termSegments):
+			# The most a document not yet in this term's segments can get from it
+			nextBound = termSegments[i + 1][0] * weight if i + 1 < len(termSegments) else 0
+			segmentList.append((impact * weight, nextBound, term, docids))
+	if not segmentList:
+		return [], 0
+	segmentList.sort(key=lambda segment: -segment[0])
+	# Bound on what the unread segments add to a document, from the first
+	# unread segment of each term
+	remaining = {}
+	for contribution, nextBound, term, docids in segmentList:
+		remaining.setdefault(term, contribution)
+	rest = sum(remaining.values())
+	# Bound on a document's score so far, from the first segment of each
+	# term started
+	reached = 0
+	started = set()
+	# Scores only grow, each by at most a segment's contribution: bounds
+	# on the k-th best and k+1-th best scores since they were last found,
+	# which skip the checks that cannot succeed
+	kthBound = 0
+	nextFloor = 0
+	accumulators = np.zeros(termImpacts.numDocs)
+	read = 0
+	settled = None
+	for i, (contribution, nextBound, term, docids) in enumerate(segmentList):
+		if budget != None and read + len(docids) > budget:
+			accumulators[docids[:budget - read]] += contribution
+			read = budget
+			break
+		accumulators[docids] += contribution
+		read += len(docids)
+		if term not in started:
+			started.add(term)
+			reached += contribution
+		rest += nextBound - remaining[term]
+		remaining[term] = nextBound
+		kthBound = min(reached, kthBound + contribution)
+		if k < len(accumulators) and kthBound > nextFloor + rest:
+			kthBest, nextBest = -np.partition(-accumulators, (k - 1, k))[k - 1:k + 1]
+			if kthBest > (nextBest + rest) * (1 + BOUND_SLACK) + BOUND_ROUNDING:
+				settled = i + 1
+				break
+			kthBound = kthBest
+			nextFloor = nextBest
+	if settled != None:
+		# Finish the scores of the top k with the segments left
+		top = np.argpartition(-accumulators, k - 1)[:k]
+		for contribution, nextBound, term, docids in segmentList[settled:]:
+			accumulators[top[np.isin(top, docids, assume_unique=True)]] += contribution
+		candidates = top
+	else:
+		candidates = np.flatnonzero(accumulators)
+	candidates = candidates[accumulators[candidates] > 0]
+	ranked = candidates[np.lexsort((candidates, -accumulators[candidates]))[:k]].tolist()
+	scale = termImpacts.scale
+	if termImpacts.model == "cosine":
+		scale /= math.sqrt(queryLen)
+	return [(docid, float(accumulators[docid]) * scale) for docid in ranked], read
+
+def search(query, index, docLength, retrievalModel, N, C, avgDocLength, k=100, termBounds=None,
+	termImpacts=None, budget=None, docsByLength=None, docArrays=None):
+	"""Ranks the documents of a parsed query: with impactSearch when 
+	termImpacts is given for the retrieval model, with maxScore for BM25 and
+	cosine when termBounds is given, with vectorScore when docArrays is 
+	given, else LM with queryLikelihood and others exhaustively (see score)
+	Returns:
+		list of the k best (doc id, score), best first
+	"""
+	if termImpacts != None and retrievalModel == termImpacts.model:
+		return impactSearch(query, index, termImpacts, k, budget)[0]
+	if termBounds != None and retrievalModel in ("bm25", "cosine"):
+		return maxScore(query, index, docLength, retrievalModel, N, C, avgDocLength, termBounds, 
+			k)[0]
+	if docArrays != None:
+		return vectorScore(query, index, docArrays, retrievalModel, N, C, avgDocLength, k)
+	if retrievalModel == "lm":
+		return queryLikelihood(query, index, docLength, C, avgDocLength, k, docsByLength)
+	return collections.Counter(score(query, index, docLength, retrievalModel, N, C, 
+		avgDocLength)).most_common(k)
+
+# The loaded state a process ranks queries with (see openBatch); each
+# --jobs worker opens its own
+batch = None
+Batch = collections.namedtuple("Batch", ["indexType", "retrievalModel", "index", "docLength", "docnos",
+	"N", "C", "avgDocLength", "stemmer", "stops", "termBounds", "termImpacts", "budget", "docsByLength",
+	"docArrays", "k"])
+
+def openBatch(indexPath, indexType, retrievalModel, evaluation="exhaustive", budget=None, k=100):
+	"""Loads an index and what the evaluation needs into this process, for
+	rankQueries. Pool initializer for --jobs: each worker maps the same index
+	files, so the operating system keeps one copy of their pages for all of
+	them, whatever the start method
+	"""
+	global batch
+	index = getIndex(indexPath, indexType)
+	docLength = getDocLength(indexPath, indexType, norms=(retrievalModel == "cosine"))
+	N = len(docLength)
+	C = getC(docLength)
+	batch = Batch(indexType, retrievalModel, index, docLength, getDocnos(indexPath, indexType), N, C,
+		C / N, getStemmer(indexPath) if indexType == "stem" else None, preprocess.loadStops(),
+		getBounds(indexPath, indexType, index, docLength) if evaluation == "maxscore" else None,
+		getImpacts(indexPath, indexType, retrievalModel, index) if evaluation == "impact" else None,
+		budget, getDocsByLength(docLength) if retrievalModel == "lm" else None,
+		getDocArrays(docLength) if evaluation == "vector" else None, k)
+
+def closeBatch():
+	global batch
+	if batch.termImpacts != None:
+		batch.termImpacts.close()
+	batch.index.close()
+	batch = None
+
+def rankQueries(queries):
+	"""Ranks parsed queries with the state openBatch loaded
+	Args: 
+		queries: list of dictionaries (key: term, value: query tf), see 
+		preprocess_query.parse
+	Returns:
+		list of their lists of the k best (doc id, score), in query order
+	"""
+	return [search(query, batch.index, batch.docLength, batch.retrievalModel, batch.N, batch.C,
+		batch.avgDocLength, batch.k, termBounds=batch.termBounds, termImpacts=batch.termImpacts, 
+		budget=batch.budget, docsByLength=batch.docsByLength, docArrays=batch.docArrays)
+		for query in queries]
+
+def popOption(argv, name, default=None):
+	"""Removes an option and its value from command line arguments
+	Returns:
+		the value, or default without the option
+	"""
+	if name not in argv:
+		return default
+	i = argv.index(name)
+	value = argv[i + 1]
+	del argv[i:i + 2]
+	return value
+
+def popJobs(argv):
+	"""Removes --jobs N from command line arguments
+	Returns:
+		N, or 1 without the option
+	"""
+	jobs = int(popOption(argv, "--jobs", 1))
+	if jobs < 1:
+		sys.exit("--jobs must be at least 1")
+	return jobs
+
+def chunkTopics(topics, jobs):
+	"""Splits topics into consecutive batches, a few per job so that jobs
+	finishing early take on more
+	Returns:
+		list of lists of topics, in topic order
+	"""
+	size = max(1, math.ceil(len(topics) / (jobs * TOPIC_CHUNKS)))
+	return [topics[i:i + size] for i in range(0, len(topics), size)]
 
 def main():
 	# [index-directory-path] [query-file-path] [retrieval-model] [index-type] [results-file]
 	# python3 query.py indexes/ data/queryfile.txt cosine stem results/results.txt
 	# python3 query.py indexes/ data/queryfile.txt lm single results/results.txt
+	# python3 query.py indexes/ data/queryfile.txt bm25 single results/results.txt maxscore
+	# python3 query.py indexes/ data/queryfile.txt bm25 single results/results.txt vector
+	# python3 query.py indexes/ data/queryfile.txt bm25 single results/results.txt impact 5000
+	# python3 query.py indexes/ data/queryfile.txt bm25 single results/results.txt --jobs 4
+	# python3 query.py indexes/ data/queryfile.txt bm25 single results/results.txt --cache results/cache.json
 	# ./trec_eval data/qrel.txt data/results.txt
 
 	start_time = time()
 
+	jobs = popJobs(sys.argv)
+	# Rankings are cached in memory, up to --cache-size (0 for none), and 
+	# kept between runs in the --cache file
+	cachePath = popOption(sys.argv, "--cache")
+	cacheSize = result_cache.parseSize(popOption(sys.argv, "--cache-size", str(result_cache.CACHE_SIZE)))
 	indexPath = sys.argv[1]
 	queryPath = sys.argv[2]
 	retrievalModel = sys.argv[3].lower()
 	indexType = sys.argv[4]
 	resultsPath = sys.argv[5] 
+	# exhaustive, maxscore for dynamic pruning (BM25 and cosine), vector for
+	# NumPy scoring, or impact for score-at-a-time evaluation of an 
+	# impact-ordered index, with an optional budget of postings
+	evaluation = sys.argv[6].lower() if len(sys.argv) > 6 else "exhaustive"
+	budget = int(sys.argv[7]) if len(sys.argv) > 7 else None
+	k = 100
 
 	if indexPath[-1] != "/":
 		indexPath += "/"  
@@ -137,91 +799,67 @@ def main():
 	if not os.path.exists(resultsDir):
 		os.makedirs(resultsDir)
 
-	# Load inverted index and document length dictionary into memory 
-	resultsFile = open(resultsDir + "/" + resultsFile, "w+")
-	index = getIndex(indexPath, indexType)
-	docLength = getDocLength(indexType)
-
-	N = len(docLength)
-	C = getC(docLength)
-	avgDocLength = C / N 
+	# Load the index; a missing or stale sidecar stops the run here, before
+	# any worker starts
+	generation = getGeneration(indexPath, indexType)
+	batchArgs = (indexPath, indexType, retrievalModel, evaluation, budget, k)
+	openBatch(*batchArgs)
+	cache = result_cache.ResultCache(cacheSize)
+	if cachePath != None:
+		cache.load(cachePath, {indexType: generation})
 
 	# Preprocess queries 
-	queryNums = []
-	queries = []
 	with open(queryPath) as f:
-		for line in f.readlines():
-			if line.startswith("<num>"):
-				num = line.replace("<num> Number: ", "").replace("\n", "").rstrip()
-				queryNums.append(num)
-			elif line.startswith("<title>"):
-				num = line.replace("<title> Topic: ", "").replace("\n", "").rstrip()
-				queries.append(num)
-
-		# Send queries to retrieval model
-		for qIdx, q in enumerate(queries):
-			scores = {}
-			query = preprocess.parse(q, indexType)
-			queryLen = 0
-			for term in query:
-				q_tf = query[term]
-				if term in index:
-					pList = index[term].pList 
-					t_idf = float(index[term].idf)
-					# LM: docsWithTerm distinguishes docs with tf > 0 
-					docsWithTf = set()
-					for doc in pList: 
-						docid = doc[0]
-						doc_tf = int(doc[1].split(" ")[0])
-						docsWithTf.add(docid)
-
-						if retrievalModel == "cosine":
-							score = (doc_tf * t_idf) * (q_tf * t_idf)
-
-						elif retrievalModel == "bm25":
-							score = BM25(n=index[term].df, doc_tf=doc_tf, q_tf=q_tf, 
-								N=N, doclen=docLength[docid].tf, avgdoclen=avgDocLength)
-						elif retrievalModel == "lm":
-							score = LM(doc_tf=float(doc_tf), u=avgDocLength, cf=index[term].cf, C=C, D=docLength[docid].tf)
-						
-						# Cosine and BM25 use summation, LM uses product 
-						if docid in scores:
-							if retrievalModel == "cosine" or retrievalModel == "bm25":
-								scores[docid] += score
-							elif retrievalModel == "lm":
-								scores[docid] *= score
-						else:
-							scores[docid] = score
-
-					# LM: score documents that don't contain term
-					if retrievalModel == "lm":
-						tmp = set(docLength.keys())
-						docsWithoutTf = set(tmp).difference(docsWithTf)
-						score = LM(doc_tf=0, u=avgDocLength, cf=index[term].cf, C=C, D=docLength[docid].tf)
-						for docid in docsWithoutTf:
-							if docid in scores:
-								scores[docid] *= score 
-							else:
-								scores[docid] = score
-
-				# Cosine: calculate query length
-				queryLen += pow(q_tf * t_idf,2)
-
-			# Cosine: normalize for document length 
-			if retrievalModel == "cosine":
-				for doc in scores: 
-					scores[doc] = round(scores[doc] / math.sqrt(docLength[doc].tf_idf * queryLen), 8)
-
-			topScores = collections.Counter(scores).most_common(100)
-			# print(topScores)
-			for i, s in enumerate(topScores):
-				docID = str(s[0])
-				rank = str(i)
-				score = str(s[1])
-				resultsFile.write(queryNums[qIdx] + " 0 " + docID + " " + rank + " " + 
-					score + " " + str(retrievalModel.upper()))
-		end_time = time()
-		print('Query Processing:   {:.3f} s'.format(end_time - start_time))
+		topics = readTopics(f.readlines())
+	queries = [preprocess.parse(q, indexType, batch.stemmer, batch.stops) for queryNum, q in topics]
+	keys = [result_cache.resultKey(query, retrievalModel, indexType, k, evaluation, budget, generation)
+		for query in queries]
+
+	# Send the queries not in the cache to the retrieval model, each 
+	# distinct query once; with --jobs, worker processes rank batches of 
+	# them
+	ranked = {}
+	pending = collections.OrderedDict()
+	for key, query in zip(keys, queries):
+		if key in ranked or key in pending:
+			# A repeat of an earlier topic of this run
+			cache.hits += 1
+			continue
+		topScores = cache.get(key)
+		if topScores == None:
+			pending[key] = query
+		else:
+			ranked[key] = topScores
+	if jobs == 1:
+		rankedPending = rankQueries(list(pending.values()))
+	else:
+		with multiprocessing.Pool(jobs, initializer=openBatch, initargs=batchArgs) as pool:
+			rankedPending = [topScores for chunk in pool.imap(rankQueries, 
+				chunkTopics(list(pending.values()), jobs)) for topScores in chunk]
+	for key, topScores in zip(pending, rankedPending):
+		ranked[key] = topScores
+		cache.put(key, topScores)
+
+	# Results are written in topic order, as a single process ranks them
+	resultsFile = open(resultsDir + "/" + resultsFile, "w+")
+	for (queryNum, q), key in zip(topics, keys):
+		for i, s in enumerate(ranked[key]):
+			docID = batch.docnos[s[0]]
+			rank = str(i)
+			score = str(s[1])
+			resultsFile.write(queryNum + " 0 " + docID + " " + rank + " " + 
+				score + " " + str(retrievalModel.upper()))
+	resultsFile.close()
+	closeBatch()
+	if cachePath != None:
+		cache.save(cachePath)
+	end_time = time()
+	print('Query Processing:   {:.3f} s'.format(end_time - start_time))
+	print('Queries/s:   {:.1f}'.format(len(topics) / (end_time - start_time)))
+	stats = cache.stats()
+	print('Cache:   {} hits, {} misses ({:.1%} hit rate), {} entries, {:.1f} of {:.1f} MB'.format(
+		stats["hits"], stats["misses"], stats["hitRate"], stats["entries"], stats["bytes"] / (1 << 20),
+		stats["maxBytes"] / (1 << 20)))
 
 if __name__== "__main__":
-	main()
\ No newline at end of file
+	main()
@@ -6,33 +6,49 @@ import query as query_static
 import os
 import sys
 import collections
-import ast
-import math
+import multiprocessing
 from time import time
 
-def processQuery(query, indexType, index):
+# An index's document lengths and the collection statistics BM25 takes
+# from them (see getLengths)
+Lengths = collections.namedtuple("Lengths", ["docLength", "N", "avgDocLength"])
+
+def getLengths(indexPath, indexType):
+	"""Loads the document lengths of an index type, for processQuery
+	Args: 
+		indexType: type of index (single, stem, phrase, positional)
+	Returns:
+		Lengths
+	"""
+	# BM25 only needs the lengths
+	docLength = query_static.getDocLength(indexPath, indexType, norms=False)
+	N = len(docLength)
+	C = query_static.getC(docLength)
+	return Lengths(docLength, N, C / N)
+
+def processQuery(query, indexType, index, lengths, stops):
 	"""Processes and sends query to the BM25 retrieval model. 
 	Logical flow is similar to that in query.py main() function.  
 	Args: 
 		query: query string 
 		indexType: type of index (single, stem, phrase, positional)
-		index: dictionary (key: term, value: Term object)
+		index: postings.LazyIndex (key: term, value: postings.Term object)
+		lengths: Lengths of the index, see getLengths
+		stops: set of stop words
 	Returns:
-		docLength dictionary (key: docID, value: DocLength object)
+		scores dictionary (key: doc id, value: score)
 	"""
 	scores = {}
-	docLength = query_static.getDocLength(indexType)
-
-	N = len(docLength)
-	C = query_static.getC(docLength)
-	avgDocLength = C / N 
+	docLength = lengths.docLength
+	N = lengths.N
+	avgDocLength = lengths.avgDocLength
 
 	if indexType == "phrase":
 		query = [query]
 	elif indexType == "positional":
 		query = query.split(" ")
 	elif indexType == "single":
-		query = preprocess.parse(query, "single")
+		query = preprocess.parse(query, "single", stops=stops)
 
 	for term in query:
 		if term in index: 
@@ -42,10 +58,10 @@ def processQuery(query, indexType, index):
 
 			for doc in pList: 
 				docid = doc[0]
-				if indexType == "positional":
-					doc_tf = len(ast.literal_eval(pList[0][1]))
-				else: 
-					doc_tf = int(doc[1].split(" ")[0])
+				# Each posting's own tf, positional postings included; the text
+				# index scored every positional posting with 1 + the tf of the
+				# list's first posting
+				doc_tf = doc[1]
 
 				score = query_static.BM25(n=index[term].df, doc_tf=doc_tf, q_tf=q_tf, 
 				N=N, doclen=docLength[docid].tf, avgdoclen=avgDocLength)
@@ -91,7 +107,7 @@ def isPhrase(allPos):
 	# Assign pointers to first element 
 	ptrs = []
 	for p in allPos:
-		ptr = 1
+		ptr = 0
 		ptrs.append(ptr)
 
 	longest = longestList(allPos)
@@ -121,7 +137,7 @@ def isPhrase(allPos):
 def intersect(pLists):
 	"""Finds intersection of posting lists based on document id 
 	Args: 
-		pLists: list of posting lists in format '[[docID, [positional list]], ...]
+		pLists: list of posting lists in format [(docID, tf, [positional list]), ...]
 	Returns:
 	 dictionary (key: document id, value: list of positional lists)
 	"""
@@ -129,7 +145,7 @@ def intersect(pLists):
 	plDicts = []
 	plSets = []
 	for pl in pLists:
-		plDict = {k[0]: ast.literal_eval(k[1]) for k in pl}
+		plDict = {k[0]: k[2] for k in pl}
 		plDicts.append(plDict)
 		pl_set = set(plDict.keys())
 		plSets.append(pl_set)
@@ -145,13 +161,94 @@ def intersect(pLists):
 		final[doc] = temp
 	return final
 
+# The indexes a process ranks topics with (see openBatch); each --jobs
+# worker opens its own
+batch = None
+Batch = collections.namedtuple("Batch", ["phraseIndex", "positionalIndex", "singleIndex",
+	"phraseLengths", "positionalLengths", "singleLengths", "docnos", "stops"])
+
+def openBatch(indexPath):
+	"""Opens the phrase, positional and single indexes in this process, and
+	loads their document lengths and the stop words once, for runTopics. 
+	Pool initializer for --jobs: each worker maps the same index files, so 
+	the operating system keeps one copy of their pages for all of them
+	"""
+	global batch
+	# Opening an index reads only its dictionary; posting lists are decoded
+	# as the queries use them
+	batch = Batch(query_static.getIndex(indexPath, "phrase-filtered"),
+		query_static.getIndex(indexPath, "positional"), query_static.getIndex(indexPath, "single"),
+		getLengths(indexPath, "phrase"), getLengths(indexPath, "positional"),
+		getLengths(indexPath, "single"), query_static.getDocnos(indexPath, "single"),
+		preprocess.loadStops())
+
+def runTopics(topics):
+	"""Ranks topics with the indexes openBatch opened
+	Args: 
+		topics: list of (topic number, title)
+	Returns:
+		their lines of the results file, in topic order
+	"""
+	phraseIndex = batch.phraseIndex
+	positionalIndex = batch.positionalIndex
+	singleIndex = batch.singleIndex
+	lines = []
+	# Finds phrases in query
+	for queryNum, q in topics:
+		scores = {}
+		phrases = preprocess.parsePhrase(q, batch.stops)
+
+		phraseCount = 0
+		for phrase in phrases:
+			# Checks if phrase is in the filtered phrase index (phrases with df > 1)
+			if phrase in phraseIndex:
+				# print("sending to phrase")
+				scores = processQuery(phrase, "phrase", phraseIndex, batch.phraseLengths, batch.stops)
+			# Send query to positional index
+			else:
+				terms = phrase.split(" ")
+				if all(term in positionalIndex for term in terms):
+					pLists = []
+					for term in terms: 
+						pLists.append(positionalIndex[term].pList)
+					potentialDocs = intersect(pLists)
+					for d in potentialDocs:
+						if isPhrase(potentialDocs[d]) == True:
+							phraseCount += 1 
+					if phraseCount >= 1:
+						# print("sending to positional")
+						scores = processQuery(phrase, "positional", positionalIndex, batch.positionalLengths,
+							batch.stops)
+						continue
+
+		# If not enough documents found then use single term index
+		if len(scores) < 100 or phraseCount == 0: 
+			scores1 = processQuery(q, "single", singleIndex, batch.singleLengths, batch.stops)
+			scoresUnion = {**scores, **scores1}
+			scoresIntersection = set(scores).intersection(set(scores1))
+			for doc in scoresIntersection:
+				# Get weighted average of phrase and single idx scores
+				scoresUnion[doc] = (scores[doc] + scores1[doc]) / 2
+			scores = scoresUnion
+
+		topScores = collections.Counter(scores).most_common(100)
+		for i, s in enumerate(topScores):
+			docID = batch.docnos[s[0]]
+			rank = str(i)
+			score = str(s[1])
+			lines.append(queryNum + " 0 " + docID + " " + rank + " " + 
+				score + " BM25 " + "\n")
+	return "".join(lines)
+
 def main():
 	# [index-directory-path] [query-file-path] [results-file]
 	# python3 query_dynamic.py ./indexes/ ./data/queryfile.txt ./results/results-dynamic.txt
+	# python3 query_dynamic.py ./indexes/ ./data/queryfile.txt ./results/results-dynamic.txt --jobs 4
 	# ./trec_eval qrel.txt results/results.txt
 
 	start_time = time()
 
+	jobs = query_static.popJobs(sys.argv)
 	indexPath = sys.argv[1]
 	queryPath = sys.argv[2]
 	resultsPath = sys.argv[3] 
@@ -169,73 +266,32 @@ def main():
 	if not os.path.exists(resultsDir):
 		os.makedirs(resultsDir)
 
-	# Load inverted index and document length dictionary into memory 
 	resultsFile = open(resultsDir + "/" + resultsFile, "w+")
-	phraseIndex = query_static.getIndex(indexPath, "phrase-filtered")
+	openBatch(indexPath)
+	# Scores of the three indexes are combined by doc id, which they share
+	# when they were built together
+	for indexType in ("phrase-filtered", "positional"):
+		if query_static.getDocnos(indexPath, indexType) != batch.docnos:
+			sys.exit("The single, positional and phrase indexes have different doc tables; "
+				"rebuild them with build.py --types single,positional,phrase")
 
 	# Preprocess queries 
-	queryNums = []
-	queries = []
 	with open(queryPath) as f:
-		for line in f.readlines():
-			if line.startswith("<num>"):
-				num = line.replace("<num> Number: ", "").replace("\n", "").rstrip()
-				queryNums.append(num)
-			elif line.startswith("<title>"):
-				num = line.replace("<title> Topic: ", "").replace("\n", "").rstrip()
-				queries.append(num)
-
-		# Finds phrases in query
-		for qIdx, q in enumerate(queries):
-			scores = {}
-			stops = preprocess.loadStops()
-			phrases = preprocess.parsePhrase(q, stops)
-
-			phraseCount = 0
-			for phrase in phrases:
-				# Checks if phrase is in the filtered phrase index (phrases with df > 1)
-				if phrase in phraseIndex:
-					# print("sending to phrase")
-					scores = processQuery(phrase, "phrase", phraseIndex)
-				# Send query to positional index
-				else:
-					posIndex = query_static.getIndex(indexPath, "positional")
-					terms = phrase.split(" ")
-					if all(term in posIndex for term in terms):
-						pLists = []
-						for term in terms: 
-							pLists.append(posIndex[term].pList)
-						potentialDocs = intersect(pLists)
-						for d in potentialDocs:
-							if isPhrase(potentialDocs[d]) == True:
-								phraseCount += 1 
-						if phraseCount >= 1:
-							# print("sending to positional")
-							positionalIndex = query_static.getIndex(indexPath, "positional")
-							scores = processQuery(phrase, "positional", positionalIndex)
-							continue
-
-			# If not enough documents found then use single term index
-			if len(scores) < 100 or phraseCount == 0: 
-				singleIndex = query_static.getIndex(indexPath, "single")
-				scores1 = processQuery(q, "single", singleIndex)
-				scoresUnion = {**scores, **scores1}
-				scoresIntersection = set(scores).intersection(set(scores1))
-				for doc in scoresIntersection:
-					# Get weighted average of phrase and single idx scores
-					scoresUnion[doc] = (scores[doc] + scores1[doc]) / 2
-				scores = scoresUnion
-
-			topScores = collections.Counter(scores).most_common(100)
-			for i, s in enumerate(topScores):
-				docID = str(s[0])
-				rank = str(i)
-				score = str(s[1])
-				resultsFile.write(queryNums[qIdx] + " 0 " + docID + " " + rank + " " + 
-					score + " BM25 " + "\n")
+		topics = query_static.readTopics(f.readlines())
+
+	# With --jobs, worker processes rank batches of topics and the results
+	# are written in topic order, as a single process writes them
+	if jobs == 1:
+		resultsFile.write(runTopics(topics))
+	else:
+		with multiprocessing.Pool(jobs, initializer=openBatch, initargs=(indexPath,)) as pool:
+			for text in pool.imap(runTopics, query_static.chunkTopics(topics, jobs)):
+				resultsFile.write(text)
+	resultsFile.close()
 
 	end_time = time()
 	print('Query Processing:   {:.3f} s'.format(end_time - start_time))
+	print('Queries/s:   {:.1f}'.format(len(topics) / (end_time - start_time)))
 
 if __name__== "__main__":
-	main()
\ No newline at end of file
+	main()
@@ -0,0 +1,340 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import signal
+import socketserver
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import time, sleep
+import preprocess_query as preprocess
+import query as query_static
+import result_cache
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "preprocessing"))
+import impacts
+
+# A resident query service: the indexes are loaded once, and requests are
+# answered over HTTP on a local port or a Unix socket. Requests and
+# responses are JSON:
+#   POST /search  {"query": "...", "model": "bm25", "indexType": "single", "k": 100,
+#                  "evaluation": "exhaustive", "budget": null}
+#                 -> {"generation": "...", "results": [{"docno": "...", "score": 1.5}, ...]}
+#   POST /batch   {"topics": "<a TREC topic file>", "model": ..., "indexType": ..., "k": ...}
+#                 -> {"generation": "...", "topics": [{"num": "051", "results": [...]}, ...]}
+#                 with "format": "trec", the results file as text/plain instead
+#   POST /reload  -> {"reloaded": ["single", ...]}
+#   GET  /status  -> {"indexes": {"single": {"generation": "...", "N": 1765}, ...},
+#                     "cache": {"entries": 12, "bytes": ..., "hits": ..., "hitRate": 0.5, ...}}
+# model, indexType and evaluation default to the first of MODELS, of the
+# loaded types and of EVALUATIONS, k to K.
+MODELS = ["bm25", "cosine", "lm"]
+# maxscore prunes BM25 and cosine with the index's score bounds (see
+# query.maxScore) and vector scores with NumPy (see query.vectorScore);
+# the results are the same. impact reads an index built
+# with --impacts score-at-a-time, stopping after budget postings if given
+# (see query.impactSearch); its scores are quantized
+EVALUATIONS = ["exhaustive", "maxscore", "vector", "impact"]
+INDEX_TYPES = ["single", "stem"]
+K = 100
+# Seconds between checks for a new index generation
+POLL = 2.0
+# Times an index is reloaded if it is republished while being loaded
+LOAD_ATTEMPTS = 5
+MAX_BODY = 16 << 20
+
+class Engine:
+	"""One index type loaded for querying: the lazy index, document lengths,
+	docnos, impact-ordered indexes and, for stem, the stem table."""
+
+	def __init__(self, indexPath, indexType):
+		self.indexType = indexType
+		for attempt in range(LOAD_ATTEMPTS):
+			self.generation = query_static.getGeneration(indexPath, indexType)
+			self.index = query_static.getIndex(indexPath, indexType)
+			self.docLength = query_static.getDocLength(indexPath, indexType)
+			self.docnos = query_static.getDocnos(indexPath, indexType)
+			self.stemmer = query_static.getStemmer(indexPath) if indexType == "stem" else None
+			self.termBounds = query_static.getBounds(indexPath, indexType, self.index, self.docLength)
+			self.termImpacts = {}
+			for model in impacts.MODELS:
+				try:
+					self.termImpacts[model] = query_static.getImpacts(indexPath, indexType, model,
+						self.index)
+				except ValueError:
+					# Not built, or not yet rewritten for this index; the
+					# rewrite changes the generation
+					pass
+			if query_static.getGeneration(indexPath, indexType) == self.generation:
+				break
+			# Published again while we read it; the parts may not match
+			self.index.close()
+			for termImpacts in self.termImpacts.values():
+				termImpacts.close()
+		else:
+			raise RuntimeError(indexType + " index changed on every load attempt")
+		self.N = len(self.docLength)
+		self.C = query_static.getC(self.docLength)
+		self.avgDocLength = self.C / self.N
+		self.docsByLength = query_static.getDocsByLength(self.docLength)
+		self.docArrays = query_static.getDocArrays(self.docLength)
+
+	def search(self, text, model, k, stops, evaluation=EVALUATIONS[0], budget=None, cache=None):
+		"""Ranks the documents for a query string
+		Args:
+			cache: result_cache.ResultCache the ranking is looked up in and 
+			added to, or None
+		Returns:
+			list of the k best (docno, score), best first
+		"""
+		termImpacts = None
+		if evaluation == "impact":
+			if model not in self.termImpacts:
+				raise ValueError("no {} impact index for {}".format(model, self.indexType))
+			termImpacts = self.termImpacts[model]
+		query = preprocess.parse(text, self.indexType, self.stemmer, stops)
+		key = result_cache.resultKey(query, model, self.indexType, k, evaluation, budget, self.generation)
+		topScores = cache.get(key) if cache != None else None
+		if topScores == None:
+			topScores = query_static.search(query, self.index, self.docLength, model, self.N, self.C,
+				self.avgDocLength, k, self.termBounds if evaluation == "maxscore" else None,
+				termImpacts, budget, self.docsByLength, self.docArrays if evaluation == "vector" else None)
+			if cache != None:
+				cache.put(key, topScores)
+		return [(self.docnos[docid], score) for docid, score in topScores]
+
+class QueryService:
+	"""Holds an Engine per index type and swaps in a new one when the index
+	type's generation changes. A request uses the engine it started with, so
+	it never sees half of a reload; a replaced engine is freed (and its
+	files unmapped) once the last request using it is done. Rankings are
+	cached by the generation they were ranked on, and a reload drops those
+	of the replaced generation."""
+
+	def __init__(self, indexPath, indexTypes, stops, cache=None):
+		self.indexPath = indexPath
+		self.stops = stops
+		self.cache = cache
+		self.engines = {indexType: Engine(indexPath, indexType) for indexType in indexTypes}
+		self.reloadLock = threading.Lock()
+
+	def engine(self, indexType):
+		if indexType not in self.engines:
+			raise ValueError("index type not loaded: {}".format(indexType))
+		return self.engines[indexType]
+
+	def reload(self):
+		"""Reloads the index types whose generation changed.
+		Returns:
+			list of index types reloaded
+		"""
+		with self.reloadLock:
+			reloaded = []
+			for indexType, engine in list(self.engines.items()):
+				if query_static.getGeneration(self.indexPath, indexType) != engine.generation:
+					self.engines[indexType] = Engine(self.indexPath, indexType)
+					if self.cache != None:
+						self.cache.invalidate(indexType, self.engines[indexType].generation)
+					reloaded.append(indexType)
+			return reloaded
+
+	def watch(self, interval):
+		"""Reloads changed index types every interval seconds; run in a
+		daemon thread. A failed reload keeps the loaded generation and is
+		tried again at the next check."""
+		while True:
+			sleep(interval)
+			try:
+				for indexType in self.reload():
+					print('Reloaded ({}):   {}'.format(indexType, self.engines[indexType].generation))
+			except Exception as e:
+				print('Reload failed:   {}'.format(e), file=sys.stderr)
+
+	def status(self):
+		status = {"indexes": {indexType: {"generation": engine.generation, "N": engine.N}
+			for indexType, engine in self.engines.items()}}
+		if self.cache != None:
+			status["cache"] = self.cache.stats()
+		return status
+
+	def options(self, request):
+		"""Reads model, index type, k, evaluation and budget from a request.
+		Returns:
+			(Engine, model, k, evaluation, budget)
+		"""
+		model = request.get("model", MODELS[0]).lower()
+		if model not in MODELS:
+			raise ValueError("unknown model: {}".format(model))
+		engine = self.engine(request.get("indexType", next(iter(self.engines))))
+		k = request.get("k", K)
+		if not isinstance(k, int) or isinstance(k, bool) or k < 1:
+			raise ValueError("k must be a positive integer")
+		evaluation = request.get("evaluation", EVALUATIONS[0])
+		if evaluation not in EVALUATIONS:
+			raise ValueError("unknown evaluation: {}".format(evaluation))
+		budget = request.get("budget")
+		if budget != None and (not isinstance(budget, int) or isinstance(budget, bool) or budget < 0):
+			raise ValueError("budget must be a non-negative integer")
+		return engine, model, k, evaluation, budget
+
+	def search(self, request):
+		engine, model, k, evaluation, budget = self.options(request)
+		if not isinstance(request.get("query"), str):
+			raise ValueError("query must be a string")
+		results = engine.search(request["query"], model, k, self.stops, evaluation, budget, self.cache)
+		return {"generation": engine.generation,
+			"results": [{"docno": docno, "score": score} for docno, score in results]}
+
+	def batch(self, request):
+		"""Runs every topic of a TREC topic file.
+		Returns:
+			(response dict, or the results file text if format is "trec")
+		"""
+		engine, model, k, evaluation, budget = self.options(request)
+		if not isinstance(request.get("topics"), str):
+			raise ValueError("topics must be the text of a TREC topic file")
+		topics = query_static.readTopics(request["topics"].splitlines())
+		ranked = [(num, engine.search(title, model, k, self.stops, evaluation, budget, self.cache))
+			for num, title in topics]
+		if request.get("format") == "trec":
+			return "".join(num + " 0 " + docno + " " + str(rank) + " " + str(score) + " " +
+				model.upper() + "\n" for num, results in ranked
+				for rank, (docno, score) in enumerate(results))
+		return {"generation": engine.generation, "topics": [{"num": num,
+			"results": [{"docno": docno, "score": score} for docno, score in results]}
+			for num, results in ranked]}
+
+class Handler(BaseHTTPRequestHandler):
+	"""Routes requests to the server's QueryService."""
+
+	def do_GET(self):
+		if self.path == "/status":
+			self.reply(200, self.server.service.status())
+		else:
+			self.reply(404, {"error": "not found: " + self.path})
+
+	def do_POST(self):
+		routes = {"/search": self.server.service.search, "/batch": self.server.service.batch,
+			"/reload": lambda request: {"reloaded": self.server.service.reload()}}
+		if self.path not in routes:
+			self.reply(404, {"error": "not found: " + self.path})
+			return
+		try:
+			length = int(self.headers.get("Content-Length", 0))
+			if length > MAX_BODY:
+				raise ValueError("request body over {} bytes".format(MAX_BODY))
+			request = json.loads(self.rfile.read(length) or b"{}")
+			if not isinstance(request, dict):
+				raise ValueError("request must be a JSON object")
+			response = routes[self.path](request)
+		except ValueError as e:
+			self.reply(400, {"error": str(e)})
+			return
+		except Exception as e:
+			self.reply(500, {"error": "{}: {}".format(type(e).__name__, e)})
+			raise
+		self.reply(200, response)
+
+	def reply(self, code, response):
+		if isinstance(response, str):
+			body = response.encode("utf-8")
+			contentType = "text/plain; charset=utf-8"
+		else:
+			body = json.dumps(response).encode("utf-8")
+			contentType = "application/json"
+		self.send_response(code)
+		self.send_header("Content-Type", contentType)
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		if self.server.verbose:
+			BaseHTTPRequestHandler.log_message(self, format, *args)
+
+	def address_string(self):
+		# Unix socket clients have no address
+		return self.client_address[0] if self.client_address else "unix"
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+
+def main():
+	# [index-directory-path] --types single,stem (--port 8080 | --socket path)
+	# python3 query_server.py indexes/ --types single,stem --port 8080
+	# curl -s localhost:8080/search -d '{"query": "export controls", "model": "bm25"}'
+	# curl -s localhost:8080/batch -d "$(jq -Rs '{topics: ., format: "trec"}' data/queryfile.txt)"
+	parser = argparse.ArgumentParser(description="Serves queries over resident indexes")
+	parser.add_argument("indexPath", help="directory holding the index files")
+	parser.add_argument("--types", default="single",
+		help="comma-separated index types to load: single, stem (default: %(default)s)")
+	parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+	parser.add_argument("--port", type=int, default=8080, help="TCP port (default: %(default)s)")
+	parser.add_argument("--socket", help="listen on this Unix socket instead of a TCP port")
+	parser.add_argument("--stops", default="data/stops.txt", help="stop word file")
+	parser.add_argument("--poll", type=float, default=POLL,
+		help="seconds between checks for a new index generation, 0 to only reload on "
+		"POST /reload or SIGHUP (default: %(default)s)")
+	parser.add_argument("--cache-size", type=result_cache.parseSize, default=result_cache.CACHE_SIZE,
+		help="bytes of query results to cache, e.g. 64MB, 0 for no cache (default: 64MB)")
+	parser.add_argument("--cache", help="file the result cache is loaded from at start and saved "
+		"to on shutdown")
+	parser.add_argument("--verbose", action="store_true", help="log every request")
+	args = parser.parse_args()
+
+	start_time = time()
+	indexPath = args.indexPath
+	if indexPath[-1] != "/":
+		indexPath += "/"
+	indexTypes = args.types.split(",")
+	for indexType in indexTypes:
+		if indexType not in INDEX_TYPES:
+			parser.error("unknown index type: " + indexType)
+	with open(args.stops) as f:
+		stops = set([x.strip() for x in f.readlines()])
+
+	cache = result_cache.ResultCache(args.cache_size) if args.cache_size > 0 else None
+	service = QueryService(indexPath, indexTypes, stops, cache)
+	for indexType, engine in service.engines.items():
+		print('Loaded ({}):   {}'.format(indexType, engine.generation))
+	if cache != None and args.cache != None:
+		print('Cached results:   {}'.format(cache.load(args.cache, {indexType: engine.generation
+			for indexType, engine in service.engines.items()})))
+	print('Load Indexes:   {:.3f} s'.format(time() - start_time))
+
+	if args.socket != None:
+		if os.path.exists(args.socket):
+			os.remove(args.socket)
+		server = UnixHTTPServer(args.socket, Handler)
+		print('Listening:   ' + args.socket)
+	else:
+		server = ThreadingHTTPServer((args.host, args.port), Handler)
+		print('Listening:   http://{}:{}/'.format(args.host, server.server_address[1]))
+	server.service = service
+	server.verbose = args.verbose
+	sys.stdout.flush()
+
+	if args.poll > 0:
+		threading.Thread(target=service.watch, args=(args.poll,), daemon=True).start()
+	# kill -HUP reloads at once
+	signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(target=service.reload,
+		daemon=True).start())
+	# kill -TERM stops like Ctrl-C, so the result cache is saved
+	signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown,
+		daemon=True).start())
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		if args.socket != None:
+			os.remove(args.socket)
+		if cache != None and args.cache != None:
+			cache.save(args.cache)
+
+if __name__== "__main__":
+	main()
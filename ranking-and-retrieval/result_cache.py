@@ -0,0 +1,170 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import argparse
+import collections
+import json
+import os
+import re
+import sys
+import threading
+
+# Query result cache, kept in memory and, with --cache, in a JSON file
+# that is loaded when a run starts and saved when it ends:
+#   {"version": 1, "entries": [[key, results], ...]}
+# Entries are listed from least to most recently used. A key is
+# [query, model, index type, k, evaluation, budget, generation]. query is
+# the [term, tf] pairs of the parsed query (see preprocess_query.parse), in
+# query order, since that is the order the scores are summed in. generation
+# is the index generation the results were ranked on (see
+# query.getGeneration). results are [doc id, score] pairs, best first.
+# Entries of another generation never match a key, and loading the cache
+# for an index type drops its entries of other generations, so publishing
+# a new index invalidates them.
+CACHE_VERSION = 1
+# Default bound on the bytes the entries hold
+CACHE_SIZE = 64 << 20
+UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+
+def parseSize(value):
+	"""Parses a --cache-size value.
+	Args:
+	    value: a byte count with an optional unit (64MB, 1.5G)
+	Returns:
+	    number of bytes
+	"""
+	match = re.match(r'^(\d+(?:\.\d+)?)\s*([KMG]?)B?$', value.strip(), re.IGNORECASE)
+	if not match:
+		raise argparse.ArgumentTypeError("invalid cache size: " + value)
+	return int(float(match.group(1)) * UNITS[match.group(2).upper()])
+
+def resultKey(query, model, indexType, k, evaluation, budget, generation):
+	"""Cache key of a ranking.
+	Args:
+	    query: dictionary (key: term, value: query tf), see preprocess_query.parse
+	Returns:
+	    hashable key
+	"""
+	return (tuple(query.items()), model, indexType, k, evaluation, budget, generation)
+
+def entrySize(key, results):
+	"""Approximate bytes an entry holds: its key, its result list and the
+	pairs in it."""
+	size = sys.getsizeof(key) + sys.getsizeof(key[0]) + sys.getsizeof(results)
+	for term, tf in key[0]:
+		size += sys.getsizeof((term, tf)) + sys.getsizeof(term)
+	for docid, score in results:
+		size += sys.getsizeof((docid, score)) + sys.getsizeof(docid) + sys.getsizeof(score)
+	return size
+
+class ResultCache:
+	"""LRU cache of top-k rankings, bounded by the approximate bytes of its
+	entries. Safe to share between threads."""
+
+	def __init__(self, maxBytes=CACHE_SIZE):
+		self.maxBytes = maxBytes
+		self.entries = collections.OrderedDict()
+		self.sizes = {}
+		self.bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.invalidated = 0
+		self.lock = threading.Lock()
+
+	def __contains__(self, key):
+		return key in self.entries
+
+	def __len__(self):
+		return len(self.entries)
+
+	def get(self, key):
+		"""Looks up a ranking and marks it most recently used.
+		Returns:
+		    list of (doc id, score), or None on a miss
+		"""
+		with self.lock:
+			results = self.entries.get(key)
+			if results == None:
+				self.misses += 1
+				return None
+			self.hits += 1
+			self.entries.move_to_end(key)
+			return results
+
+	def put(self, key, results):
+		"""Adds a ranking, evicting the least recently used ones over the
+		size bound. A ranking larger than the bound is not kept."""
+		size = entrySize(key, results)
+		with self.lock:
+			if key in self.entries:
+				self.remove(key)
+			if size > self.maxBytes:
+				return
+			self.entries[key] = results
+			self.sizes[key] = size
+			self.bytes += size
+			while self.bytes > self.maxBytes:
+				self.remove(next(iter(self.entries)))
+				self.evictions += 1
+
+	def remove(self, key):
+		del self.entries[key]
+		self.bytes -= self.sizes.pop(key)
+
+	def invalidate(self, indexType, generation):
+		"""Drops the rankings of an index type ranked on another generation.
+		Returns:
+		    number of entries dropped
+		"""
+		with self.lock:
+			stale = [key for key in self.entries if key[2] == indexType and key[-1] != generation]
+			for key in stale:
+				self.remove(key)
+			self.invalidated += len(stale)
+			return len(stale)
+
+	def stats(self):
+		lookups = self.hits + self.misses
+		return {"entries": len(self.entries), "bytes": self.bytes, "maxBytes": self.maxBytes,
+			"hits": self.hits, "misses": self.misses, "hitRate": self.hits / lookups if lookups else 0.0,
+			"evictions": self.evictions, "invalidated": self.invalidated}
+
+	def load(self, path, generations):
+		"""Adds the entries saved in a cache file. A missing or unreadable
+		file is an empty cache.
+		Args:
+		    generations: dictionary (key: index type, value: its current
+		    generation); entries ranked on another generation of these index
+		    types are dropped, those of other index types kept
+		Returns:
+		    number of entries loaded
+		"""
+		try:
+			with open(path) as f:
+				saved = json.load(f)
+			if saved["version"] != CACHE_VERSION:
+				return 0
+			entries = saved["entries"]
+		except (OSError, ValueError, KeyError, TypeError):
+			return 0
+		loaded = 0
+		for key, results in entries:
+			query, model, indexType, k, evaluation, budget, generation = key
+			if indexType in generations and generations[indexType] != generation:
+				self.invalidated += 1
+				continue
+			self.put((tuple((term, tf) for term, tf in query), model, indexType, k, evaluation, budget,
+				generation), [(docid, score) for docid, score in results])
+			loaded += 1
+		return loaded
+
+	def save(self, path):
+		"""Writes the entries to a cache file, replacing it atomically."""
+		with self.lock:
+			entries = [[[[list(pair) for pair in key[0]]] + list(key[1:]),
+				[[int(docid), float(score)] for docid, score in results]]
+				for key, results in self.entries.items()]
+		with open(path + ".tmp", "w") as f:
+			json.dump({"version": CACHE_VERSION, "entries": entries}, f)
+		os.replace(path + ".tmp", path)
@@ -0,0 +1,363 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import nltk
+import numpy as np
+
+PREPROCESSING = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "preprocessing")
+sys.path.append(PREPROCESSING)
+import postings
+import runs
+import segments
+import shards
+import tokenizer
+from build import addToDict, countPhrases, replaceEscSeq
+
+WORDS = ["export", "control", "federal", "register", "rule", "agency", "notice", "tariff", "import",
+	"commerce", "wheat", "grain", "safety", "vehicle", "permit"]
+
+def writeTrecFile(path, prefix, numDocs):
+	"""Writes a TREC file of numDocs documents with overlapping vocabularies."""
+	with open(path, "w") as f:
+		for i in range(numDocs):
+			words = [WORDS[(i * 7 + j * 3) % len(WORDS)] for j in range(5 + i % 6)]
+			f.write("<DOC>\n<DOCNO> {}-{:05d} </DOCNO>\n<TEXT>\n{}\n</TEXT>\n</DOC>\n".format(prefix, i,
+				" ".join(words)))
+
+def build(workDir, trecDir, outputDir, *options):
+	subprocess.check_call([sys.executable, os.path.join(PREPROCESSING, "build.py"), trecDir, "single",
+		outputDir] + list(options), cwd=workDir, stdout=subprocess.DEVNULL)
+
+def contents(indexDir):
+	"""Returns:
+	    (sorted docnos, N, dict from term to sorted (docno, tf) postings)
+	"""
+	reader = segments.openIndex(indexDir, "single")
+	docs = reader.docs
+	postingLists = {term: sorted((docs[docid], tf) for docid, tf, positions in reader.rawPostings(term))
+		for term in reader}
+	N = reader.N
+	reader.close()
+	return sorted(docs), N, postingLists
+
+def lengths(reader):
+	"""Returns:
+	    (N, dict from docno to (total tf, tf-idf norm))
+	"""
+	return reader.N, {reader.docs[docid]: length for docid, length in reader.docLengths().items()}
+
+def computedLengths(reader):
+	"""lengths() summed from the posting lists rather than the statistics."""
+	lengthArray, norms = reader.computeLengths()
+	return int(np.count_nonzero(lengthArray)), {reader.docs[docid]: (length, norm) for docid, (length, norm)
+		in enumerate(zip(lengthArray.tolist(), norms.tolist())) if length}
+
+def statsFiles(directory):
+	return sorted(f for f in os.listdir(directory) if f.startswith("segments-"))
+
+def assertLengthsAlmostEqual(test, actual, expected):
+	"""Norms summed in another order differ in the last bits."""
+	test.assertEqual(actual[0], expected[0])
+	test.assertEqual(sorted(actual[1]), sorted(expected[1]))
+	for docno, (length, norm) in expected[1].items():
+		test.assertEqual(actual[1][docno][0], length)
+		test.assertAlmostEqual(actual[1][docno][1], norm, places=9)
+
+# Documents whose lines have no '.', '?' or '!', so the baseline's
+# nltk.word_tokenize can skip Punkt (preserve_line) and still split them as
+# it would have
+PHRASE_DOCS = [
+	["federal register notice of export control"],
+	# Phrases across lines, from one or two trailing words, and lines of
+	# fewer than three tokens
+	["the agency issued export", "control rules for wheat grain", "safety", "vehicle permit",
+		"import tariff", "commerce"],
+	["rule", "agency notice", "of the", "federal register", "a b", "export control rule"],
+	# Stop words and symbols break phrases
+	["export, control (rule) and: the agency; grain & wheat % tariff", "# safety $ vehicle @ permit"],
+	# Quotes and contractions
+	["the agency's \"export control\" rule doesn't apply", "'federal register' won't list it",
+		"``import tariff'' can't rise"],
+	["Export Control RULE with Mixed CASE", "wheat-grain safety-vehicle permit"],
+]
+
+def baselinePhrases(lines, stops):
+	"""The two/three-word phrases of one document as the original build.py
+	counted them (preProcessPhrase)."""
+	termfreq = {}
+	lastTwo = []
+	for i, line in enumerate(lines):
+		line = replaceEscSeq(line)
+		tokens = nltk.word_tokenize(line, preserve_line=True)
+		tokens = list(filter(None, tokens))
+		tokens = [x.lower() for x in tokens]
+
+		# Handle edge case: phrase on two lines
+		if baselineIsPhrase(stops, tokens[0]):
+			if len(lastTwo) == 2:
+				phrase = " ".join(lastTwo) + " " + tokens[0]
+				addToDict(phrase, termfreq, None)
+			if len(lastTwo) == 1:
+				phrase = lastTwo[0] + " " + tokens[0]
+				addToDict(phrase, termfreq, None)
+		if len(tokens) > 1 and baselineIsPhrase(stops, tokens[0]) and baselineIsPhrase(stops, tokens[1]):
+			if len(lastTwo) == 2:
+				phrase = lastTwo[1] + " " + tokens[0] + " " + tokens[1]
+				addToDict(phrase, termfreq, None)
+			if len(lastTwo) == 1:
+				phrase = lastTwo[0] + " " + tokens[0] + " " + tokens[1]
+				addToDict(phrase, termfreq, None)
+		lastTwo = []
+
+		i = j = 0
+		phrase = ""
+		while i < len(tokens) - 2:
+			while (j - i) < 3 and baselineIsPhrase(stops, tokens[j]):
+				phrase += tokens[j] + " "
+				if j - i >= 1:
+					addToDict(phrase[:-1], termfreq, None)
+				j += 1
+			if (j - i) < 3:
+				i = j = j + 1
+			else:
+				i = j = i + 1
+			phrase = ""
+		if len(tokens) > 1 and baselineIsPhrase(stops, tokens[-2]) and baselineIsPhrase(stops, tokens[-1]):
+			lastTwo.append(tokens[-2])
+			lastTwo.append(tokens[-1])
+		elif baselineIsPhrase(stops, tokens[-1]):
+			lastTwo.append(tokens[-1])
+	return termfreq
+
+def baselineIsPhrase(stops, token):
+	symbol = set([",","(", ")", ".", "?", "!", "'", ";", "...", " ", "", ":", "",
+		"-", "@","$","^","*","@","/", "○", "•", "``", "''", "&", "[", "]", "%", "#"])
+	return token not in stops and token not in symbol
+
+class PhraseTest(unittest.TestCase):
+
+	def testCountPhrasesMatchesBaseline(self):
+		stops = set(["the", "of", "and", "a", "for", "with", "it"])
+		for lines in PHRASE_DOCS:
+			for line in lines:
+				self.assertEqual(tokenizer.SENTENCE_END.search(line), None)
+			with self.subTest(lines=lines):
+				termfreq = {}
+				countPhrases([replaceEscSeq(line) for line in lines], stops, termfreq)
+				self.assertEqual(termfreq, baselinePhrases(lines, stops))
+
+class AppendTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		with open(os.path.join(self.dir, "stops.txt"), "w") as f:
+			f.write("the\nof\nand\n")
+		self.allFiles = os.path.join(self.dir, "trec")
+		self.firstFiles = os.path.join(self.dir, "first")
+		self.newFiles = os.path.join(self.dir, "new")
+		for path in (self.allFiles, self.firstFiles, self.newFiles):
+			os.makedirs(path)
+		for i in range(5):
+			writeTrecFile(os.path.join(self.allFiles, "fr94010%d.0" % i), "FR94010%d" % i, 20 + i)
+		# An index of two files, then a directory of three new ones
+		for i, name in enumerate(sorted(os.listdir(self.allFiles))):
+			shutil.copy(os.path.join(self.allFiles, name), self.firstFiles if i < 2 else self.newFiles)
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def output(self, name):
+		path = os.path.join(self.dir, name) + "/"
+		os.makedirs(path + "temp")
+		os.makedirs(path + "indexes")
+		return path
+
+	def testAppendAddsToExistingIndex(self):
+		full = self.output("full")
+		build(self.dir, self.allFiles, full)
+		appended = self.output("appended")
+		build(self.dir, self.firstFiles, appended)
+		build(self.dir, self.newFiles, appended, "--append", "--merge", "none")
+		self.assertTrue(segments.isSegmented(appended + "indexes", "single"))
+		self.assertEqual(contents(appended + "indexes"), contents(full + "indexes"))
+
+	def testStatisticsAreSavedOnFirstUse(self):
+		appended = self.output("appended")
+		build(self.dir, self.firstFiles, appended)
+		build(self.dir, self.newFiles, appended, "--append", "--merge", "none")
+		directory = segments.segmentDir(appended + "indexes", "single")
+		generation = segments.readManifest(directory)["generation"]
+		# The append reads no posting list
+		self.assertEqual(statsFiles(directory), [])
+
+		# Lengths come from the segments' own statistics
+		reader = segments.openIndex(appended + "indexes", "single")
+		self.assertEqual(len(reader.readers), 2)
+		self.assertIsNone(reader.norms)
+		N, expected = computedLengths(reader)
+		self.assertEqual(reader.N, N)
+		self.assertEqual(reader.docLengths(norms=False),
+			{reader.docs.index(docno): (length, None) for docno, (length, norm) in expected.items()})
+		self.assertEqual(statsFiles(directory), [])
+		# Norms are summed once and saved for the generation
+		self.assertEqual(lengths(reader), (N, expected))
+		reader.close()
+		self.assertEqual(statsFiles(directory), ["segments-%d.stats" % generation])
+		reader = segments.openIndex(appended + "indexes", "single")
+		self.assertIsNotNone(reader.norms)
+		self.assertEqual(lengths(reader), computedLengths(reader))
+		reader.close()
+
+		# <type>-filtered needs its lengths and N on opening
+		reader = segments.openIndex(appended + "indexes", "single" + segments.FILTERED)
+		self.assertIsNotNone(reader.norms)
+		self.assertEqual(lengths(reader), computedLengths(reader))
+		reader.close()
+		self.assertEqual(statsFiles(directory),
+			["segments-%d-filtered.stats" % generation, "segments-%d.stats" % generation])
+
+	def testStatisticsOfEarlierGenerationAreNotRead(self):
+		appended = self.output("appended")
+		build(self.dir, self.firstFiles, appended)
+		nextFiles = os.path.join(self.dir, "next")
+		os.makedirs(nextFiles)
+		shutil.move(os.path.join(self.newFiles, sorted(os.listdir(self.newFiles))[0]), nextFiles)
+		build(self.dir, nextFiles, appended, "--append", "--merge", "none")
+		reader = segments.openIndex(appended + "indexes", "single")
+		lengths(reader)
+		reader.close()
+		build(self.dir, self.newFiles, appended, "--append", "--merge", "none")
+		reader = segments.openIndex(appended + "indexes", "single")
+		self.assertEqual(len(reader.readers), 3)
+		self.assertIsNone(reader.norms)
+		self.assertEqual(lengths(reader), computedLengths(reader))
+		reader.close()
+		directory = segments.segmentDir(appended + "indexes", "single")
+		self.assertEqual(statsFiles(directory),
+			["segments-%d.stats" % segments.readManifest(directory)["generation"]])
+
+	def testMergeKeepsStatistics(self):
+		appended = self.output("appended")
+		build(self.dir, self.firstFiles, appended)
+		# Two files of about as many documents as the first two, so that the
+		# segments are on one tier
+		nextFiles = os.path.join(self.dir, "next")
+		os.makedirs(nextFiles)
+		for name in sorted(os.listdir(self.newFiles))[:2]:
+			shutil.copy(os.path.join(self.newFiles, name), nextFiles)
+		build(self.dir, nextFiles, appended, "--append", "--merge", "none")
+		before = {}
+		for indexType in ("single", "single" + segments.FILTERED):
+			reader = segments.openIndex(appended + "indexes", indexType)
+			before[indexType] = lengths(reader)
+			reader.close()
+		directory = segments.segmentDir(appended + "indexes", "single")
+		self.assertEqual(len(segments.mergeAll(directory, factor=2)), 1)
+		generation = segments.readManifest(directory)["generation"]
+		self.assertEqual(statsFiles(directory),
+			["segments-%d-filtered.stats" % generation, "segments-%d.stats" % generation])
+		for indexType in ("single", "single" + segments.FILTERED):
+			reader = segments.openIndex(appended + "indexes", indexType)
+			self.assertEqual(len(reader.readers), 1)
+			self.assertIsNotNone(reader.norms)
+			assertLengthsAlmostEqual(self, lengths(reader), before[indexType])
+			self.assertEqual(lengths(reader), computedLengths(reader))
+			reader.close()
+
+	def testAppendRefusesIndexWithoutFileRecord(self):
+		appended = self.output("appended")
+		build(self.dir, self.firstFiles, appended)
+		os.remove(segments.filesPath(os.path.join(appended, "indexes", "single.idx")))
+		with self.assertRaises(subprocess.CalledProcessError):
+			build(self.dir, self.newFiles, appended, "--append")
+		self.assertFalse(segments.isSegmented(appended + "indexes", "single"))
+
+class ShardTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		with open(os.path.join(self.dir, "stops.txt"), "w") as f:
+			f.write("the\nof\nand\n")
+		self.trecFiles = os.path.join(self.dir, "trec")
+		os.makedirs(self.trecFiles)
+		for i in range(3):
+			writeTrecFile(os.path.join(self.trecFiles, "fr94010%d.0" % i), "FR94010%d" % i, 20 + i)
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def output(self, name):
+		path = os.path.join(self.dir, name) + "/"
+		os.makedirs(path + "temp")
+		os.makedirs(path + "indexes")
+		return path
+
+	def testShardsOpenWithGlobalStatistics(self):
+		full = self.output("full")
+		build(self.dir, self.trecFiles, full)
+		sharded = self.output("sharded")
+		build(self.dir, self.trecFiles, sharded, "--shards", "3")
+		self.assertTrue(shards.isSharded(sharded + "indexes", "single"))
+		reader = postings.IndexReader(postings.indexPath(full + "indexes", "single"))
+		expected = lengths(reader)
+		reader.close()
+		reader = segments.openIndex(sharded + "indexes", "single")
+		self.assertIsNotNone(reader.norms)
+		assertLengthsAlmostEqual(self, lengths(reader), expected)
+		self.assertEqual(lengths(reader), computedLengths(reader))
+		reader.close()
+		reader = segments.openIndex(sharded + "indexes", "single" + segments.FILTERED)
+		self.assertIsNotNone(reader.norms)
+		self.assertEqual(lengths(reader), computedLengths(reader))
+		reader.close()
+		self.assertEqual(shards.verify(sharded, "single"), [])
+
+class MemoryTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		with open(os.path.join(self.dir, "stops.txt"), "w") as f:
+			f.write("the\nof\nand\n")
+		os.makedirs(os.path.join(self.dir, "trec"))
+		writeTrecFile(os.path.join(self.dir, "trec", "fr940100.0"), "FR940100", 20)
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def testBudgetBelowFootprintIsRefused(self):
+		output = os.path.join(self.dir, "out") + "/"
+		process = subprocess.run([sys.executable, os.path.join(PREPROCESSING, "build.py"), "trec",
+			"stem", output, "--memory", "1MB"], cwd=self.dir, stdout=subprocess.PIPE,
+			stderr=subprocess.PIPE, universal_newlines=True)
+		self.assertNotEqual(process.returncode, 0)
+		self.assertIn("less than the builder's own footprint", process.stderr)
+
+	def addDocuments(self, runWriter, numDocs, terms=8):
+		for i in range(numDocs):
+			runWriter.reserve(4 << 20)
+			runWriter.addDocument("FR-{:05d}".format(i), {"term{}".format((i + j) % 500): 1
+				for j in range(terms)})
+
+	def testBudgetPressureDoesNotSpillSmallRuns(self):
+		# Parsing a 4 MB document never fits, yet runs keep MIN_RUN triples
+		runWriter = runs.RunWriter(self.dir, "test-", memory=runs.currentRSS() + 32 * runs.MB,
+			capacity=1 << 20)
+		self.addDocuments(runWriter, runs.MIN_RUN // 8 + 10)
+		self.assertEqual([run["triples"] for run in runWriter.runs], [runs.MIN_RUN])
+		runWriter.close()
+
+	def testOverBudgetRaises(self):
+		runWriter = runs.RunWriter(self.dir, "test-", memory=runs.currentRSS() // 2, capacity=1 << 20)
+		with self.assertRaises(MemoryError):
+			self.addDocuments(runWriter, 1)
+		self.assertEqual(runWriter.runs, [])
+		runWriter.close()
+
+if __name__== "__main__":
+	unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "preprocessing"))
+import codec
+
+MAX = 2 ** 32 - 1
+
+def lists():
+	"""Lists of ints at the edges of each codec: empty lists, 0 and 2^32 - 1,
+	byte and bit-width boundaries, and lengths around a block."""
+	rand = random.Random(488)
+	yield []
+	yield [0]
+	yield [MAX]
+	yield [0, MAX, 0, MAX]
+	yield [127, 128, 16383, 16384, 2 ** 21 - 1, 2 ** 21, 2 ** 28 - 1, 2 ** 28]
+	yield [2 ** k - 1 for k in range(33)] + [2 ** k for k in range(32)]
+	for length in (codec.BLOCK - 1, codec.BLOCK, codec.BLOCK + 1, 2 * codec.BLOCK, 3 * codec.BLOCK + 5):
+		yield [0] * length
+		yield [MAX] * length
+		# Small values with large exceptions, which blockEncode patches in
+		yield [rand.choice([rand.randint(0, 7), rand.randint(0, MAX)]) if i % 11 == 0 else
+			rand.randint(0, 7) for i in range(length)]
+		yield [rand.randint(0, MAX) for i in range(length)]
+
+class CodecTest(unittest.TestCase):
+
+	def testRoundTrip(self):
+		for name, (codecId, encode, decode) in sorted(codec.CODECS.items()):
+			for numbers in lists():
+				with self.subTest(codec=name, length=len(numbers)):
+					self.assertEqual(decode(encode(numbers), len(numbers)), numbers)
+
+	def testVbDecodeArray(self):
+		for numbers in lists():
+			with self.subTest(length=len(numbers)):
+				self.assertEqual(codec.vbDecodeArray(codec.vbEncode(numbers)).tolist(), numbers)
+
+	def testVbDecodeFrom(self):
+		numbers = [0, 127, 128, MAX, 5]
+		data = codec.vbEncode([MAX]) + codec.vbEncode(numbers) + codec.vbEncode([1])
+		self.assertEqual(codec.vbDecodeFrom(data, len(codec.vbEncode([MAX])), len(numbers)),
+			(numbers, len(data) - 1))
+
+	def testGaps(self):
+		postings = [(0, 1, [0]), (1, 3, [0, 1, MAX]), (5, 2, [7, 7 + 1]), (MAX, 1, [MAX])]
+		for positional in (False, True):
+			with self.subTest(positional=positional):
+				expected = postings if positional else [(d, tf, None) for d, tf, p in postings]
+				numbers = codec.toGaps(postings, positional)
+				self.assertTrue(all(0 <= n <= MAX for n in numbers))
+				self.assertEqual(codec.fromGaps(numbers, positional), expected)
+				for name, (codecId, encode, decode) in codec.CODECS.items():
+					self.assertEqual(codec.fromGaps(decode(encode(numbers), len(numbers)), positional),
+						expected)
+		self.assertEqual(codec.toGaps([], True), [])
+		self.assertEqual(codec.fromGaps([], True), [])
+
+if __name__== "__main__":
+	unittest.main()
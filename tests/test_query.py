@@ -0,0 +1,237 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import collections
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+PREPROCESSING = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "preprocessing")
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ranking-and-retrieval"))
+import preprocess_query
+import query
+
+STOPS = set(["the", "of", "and"])
+
+# "federal" is in almost every document, so its BM25 weight is negative
+WORDS = ["federal", "register", "export", "control", "rule", "agency", "notice", "tariff", "wheat",
+	"grain", "safety", "permit"]
+
+def writeTrecFile(path, numDocs):
+	"""Writes a TREC file of numDocs documents, each in it twice, so that
+	documents tie on every score. It starts with documents of "commerce"
+	alone, then of "import" alone, which tie with each other too."""
+	rand = random.Random(7)
+	docs = [["commerce"], ["commerce"], ["import"], ["import"]]
+	for i in range(numDocs):
+		words = ["federal"] * rand.randint(0, 2) + [rand.choice(WORDS[1:2 + i % len(WORDS)])
+			for j in range(rand.randint(1, 12))]
+		docs.extend([words, words])
+	with open(path, "w") as f:
+		for i, words in enumerate(docs):
+			f.write("<DOC>\n<DOCNO> FR940104-{:05d} </DOCNO>\n<TEXT>\n{}\n</TEXT>\n</DOC>\n".format(i,
+				" ".join(words)))
+
+def buildIndex(workDir, *options):
+	"""Builds the single index of a small collection.
+	Returns:
+	    index directory
+	"""
+	with open(os.path.join(workDir, "stops.txt"), "w") as f:
+		f.write("\n".join(sorted(STOPS)) + "\n")
+	os.makedirs(os.path.join(workDir, "trec"))
+	writeTrecFile(os.path.join(workDir, "trec", "fr940104.0"), 60)
+	outputDir = os.path.join(workDir, "output") + "/"
+	os.makedirs(outputDir + "temp")
+	os.makedirs(outputDir + "indexes")
+	subprocess.check_call([sys.executable, os.path.join(PREPROCESSING, "build.py"),
+		os.path.join(workDir, "trec") + "/", "single", outputDir] + list(options), cwd=workDir,
+		stdout=subprocess.DEVNULL)
+	return outputDir + "indexes/"
+
+class ParseTest(unittest.TestCase):
+
+	def testTermFrequencies(self):
+		self.assertEqual(preprocess_query.parse("export controls of export", "single", stops=STOPS),
+			{"export": 2, "controls": 1})
+
+	def testQueryWithoutTermsIsEmpty(self):
+		for indexType in ["single", "stem", "positional"]:
+			for query in ["", "   ", "?!"]:
+				self.assertEqual(preprocess_query.parse(query, indexType, stops=STOPS), {})
+		for indexType in ["single", "stem"]:
+			self.assertEqual(preprocess_query.parse("the of", indexType, stops=STOPS), {})
+
+Term = collections.namedtuple("Term", ["cf", "pList"])
+
+class QueryLikelihoodTest(unittest.TestCase):
+
+	def setUp(self):
+		# C = 20 terms over 5 documents, so u = 4, u * cf / C = 0.6 for a 
+		# and 0.8 for b
+		self.index = {
+			"a": Term(3, [(0, 2, []), (2, 1, [])]),
+			"b": Term(4, [(1, 1, []), (2, 3, [])]),
+		}
+		self.docLength = {docid: query.DocLength(tf, 0.0) for docid, tf in
+			enumerate([4, 2, 6, 3, 5])}
+
+	def testScoresAreLogOfProductForm(self):
+		# (tf + u * cf / C) / (D + u) per term, D the document's own length
+		products = {
+			0: (2 + 0.6) * (0 + 0.8) / (4 + 4) ** 2,
+			1: (0 + 0.6) * (1 + 0.8) / (2 + 4) ** 2,
+			2: (1 + 0.6) * (3 + 0.8) / (6 + 4) ** 2,
+			3: (0 + 0.6) * (0 + 0.8) / (3 + 4) ** 2,
+			4: (0 + 0.6) * (0 + 0.8) / (5 + 4) ** 2,
+		}
+		ranking = query.queryLikelihood({"a": 1, "b": 1, "absent": 1}, self.index, self.docLength,
+			C=20, avgDocLength=4.0)
+		self.assertEqual([docid for docid, score in ranking], [2, 0, 1, 3, 4])
+		for docid, score in ranking:
+			self.assertAlmostEqual(score, math.log(products[docid]), places=12)
+
+	def testUnmatchedDocumentsFillTopKShortestFirst(self):
+		ranking = query.queryLikelihood({"a": 1}, self.index, self.docLength, C=20, avgDocLength=4.0, k=4)
+		self.assertEqual([docid for docid, score in ranking], [0, 2, 1, 3])
+
+	def testQueryWithoutIndexedTermsIsEmpty(self):
+		self.assertEqual(query.queryLikelihood({"absent": 1}, self.index, self.docLength, C=20,
+			avgDocLength=4.0), [])
+
+QUERIES = [
+	{"export": 1},
+	{"export": 1, "control": 1},
+	{"control": 1, "export": 1},
+	{"wheat": 2, "grain": 1, "tariff": 1},
+	{"federal": 1},
+	{"federal": 1, "register": 1, "rule": 1},
+	{"agency": 1, "notice": 3, "absent": 1},
+	{"safety": 1, "permit": 1, "export": 1, "rule": 1, "grain": 1, "notice": 1},
+	{"import": 1, "commerce": 1},
+	{"absent": 1},
+]
+KS = [1, 2, 3, 5, 10, 200]
+
+class SearchTest(unittest.TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		cls.dir = tempfile.mkdtemp()
+		indexPath = buildIndex(cls.dir)
+		cls.index = query.getIndex(indexPath, "single")
+		cls.docLength = query.getDocLength(indexPath, "single")
+		cls.N = len(cls.docLength)
+		cls.C = query.getC(cls.docLength)
+		cls.termBounds = query.getBounds(indexPath, "single", cls.index, cls.docLength)
+		cls.docArrays = query.getDocArrays(cls.docLength)
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.index.close()
+		shutil.rmtree(cls.dir)
+
+	def search(self, q, retrievalModel, k, **evaluation):
+		return query.search(q, self.index, self.docLength, retrievalModel, self.N, self.C,
+			self.C / self.N, k, **evaluation)
+
+	def assertSameRanking(self, evaluation, models):
+		for retrievalModel in models:
+			ties = 0
+			for q in QUERIES:
+				for k in KS:
+					with self.subTest(model=retrievalModel, query=q, k=k):
+						expected = self.search(q, retrievalModel, k)
+						self.assertEqual(self.search(q, retrievalModel, k, **evaluation), expected)
+						full = self.search(q, retrievalModel, k + 1)
+						if len(full) > k and full[k][1] == full[k - 1][1]:
+							ties += 1
+			# The k-th document ties with the next one for some of the rankings
+			self.assertGreater(ties, 0, retrievalModel)
+
+	def testMaxScoreMatchesExhaustive(self):
+		self.assertSameRanking({"termBounds": self.termBounds}, ["bm25", "cosine"])
+
+	def testVectorMatchesExhaustive(self):
+		self.assertSameRanking({"docArrays": self.docArrays}, ["bm25", "cosine", "lm"])
+
+	def testTiesGoToEarlierQueryTerm(self):
+		for retrievalModel in ["bm25", "cosine"]:
+			ranking = self.search({"import": 1, "commerce": 1}, retrievalModel, 4)
+			self.assertEqual([docid for docid, score in ranking], [2, 3, 0, 1])
+
+	def testNegativeWeightsAreRanked(self):
+		ranking = self.search({"federal": 1}, "bm25", 5)
+		self.assertTrue(ranking and all(score < 0 for docid, score in ranking))
+
+def exhaustiveImpacts(q, index, termImpacts, k):
+	"""Ranks every document by the sum of its quantized impacts times the
+	query term weights, added highest contribution first as impactSearch
+	adds them; ties go to the lower doc id."""
+	contributions = []
+	queryLen = 0
+	for term in q:
+		if term not in index:
+			continue
+		t_idf = float(index[term].idf)
+		queryLen += pow(q[term] * t_idf,2)
+		if term not in termImpacts:
+			continue
+		if termImpacts.model == "bm25":
+			weight = (((query.bounds.K2 + 1) * q[term]) / (query.bounds.K2 + q[term]))
+		else:
+			weight = q[term] * t_idf
+		if weight <= 0:
+			continue
+		contributions.extend((impact * weight, docids.tolist()) for impact, docids in
+			termImpacts.segments(term))
+	if not contributions:
+		return []
+	contributions.sort(key=lambda contribution: -contribution[0])
+	scores = {}
+	for contribution, docids in contributions:
+		for docid in docids:
+			scores[docid] = scores.get(docid, 0.0) + contribution
+	scale = termImpacts.scale
+	if termImpacts.model == "cosine":
+		scale /= math.sqrt(queryLen)
+	ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+	return [(docid, score * scale) for docid, score in ranked]
+
+class ImpactSearchTest(unittest.TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		cls.dir = tempfile.mkdtemp()
+		cls.indexPath = buildIndex(cls.dir, "--impacts", "bm25,cosine")
+		cls.index = query.getIndex(cls.indexPath, "single")
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.index.close()
+		shutil.rmtree(cls.dir)
+
+	def testMatchesExhaustiveRankingOfImpacts(self):
+		for retrievalModel in ["bm25", "cosine"]:
+			termImpacts = query.getImpacts(self.indexPath, "single", retrievalModel, self.index)
+			settled = 0
+			for q in QUERIES:
+				total = sum(len(docids) for term in q if term in termImpacts
+					for impact, docids in termImpacts.segments(term))
+				for k in KS:
+					with self.subTest(model=retrievalModel, query=q, k=k):
+						ranking, read = query.impactSearch(q, self.index, termImpacts, k)
+						self.assertEqual(ranking, exhaustiveImpacts(q, self.index, termImpacts, k))
+						if read < total:
+							settled += 1
+			# Some of the rankings were settled before every posting was read
+			self.assertGreater(settled, 0, retrievalModel)
+			termImpacts.close()
+
+if __name__== "__main__":
+	unittest.main()
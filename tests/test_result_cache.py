@@ -0,0 +1,112 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ranking-and-retrieval"))
+import result_cache
+from result_cache import ResultCache, entrySize, resultKey
+
+def key(term, indexType="single", generation=1):
+	return resultKey({term: 1}, "bm25", indexType, 10, "exhaustive", None, generation)
+
+RESULTS = [(3, 2.5), (1, 1.25), (7, 0.5)]
+
+class ResultCacheTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tempDir = tempfile.mkdtemp()
+		self.path = os.path.join(self.tempDir, "cache.json")
+
+	def tearDown(self):
+		shutil.rmtree(self.tempDir)
+
+	def testEvictsLeastRecentlyUsedOverByteBound(self):
+		size = entrySize(key("a"), RESULTS)
+		cache = ResultCache(3 * size)
+		for term in "abc":
+			cache.put(key(term), RESULTS)
+		self.assertEqual(cache.bytes, 3 * size)
+		self.assertEqual(cache.get(key("a")), RESULTS)
+		cache.put(key("d"), RESULTS)
+		self.assertEqual(len(cache), 3)
+		self.assertNotIn(key("b"), cache)
+		for term in "acd":
+			self.assertIn(key(term), cache)
+		self.assertEqual(cache.bytes, 3 * size)
+		self.assertEqual(cache.evictions, 1)
+
+	def testReplacingAnEntryKeepsItsBytes(self):
+		cache = ResultCache(1 << 20)
+		cache.put(key("a"), RESULTS)
+		cache.put(key("a"), RESULTS[:1])
+		self.assertEqual(len(cache), 1)
+		self.assertEqual(cache.bytes, entrySize(key("a"), RESULTS[:1]))
+
+	def testRankingLargerThanBoundIsNotKept(self):
+		cache = ResultCache(entrySize(key("a"), RESULTS) - 1)
+		cache.put(key("a"), RESULTS)
+		self.assertEqual(len(cache), 0)
+		self.assertEqual(cache.bytes, 0)
+		self.assertEqual(cache.get(key("a")), None)
+		self.assertEqual(cache.misses, 1)
+
+	def testInvalidateDropsOtherGenerationsOfIndexType(self):
+		cache = ResultCache()
+		cache.put(key("a", "single", 1), RESULTS)
+		cache.put(key("b", "single", 2), RESULTS)
+		cache.put(key("c", "stem", 1), RESULTS)
+		self.assertEqual(cache.invalidate("single", 2), 1)
+		self.assertNotIn(key("a", "single", 1), cache)
+		self.assertIn(key("b", "single", 2), cache)
+		self.assertIn(key("c", "stem", 1), cache)
+		self.assertEqual(cache.bytes, 2 * entrySize(key("b"), RESULTS))
+		self.assertEqual(cache.invalidated, 1)
+
+	def testLoadKeepsCurrentGenerations(self):
+		cache = ResultCache()
+		cache.put(key("a", "single", 1), RESULTS)
+		cache.put(key("b", "single", 2), RESULTS)
+		cache.put(key("c", "stem", 1), RESULTS)
+		cache.put(key("d", "phrase", 5), RESULTS)
+		cache.save(self.path)
+
+		loaded = ResultCache()
+		self.assertEqual(loaded.load(self.path, {"single": 2, "stem": 1}), 3)
+		self.assertEqual(loaded.invalidated, 1)
+		self.assertNotIn(key("a", "single", 1), loaded)
+		# Index types that are not given keep every generation
+		self.assertEqual(loaded.get(key("d", "phrase", 5)), RESULTS)
+		self.assertEqual(loaded.get(key("b", "single", 2)), RESULTS)
+		self.assertEqual(loaded.get(key("c", "stem", 1)), RESULTS)
+
+	def testLoadKeepsRecencyOrder(self):
+		cache = ResultCache()
+		for term in "abc":
+			cache.put(key(term), RESULTS)
+		cache.get(key("a"))
+		cache.save(self.path)
+		loaded = ResultCache(3 * entrySize(key("a"), RESULTS))
+		loaded.load(self.path, {})
+		loaded.put(key("d"), RESULTS)
+		self.assertNotIn(key("b"), loaded)
+		self.assertIn(key("a"), loaded)
+
+	def testLoadIgnoresMissingOrOtherVersionFiles(self):
+		cache = ResultCache()
+		self.assertEqual(cache.load(self.path, {}), 0)
+		with open(self.path, "w") as f:
+			json.dump({"version": result_cache.CACHE_VERSION + 1, "entries": []}, f)
+		self.assertEqual(cache.load(self.path, {}), 0)
+		with open(self.path, "w") as f:
+			f.write("{")
+		self.assertEqual(cache.load(self.path, {}), 0)
+		self.assertEqual(len(cache), 0)
+
+if __name__== "__main__":
+	unittest.main()
@@ -0,0 +1,231 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "preprocessing"))
+import nltk
+import tokenizer
+import trec
+from tokenizer import normalize, normalizeDate
+
+STOPS = set(["the", "of", "and", "a", "to", "in"])
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+# Every SAMPLE-th line of the Federal Register files is checked, which keeps
+# the baseline cascade under a second and still covers every file
+SAMPLE = 7
+
+# Lines that exercise each special token pattern and the ways they overlap
+LINES = [
+	"",
+	"plain words without any special token",
+	# Dates
+	"Effective January 5, 1994 and Feb 29, 1996 the rule applies.",
+	"Dated 12/31/1993, 02-30-1994, 13/01/1994, 1/2/03 and 4-5-17.",
+	"Aug 3, 1990 or Dec. 25, 1995 or May 1, 2020, not Mayday 1, 1990.",
+	"The 6/30/1995 deadline, extended from 06-30-95 to 7/1/1995.",
+	# Emails
+	"Send comments to john.doe+fr@agency-name.gov or jane_doe@epa.gov.",
+	"Contact EPA-Docket@epa.gov (the docket) by 3/4/1994.",
+	# IP addresses
+	"Hosts 192.168.10.254 and 10.20.30.40 but not 1.2.3.4 or 1234.5.6.7.",
+	# URLs
+	"See http://www.access.gpo.gov/su_docs/aces/aces140.html for the text.",
+	"Also https://example.com/a-b/c?d=1,2&e=3 and http://10.0.0.1/x.pdf too.",
+	# Hyphenated, alpha-digit and digit-alpha tokens
+	"The co-operate pre-existing state-of-the-art F-16 and 1-800 lines.",
+	"CDC-1 B-52 ABC-123 5-year 10-day a-b x-ray non-profit ex-officio.",
+	"well-known long-term re-evaluate anti-dumping un-do mid-year.",
+	# Abbreviations and acronyms
+	"The U.S. EPA and the FDA, U.S.A. and Ph.D. holders, NW. and US.",
+	"OMB approved it; NOAA, DOT, and the FAA (Sec. 5) concur.",
+	# File extensions
+	"Files report.pdf, FIGURE1.GIF, index.html, memo.DOC and photo.jpg.",
+	"A .pdf without a name and notes.txt which is not an extension.",
+	# Digits with commas, decimals and currency
+	"Costs of $1,234.56 and $12.5 million, §1.5 and 3.14159 units.",
+	"Totals 1,000,000 and 2,500 tons; 0.5 percent; $.75 each.",
+	# Several patterns on one line, and patterns inside one another
+	"On 1/2/1994 EPA-HQ-OAR-2003-0190 was filed at http://epa.gov/a-b.html by x@y.gov.",
+	"The 12-31-1994 and 12.31.1994 dates, 10.1.1.1 and 3.5-inch disks.",
+	"U.S.-Canada trade, 1.5-liter engines, and OMB-approved form 10-K.",
+	"Version 2.0-beta of file-name.PDF from ftp-site@host-name.org.",
+	"$2.5-$3.5 billion in FY-1995, Jan 15, 1995-Feb 1, 1995.",
+	"&hyph; AB-12-CD and 1994-95 and 05/06/07/08 and 1/2/3/4/5.",
+]
+
+# Lines without '.', '?' or '!', which nltk.word_tokenize treats as one
+# sentence, so neither side needs the Punkt models
+WORD_LINES = [
+	"",
+	"   ",
+	"word",
+	"two words",
+	"The agency's rule doesn't apply; they'll say it won't and can't",
+	"I'm sure we'd've gone, y'all ain't gonna wanna lemme gimme",
+	"He said \"export control\" and 'federal register' then \u201cquoted\u201d text",
+	"``already quoted'' and \"\" empty quotes and 'tis the season",
+	"Costs of $1,234 (and 5,000 tons) at 10:30 on 3/4/94 -- or 12:00, not 1:2",
+	"Sections 5-7 [see note] {braces} <angle> & 50% #1 @home a*b",
+	"trailing comma, and colon: and semicolon; then-hyphen -- double--dash",
+	"Mr O'Neil's and the users' files plus rock 'n' roll",
+	"tab\tseparated\twords  and   multiple   spaces",
+	"Unicode caf\u00e9 na\u00efve \u00a7 1 and \u2022 bullets",
+]
+
+def baselineSpecialTokens(line, stops):
+	"""findSpecialTokens as the original build.py applied it: one pattern
+	after another, each removing its matches before the next runs.
+	Returns:
+	    (list of tokens in the order they were added, line with special
+	    tokens removed)
+	"""
+	tokens = []
+
+	# Email
+	email = re.compile(r'([a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+)')
+	if len(email.findall(line)) > 0:
+		for token in email.findall(line):
+			token = normalize(token)
+			tokens.append(token)
+		line = email.sub('', line)
+
+	# IP Address
+	ip = re.compile(r'\b(?:\d{2,3}\.){3}\d{2,3}\b')
+	if len(ip.findall(line)) > 0:
+		for token in ip.findall(line):
+			token = normalize(token)
+			tokens.append(token)
+		line = ip.sub('', line)
+
+	# Abbreviations and Acronyms
+	abbrev = re.compile(r'\b[A-Z][a-zA-Z\.]{,1}[A-Z]\b\.?')
+	if len(abbrev.findall(line)) > 0:
+		for token in abbrev.findall(line):
+			token = normalize(token)
+			token = normalize(token).replace('.', '')
+			tokens.append(token)
+		line = abbrev.sub('', line)
+
+	# Date
+	date = re.compile(r'(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sept|Oct|Nov|Dec[.]?|January|February|March|April|May|June|July|August|September|October|November|December)\s(\d+),\s(\d+)|((\d+)(?:/|-)(\d+)(?:/|-)(\d+))')
+	if len(date.findall(line)) > 0:
+		for token in date.findall(line):
+			token = normalizeDate(token)
+			if token != None:
+				tokens.append(token)
+		line = date.sub('', line)
+
+	# Decimal and Currency
+	decimal = re.compile(r'(§|\$)*(\d+\.\d+)')
+	if len(decimal.findall(line)) > 0:
+		for token in decimal.findall(line):
+			token = token[0] + str(int(round(float(token[1]))))
+			tokens.append(token)
+		line = decimal.sub('', line)
+
+	#Hyphenated, Alpha-Digit, and Digit-Alpha terms
+	hyphen = re.compile(r'(((\w+)-)+(\w+))')
+	prefixes = set(['a', 'an', 'ante', 'anti', 'auto', 'circum', 'co', 'com',
+	'con', 'contra', 'de', 'dis', 'en', 'ex', 'extra', 'hetero', 'homo',
+	'inter', 'intra','kilo', 'macro', 'micro', 'milli', 'non', 'pico', 'pseudo',
+	'pre', 'post', 're', 'sub', 'syn', 'trans', 'tri', 'un', 'uni', 'ultra'])
+
+	if len(hyphen.findall(line)) > 0:
+		for token in hyphen.findall(line):
+			token = normalize(token[0])
+			split = token.split("-")
+			if len(split) == 2 and split[0].isalpha() and split[1].isdigit():
+				# Requirement: alphabets stored as a separate term if 3+ letters
+				if len(split[0]) >= 3:
+					tokens.append(normalize(split[0]))
+			elif len(split) == 2 and split[0].isdigit() and split[1].isalpha():
+				if len(split[1]) >= 3:
+					tokens.append(split[1])
+			elif split[0] in prefixes:
+				tokens.append(split[1])
+			else:
+				for s in split:
+						if s not in stops:
+							tokens.append(s)
+			token = token.replace("-", "")
+			tokens.append(token)
+		line = hyphen.sub('', line)
+
+	# URL
+	url = re.compile(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+')
+	if len(url.findall(line)) > 0:
+		for token in url.findall(line):
+			tokens.append(token)
+		line = url.sub('', line)
+
+	# File Extension
+	fileext = re.compile(r'(\w*)\.(jpg|JPG|gif|GIF|doc|DOC|pdf|PDF|html|HTML)')
+	if len(fileext.findall(line)) > 0:
+		for token in fileext.findall(line):
+			tokens.append(token)
+		line = fileext.sub('', line)
+	return tokens, line
+
+def dataLines():
+	"""Every SAMPLE-th non-empty line of the data/fr* documents, as preProcess
+	sees it."""
+	lines = []
+	for f in sorted(os.listdir(DATA_DIR)):
+		if f.startswith("fr"):
+			for docID, text in trec.readTrecDocs(os.path.join(DATA_DIR, f)):
+				lines.extend(tokenizer.replaceEscSeq(line) for line in filter(None, text.splitlines()))
+	return lines[::SAMPLE]
+
+def outcome(scan, line, stops):
+	"""Result of a scan, or the exception it raised (normalizeDate raises on
+	some dates in both implementations)."""
+	try:
+		return scan(line, stops)
+	except Exception as e:
+		return type(e)
+
+class WordTokensTest(unittest.TestCase):
+
+	def testMatchesWordTokenize(self):
+		for line in WORD_LINES:
+			self.assertEqual(tokenizer.SENTENCE_END.search(line), None)
+			with self.subTest(line=line):
+				self.assertEqual(tokenizer.wordTokens(line), nltk.word_tokenize(line, preserve_line=True))
+
+class SpecialTokensTest(unittest.TestCase):
+
+	def assertMatchesBaseline(self, scan):
+		for line in LINES:
+			line = tokenizer.replaceEscSeq(line)
+			with self.subTest(line=line):
+				self.assertEqual(scan(line, STOPS), baselineSpecialTokens(line, STOPS))
+
+	def testCascadeMatchesBaseline(self):
+		self.assertMatchesBaseline(tokenizer.scanSpecialTokensCascade)
+
+	def testSinglePassMatchesBaseline(self):
+		self.assertMatchesBaseline(tokenizer.scanSpecialTokens)
+
+	def testEveryPatternIsExercised(self):
+		found = set()
+		for line in LINES:
+			found.update(k for k, pattern in enumerate(tokenizer.PATTERNS) if pattern.search(line))
+		self.assertEqual(found, set(range(len(tokenizer.SPECIAL_TOKENS))))
+
+	@unittest.skipUnless(os.path.isdir(DATA_DIR), "no data directory")
+	def testSinglePassMatchesBaselineOnData(self):
+		with open(os.path.join(DATA_DIR, "stops.txt")) as f:
+			stops = set([x.strip() for x in f.readlines()])
+		lines = dataLines()
+		self.assertGreater(len(lines), 0)
+		mismatches = [line for line in lines
+			if outcome(tokenizer.scanSpecialTokens, line, stops) != outcome(baselineSpecialTokens, line, stops)]
+		self.assertEqual(mismatches[:5], [])
+
+if __name__== "__main__":
+	unittest.main()